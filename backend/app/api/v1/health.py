@@ -1,7 +1,11 @@
 """Health check endpoints."""
+from typing import Dict, Optional
+
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from app.config import settings
+from app.services.model_warmup import model_warmup
 
 router = APIRouter(tags=["health"])
 
@@ -13,9 +17,16 @@ class HealthResponse(BaseModel):
     service: str
 
 
+class ReadinessResponse(HealthResponse):
+    """Readiness check response."""
+    models: Dict[str, str]
+    startup_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint."""
+    """Health check endpoint. Answers as soon as the process is up."""
     return HealthResponse(
         status="healthy",
         version=settings.APP_VERSION,
@@ -23,12 +34,22 @@ async def health_check():
     )
 
 
-@router.get("/ready", response_model=HealthResponse)
+@router.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
 async def readiness_check():
-    """Readiness check endpoint."""
-    # Could add database/model checks here
-    return HealthResponse(
-        status="ready",
+    """
+    Readiness check endpoint.
+    
+    Returns 200 once the preloaded models are loaded and warmed up, and 503
+    with status "pending", "loading" or "failed" until then.
+    """
+    response = ReadinessResponse(
+        status=model_warmup.state,
         version=settings.APP_VERSION,
-        service=settings.APP_NAME
+        service=settings.APP_NAME,
+        models=model_warmup.models,
+        startup_seconds=round(model_warmup.startup_seconds, 3) if model_warmup.startup_seconds else None,
+        error=model_warmup.error,
     )
+    if not model_warmup.ready:
+        return JSONResponse(response.model_dump(), status_code=503)
+    return response
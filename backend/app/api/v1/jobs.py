@@ -0,0 +1,254 @@
+"""Batch job API endpoints."""
+import io
+import zipfile
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Header
+from fastapi.responses import StreamingResponse
+from PIL import Image
+from pydantic import BaseModel
+
+from app.config import settings
+from app.services.background_remover import InvalidOptions, parse_options
+from app.services.image_io import ImageTooLarge, check_megapixels
+from app.services.credits import Balance, credit_ledger
+from app.services.jobs import ITEM_FAILED, PRIORITY_FREE, PRIORITY_PAID, job_manager
+from app.services.rate_limiter import check_rate_limit
+from app.services.uploads import ALLOWED_FORMATS, UploadTooLarge, read_upload
+from app.metrics import uploaded_file_bytes
+
+router = APIRouter(prefix="/api/v1/jobs", tags=["jobs"])
+
+
+class JobItemResponse(BaseModel):
+    """Status of one image in a job."""
+    index: int
+    filename: str
+    status: str
+    error: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    """Job status response."""
+    id: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    items: List[JobItemResponse]
+    results_url: str
+
+
+def _job_response(job) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        status=job.status,
+        total=len(job.items),
+        completed=job.completed,
+        failed=job.failed,
+        items=[JobItemResponse(**item.__dict__) for item in job.items],
+        results_url=f"/api/v1/jobs/{job.id}/results",
+    )
+
+
+def _job_priority(balance: Balance) -> int:
+    """Queue priority for a device's jobs. Paid jobs are served first."""
+    return PRIORITY_PAID if balance.usable else PRIORITY_FREE
+
+
+def _has_allowed_extension(filename: str) -> bool:
+    return "." in filename and filename.rsplit(".", 1)[-1].lower() in settings.ALLOWED_EXTENSIONS
+
+
+def _validate_image(filename: str, data: bytes):
+    """Check an image's format and pixel count from its header."""
+    try:
+        image = Image.open(io.BytesIO(data))
+    except (OSError, SyntaxError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid or unsupported image: {filename}")
+    if image.format not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid or unsupported image: {filename}")
+    try:
+        check_megapixels(image.width, image.height, settings.MAX_MEGAPIXELS)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=400, detail=f"{filename}: {e}")
+
+
+def _extract_zip(data: bytes, max_images: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    Read the images from a zip archive.
+    
+    Directories, hidden files and files without an image extension are
+    skipped. Entry sizes are checked before decompressing so a small
+    archive can't expand into something huge.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
+        
+    images = []
+    with archive:
+        for info in archive.infolist():
+            basename = info.filename.rsplit("/", 1)[-1]
+            if info.is_dir() or not basename or basename.startswith(".") \
+                    or info.filename.startswith("__MACOSX/") or not _has_allowed_extension(basename):
+                continue
+            if len(images) >= max_images:
+                raise HTTPException(status_code=400, detail=f"Too many images. Maximum: {max_images}")
+            if info.file_size > max_bytes:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large: {basename}. Maximum size: {settings.MAX_FILE_SIZE_MB}MB"
+                )
+            images.append((info.filename, archive.read(info)))
+    return images
+
+
+@router.post("", response_model=JobResponse, status_code=202)
+async def create_job(
+    files: List[UploadFile] = File(...),
+    x_device_id: str = Header(..., alias="X-Device-ID"),
+    quality: Optional[str] = Form(None),
+    model: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    region: Optional[str] = Form(None),
+    crop: Optional[bool] = Form(None),
+):
+    """
+    Submit images for background removal in the background.
+    
+    Accepts one or more images, or zip archives of images, as `files`.
+    Takes the same `quality`, `model`, `output_format`, `region` and
+    `crop` fields as /api/v1/remove-bg. Returns immediately with a job
+    id; poll GET /api/v1/jobs/{id} for progress and download the results as a
+    zip from GET /api/v1/jobs/{id}/results.
+    
+    Every image counts as one use against the device's daily limit.
+    """
+    try:
+        options = parse_options(quality, model, output_format, region, crop)
+    except InvalidOptions as e:
+        raise HTTPException(status_code=400, detail=str(e))
+        
+    max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    images: List[Tuple[str, bytes]] = []
+    for file in files:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="Filename is required")
+        ext = file.filename.rsplit(".", 1)[-1].lower()
+        if ext == "zip":
+            try:
+                data = await read_upload(file, settings.JOB_MAX_UPLOAD_MB * 1024 * 1024)
+            except UploadTooLarge:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Archive too large. Maximum size: {settings.JOB_MAX_UPLOAD_MB}MB"
+                )
+            images.extend(_extract_zip(data, settings.JOB_MAX_IMAGES - len(images), max_bytes))
+        elif ext in settings.ALLOWED_EXTENSIONS:
+            try:
+                images.append((file.filename, await read_upload(file, max_bytes)))
+            except UploadTooLarge:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large: {file.filename}. Maximum size: {settings.MAX_FILE_SIZE_MB}MB"
+                )
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File type not allowed. Supported: {', '.join(settings.ALLOWED_EXTENSIONS)}, zip"
+            )
+            
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found")
+    if len(images) > settings.JOB_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images. Maximum: {settings.JOB_MAX_IMAGES}")
+    for filename, data in images:
+        _validate_image(filename, data)
+        uploaded_file_bytes.observe(len(data))
+        
+    # Reject up front if the batch can't fit in paid credits plus today's free uses
+    allowed, remaining, reset_at = await check_rate_limit(x_device_id)
+    balance = await credit_ledger.balance(x_device_id, fresh=True)
+    if not balance.unlimited and remaining + balance.credits < len(images):
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "rate_limit_exceeded",
+                "message": f"{len(images)} images requested but only {remaining + balance.credits} uses left",
+                "reset_at": reset_at,
+                "upgrade_url": "/pricing"
+            }
+        )
+        
+    job = await job_manager.submit(x_device_id, images, options, priority=_job_priority(balance))
+    return _job_response(job)
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Get a job's status and per-image progress."""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+
+class _ZipSink:
+    """Write-only, unseekable buffer that ZipFile streams entries into."""
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+        
+    def flush(self):
+        pass
+        
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+@router.get("/{job_id}/results")
+async def get_job_results(job_id: str):
+    """
+    Download a job's results as a zip.
+    
+    The archive is streamed: each image is written as soon as it finishes,
+    so the download can start before the job is done. Images that failed
+    appear as errors/<name>.txt with the reason.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+        
+    async def stream():
+        sink = _ZipSink()
+        # Outputs are already compressed; storing avoids spending CPU twice
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+            async for item in job_manager.iter_finished(job_id):
+                result = None
+                if item.status != ITEM_FAILED:
+                    # None if the job expired while the archive was being streamed
+                    result = await job_manager.load_result(job_id, item.index)
+                if result is None:
+                    name = item.filename.rsplit("/", 1)[-1]
+                    archive.writestr(
+                        f"errors/{item.index + 1:03d}_{name}.txt",
+                        (item.error or "Failed") if item.status == ITEM_FAILED else "Result is no longer available",
+                    )
+                else:
+                    archive.writestr(item.output_filename(job.options.output_format), result)
+                yield sink.drain()
+        yield sink.drain()
+        
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=bggone_{job_id}.zip"},
+    )
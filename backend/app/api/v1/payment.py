@@ -1,4 +1,5 @@
 """Creem payment integration endpoints."""
+import asyncio
 import os
 import json
 import hmac
@@ -6,9 +7,11 @@ import hashlib
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Header, Request
 from pydantic import BaseModel
-import requests
 
 from app.config import settings
+from app.services.credits import credit_ledger
+from app.services.upstream import CircuitBreaker, CircuitOpen, RetryBudget, UpstreamClient, UpstreamError
+from app.services.webhooks import WebhookProcessor, event_key, webhook_journal
 from app.metrics import (
     payment_checkout_created,
     payment_success,
@@ -23,6 +26,19 @@ router = APIRouter(prefix="/api/v1/payment", tags=["payment"])
 # Creem API configuration
 CREEM_API_BASE = "https://api.creem.io" if not settings.CREEM_API_KEY.startswith("creem_test_") else "https://test-api.creem.io"
 
+# Shared by all requests; started and closed by the app lifespan
+creem_client = UpstreamClient(
+    "creem",
+    CREEM_API_BASE,
+    headers={"Authorization": f"Bearer {settings.CREEM_API_KEY}"},
+    timeout=settings.CREEM_TIMEOUT_SECONDS,
+    connect_timeout=settings.CREEM_CONNECT_TIMEOUT_SECONDS,
+    max_connections=settings.CREEM_MAX_CONNECTIONS,
+    max_retries=settings.CREEM_MAX_RETRIES,
+    breaker=CircuitBreaker("creem", settings.CREEM_CIRCUIT_FAILURES, settings.CREEM_CIRCUIT_RESET_SECONDS),
+    budget=RetryBudget(settings.CREEM_RETRY_BUDGET_RATIO),
+)
+
 # Product configurations (based on competitor pricing analysis)
 # remove.bg charges $0.225/image, we charge $0.035-0.06 (70-82% cheaper)
 PRODUCTS = {
@@ -47,6 +63,13 @@ class CheckoutResponse(BaseModel):
     checkout_id: str
 
 
+class CreditsResponse(BaseModel):
+    """Paid credit balance."""
+    credits: int
+    unlimited: bool
+    unlimited_until: int
+
+
 @router.post("/create-checkout", response_model=CheckoutResponse)
 async def create_checkout(request: CheckoutRequest):
     """Create a Creem checkout session."""
@@ -67,14 +90,12 @@ async def create_checkout(request: CheckoutRequest):
     except json.JSONDecodeError:
         raise HTTPException(status_code=503, detail="Invalid product configuration")
     
-    # Create checkout via Creem API
+    # Create checkout via Creem API. Retrying is safe: an unused checkout session is harmless
     try:
-        response = requests.post(
-            f"{CREEM_API_BASE}/v1/checkouts",
-            headers={
-                "Authorization": f"Bearer {settings.CREEM_API_KEY}",
-                "Content-Type": "application/json",
-            },
+        response = await creem_client.request(
+            "POST",
+            "/v1/checkouts",
+            idempotent=True,
             json={
                 "product_id": creem_product_id,
                 "success_url": request.success_url,
@@ -85,9 +106,7 @@ async def create_checkout(request: CheckoutRequest):
                     "tool": TOOL_NAME,
                 },
             },
-            timeout=30,
         )
-        response.raise_for_status()
         data = response.json()
         
         # Record metric
@@ -98,10 +117,27 @@ async def create_checkout(request: CheckoutRequest):
             checkout_id=data["id"],
         )
         
-    except requests.RequestException as e:
+    except CircuitOpen as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Payment provider unavailable, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except (UpstreamError, ValueError, KeyError) as e:
         raise HTTPException(status_code=502, detail=f"Payment provider error: {str(e)}")
 
 
+@router.get("/credits", response_model=CreditsResponse)
+async def get_credits(x_device_id: str = Header(..., alias="X-Device-ID")):
+    """Paid credits left for a device (read straight from the ledger)."""
+    balance = await credit_ledger.balance(x_device_id, fresh=True)
+    return CreditsResponse(
+        credits=balance.credits,
+        unlimited=balance.unlimited,
+        unlimited_until=balance.unlimited_until,
+    )
+
+
 def verify_webhook_signature(payload: bytes, signature: str) -> bool:
     """Verify Creem webhook signature."""
     if not settings.CREEM_WEBHOOK_SECRET:
@@ -121,19 +157,35 @@ async def handle_creem_webhook(
     request: Request,
     x_creem_signature: str = Header(None, alias="X-Creem-Signature"),
 ):
-    """Handle Creem payment webhooks."""
+    """
+    Receive Creem payment webhooks.
+    
+    Verified events are journaled and acknowledged straight away; the
+    webhook processor applies them in the background.
+    """
     payload = await request.body()
     
     # Verify signature
-    if x_creem_signature and not verify_webhook_signature(payload, x_creem_signature):
+    if not x_creem_signature or not verify_webhook_signature(payload, x_creem_signature):
         payment_webhook_received.labels(tool=TOOL_NAME, event_type="unknown", status="invalid_signature").inc()
         raise HTTPException(status_code=401, detail="Invalid signature")
     
     try:
         event = json.loads(payload)
-    except json.JSONDecodeError:
+        key = event_key(event)
+    except (json.JSONDecodeError, AttributeError, ValueError):
         raise HTTPException(status_code=400, detail="Invalid JSON")
+        
+    event_type = str(event.get("type", "unknown"))
+    await asyncio.to_thread(webhook_journal.append, key, event_type, payload)
+    payment_webhook_received.labels(tool=TOOL_NAME, event_type=event_type, status="queued").inc()
+    webhook_processor.notify()
     
+    return {"received": True}
+
+
+async def apply_webhook_event(event: dict):
+    """Apply one journaled webhook event (called by the webhook processor)."""
     event_type = event.get("type", "unknown")
     
     if event_type == "checkout.completed":
@@ -141,8 +193,6 @@ async def handle_creem_webhook(
         payment_webhook_received.labels(tool=TOOL_NAME, event_type=event_type, status="success").inc()
     else:
         payment_webhook_received.labels(tool=TOOL_NAME, event_type=event_type, status="ignored").inc()
-    
-    return {"received": True}
 
 
 async def handle_checkout_completed(event: dict):
@@ -162,11 +212,41 @@ async def handle_checkout_completed(event: dict):
     if not product:
         return
     
+    # Creem redelivers webhooks; the order id makes crediting idempotent
+    order_id = (data.get("order") or {}).get("id") or data.get("id") or event.get("id")
+    if not order_id:
+        return
+        
+    unlimited = product["credits"] < 0
+    # A database error propagates to the webhook processor, which keeps the
+    # event in the journal and applies it again on a later pass
+    granted = await credit_ledger.grant(
+        device_id,
+        str(order_id),
+        product_sku,
+        credits=0 if unlimited else product["credits"],
+        unlimited_days=settings.UNLIMITED_PLAN_DAYS if unlimited else 0,
+        amount_cents=amount_cents,
+        currency=currency,
+    )
+    if not granted:
+        print(f"Payment already credited: order {order_id}")
+        return
+        
     # Record payment metrics
     payment_success.labels(tool=TOOL_NAME, product_sku=product_sku, currency=currency).inc()
     payment_revenue_cents.labels(tool=TOOL_NAME, product_sku=product_sku, currency=currency).inc(amount_cents)
     tokens_created.labels(tool=TOOL_NAME, product_sku=product_sku).inc()
     
-    # TODO: Create token in database
-    # For now, we log the successful payment
     print(f"Payment completed: {product_sku} for device {device_id}, {amount_cents} {currency}")
+
+
+webhook_processor = WebhookProcessor(
+    webhook_journal,
+    credit_ledger,
+    apply_webhook_event,
+    batch_size=settings.WEBHOOK_BATCH_SIZE,
+    window=settings.WEBHOOK_BATCH_WINDOW_MS / 1000,
+    retry_interval=settings.WEBHOOK_RETRY_INTERVAL_SECONDS,
+    max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+)
@@ -1,17 +1,51 @@
 """Background removal API endpoints."""
-import io
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header
-from fastapi.responses import StreamingResponse
+import asyncio
+import base64
+import json
+import time
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
 
 from app.config import settings
-from app.services.background_remover import remove_background, get_image_info
-from app.services.rate_limiter import check_rate_limit, record_usage
-from app.metrics import file_size_bytes, TOOL_NAME
+from app.services.background_remover import (
+    PREVIEW_OPTIONS,
+    InvalidOptions,
+    RemovalOptions,
+    parse_options,
+    remove_background,
+    remove_background_cached,
+)
+from app.services.cancellation import DeadlineExceeded
+from app.services.encoding import OUTPUT_FORMATS
+from app.services.image_io import ImageTooLarge, check_megapixels
+from app.services.inference_pool import InferenceQueueFull
+from app.services.profiling import profiling_requested, should_dump_profile
+from app.services.credits import Charge, charge_use, credit_ledger, refund_use
+from app.services.rate_limiter import check_rate_limit
+from app.services.timing import StageTimings
+from app.services.uploads import (
+    ALLOWED_FORMATS,
+    InvalidImage,
+    UploadTooLarge,
+    read_upload,
+    sniff_image_header,
+    upload_size,
+)
+from app.services.model_registry import model_registry
+from app.metrics import (
+    abandoned_on_deadline,
+    abandoned_on_disconnect,
+    preview_latency,
+    progressive_result_latency,
+    uploaded_file_bytes,
+)
 
 router = APIRouter(prefix="/api/v1", tags=["background-removal"])
 
+T = TypeVar("T")
+
 
 class RateLimitResponse(BaseModel):
     """Rate limit status response."""
@@ -32,7 +66,7 @@ class ImageInfoResponse(BaseModel):
 @router.get("/rate-limit", response_model=RateLimitResponse)
 async def get_rate_limit(x_device_id: str = Header(..., alias="X-Device-ID")):
     """Check current rate limit status for a device."""
-    allowed, remaining, reset_at = check_rate_limit(x_device_id)
+    allowed, remaining, reset_at = await check_rate_limit(x_device_id)
     return RateLimitResponse(
         allowed=allowed,
         remaining=remaining,
@@ -41,30 +75,220 @@ async def get_rate_limit(x_device_id: str = Header(..., alias="X-Device-ID")):
     )
 
 
+def _rate_limit_exceeded(reset_at: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "rate_limit_exceeded",
+            "message": f"Daily limit of {settings.FREE_DAILY_LIMIT} free uses reached",
+            "reset_at": reset_at,
+            "upgrade_url": "/pricing"
+        }
+    )
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its result was ready."""
+
+
+def _request_deadline(timeout_header: Optional[str]) -> Optional[float]:
+    """
+    Deadline (time.monotonic()) for a removal request.
+    
+    The client may ask for a shorter or longer one with an X-Request-Timeout
+    header in seconds, up to REQUEST_TIMEOUT_MAX_SECONDS. Otherwise it's
+    REQUEST_TIMEOUT_SECONDS from now, or none if that's 0.
+    """
+    timeout = settings.REQUEST_TIMEOUT_SECONDS
+    if timeout_header is not None:
+        try:
+            timeout = float(timeout_header)
+        except ValueError:
+            timeout = 0
+        if not timeout > 0:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds")
+        if settings.REQUEST_TIMEOUT_MAX_SECONDS:
+            timeout = min(timeout, settings.REQUEST_TIMEOUT_MAX_SECONDS)
+    return time.monotonic() + timeout if timeout > 0 else None
+
+
+async def _wait_for_disconnect(request: Request):
+    # The body has been read already, so the next message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _unless_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it if the client disconnects first.
+    
+    Raises:
+        ClientDisconnected: If the client went away
+    """
+    work = asyncio.ensure_future(awaitable)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+        if not work.done():
+            work.cancel()
+    if not work.done():
+        raise ClientDisconnected()
+    return work.result()
+
+
+# Refunds started by abandoned progressive requests (kept referenced until done)
+_pending_refunds = set()
+
+
+def _sse(event: str, payload: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+def _usage_fields(charge: Charge) -> dict:
+    if charge.paid:
+        return {"credits_remaining": "unlimited" if charge.credits.unlimited else charge.credits.credits}
+    return {"remaining_uses": charge.free_remaining, "daily_limit": settings.FREE_DAILY_LIMIT}
+
+
+async def _progressive_events(
+    contents: bytes,
+    options: RemovalOptions,
+    filename: str,
+    device_id: str,
+    charge: Charge,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Server-sent events for progressive mode.
+    
+    The full removal and a PREVIEW_MODEL pass on a small copy start
+    together; the preview usually lands within a few hundred milliseconds
+    and is sent as a `preview` event (a grayscale PNG mask the client can
+    apply to the image it already has), then the `result` event carries
+    the finished image. Image data is base64 in the JSON payload. Failures
+    after the stream has started are sent as an `error` event.
+    
+    If the client disconnects or the deadline passes, the removal is
+    abandoned (see remove_background) and the use is refunded.
+    """
+    started = time.perf_counter()
+    output = OUTPUT_FORMATS[options.output_format]
+    result_task = asyncio.ensure_future(remove_background_cached(contents, options, deadline=deadline))
+    tasks = [result_task]
+    if settings.PREVIEW_MODEL in model_registry.available:
+        tasks.append(asyncio.ensure_future(remove_background(contents, PREVIEW_OPTIONS, deadline=deadline)))
+    delivered = answered = False
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        preview_task = tasks[1] if len(tasks) > 1 else None
+        if result_task not in done and preview_task in done and preview_task.exception() is None:
+            preview_latency.observe(time.perf_counter() - started)
+            yield _sse("preview", {
+                "media_type": OUTPUT_FORMATS[PREVIEW_OPTIONS.output_format].media_type,
+                "data": base64.b64encode(preview_task.result()).decode(),
+            })
+            
+        try:
+            result, cache_hit = await result_task
+        except InferenceQueueFull as e:
+            answered = True
+            yield _sse("error", {"status": 503, "error": "server_busy", "retry_after": e.retry_after})
+            return
+        except DeadlineExceeded:
+            abandoned_on_deadline.inc()
+            answered = True
+            yield _sse("error", {"status": 504, "error": "deadline_exceeded"})
+            return
+        except Exception as e:
+            answered = True
+            yield _sse("error", {"status": 500, "detail": f"Failed to process image: {e}"})
+            return
+            
+        if cache_hit and not settings.RESULT_CACHE_CHARGE_HITS:
+            charge = await refund_use(device_id, charge)
+        progressive_result_latency.observe(time.perf_counter() - started)
+        delivered = answered = True
+        yield _sse("result", {
+            "media_type": output.media_type,
+            "filename": f"bggone_{filename.rsplit('.', 1)[0]}.{output.extension}",
+            "cache": "HIT" if cache_hit else "MISS",
+            **_usage_fields(charge),
+            "data": base64.b64encode(result).decode(),
+        })
+    finally:
+        for task in tasks:
+            task.cancel()
+        if not answered:
+            abandoned_on_disconnect.inc()
+        if not delivered:
+            # Shielded: the disconnect that got us here may cancel awaits in this block too
+            refund = asyncio.ensure_future(refund_use(device_id, charge))
+            _pending_refunds.add(refund)
+            refund.add_done_callback(_pending_refunds.discard)
+            try:
+                await asyncio.shield(refund)
+            except asyncio.CancelledError:
+                pass
+
+
 @router.post("/remove-bg")
 async def remove_bg(
+    request: Request,
     file: UploadFile = File(...),
     x_device_id: str = Header(..., alias="X-Device-ID"),
+    quality: Optional[str] = Form(None),
+    model: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    region: Optional[str] = Form(None),
+    crop: Optional[bool] = Form(None),
+    progressive: Optional[bool] = Form(None),
+    x_profile: Optional[str] = Header(None, alias="X-Profile"),
+    x_request_timeout: Optional[str] = Header(None, alias="X-Request-Timeout"),
 ):
     """
     Remove background from an uploaded image.
     
-    Returns the processed image as PNG with transparent background.
-    Rate limited to FREE_DAILY_LIMIT uses per device per day.
+    Returns the processed image with transparent background, as PNG unless
+    another `output_format` is requested.
+    Uses the device's paid credits first, then FREE_DAILY_LIMIT free uses
+    per device per day.
+    
+    The optional `quality` form field trades edge quality for speed:
+    fast (no alpha matting), balanced (matting on a downscaled copy)
+    or best (full-resolution matting). Defaults to DEFAULT_QUALITY.
+    The optional `model` form field picks one of AVAILABLE_MODELS,
+    e.g. u2netp for quick previews. Defaults to DEFAULT_MODEL.
+    The optional `output_format` form field is one of png-fast,
+    png-optimized, webp, webp-lossless or mask (grayscale alpha only).
+    Defaults to DEFAULT_OUTPUT_FORMAT.
+    The optional `region` form field speeds up huge images where the
+    subject covers only part of the frame: roi segments only the area a
+    low-resolution pass found the subject in, tiled also predicts that
+    area's mask in overlapping tiles at higher resolution (for panoramas
+    and scans). `crop=true` returns the image trimmed to the subject
+    instead of the full-size canvas.
+    `progressive=true` answers with a text/event-stream instead: a quick
+    low-resolution `preview` mask, then the `result` (see
+    _progressive_events).
+    
+    With profiling enabled (PROFILING_ENABLED, or an `X-Profile: 1` header)
+    the response carries a Server-Timing header with the stage breakdown.
+    
+    Processing stops when the client disconnects, or with a 504 once the
+    request's deadline passes (REQUEST_TIMEOUT_SECONDS, or the client's
+    `X-Request-Timeout` in seconds); either way the use is refunded.
     """
-    # Check rate limit
-    allowed, remaining, reset_at = check_rate_limit(x_device_id)
-    if not allowed:
-        raise HTTPException(
-            status_code=429,
-            detail={
-                "error": "rate_limit_exceeded",
-                "message": f"Daily limit of {settings.FREE_DAILY_LIMIT} free uses reached",
-                "reset_at": reset_at,
-                "upgrade_url": "/pricing"
-            }
-        )
+    deadline = _request_deadline(x_request_timeout)
     
+    # Check rate limit (cheap early exit; the use is taken atomically below).
+    # The ledger is only asked once the free uses are gone, and then directly
+    # so a purchase made through another worker counts straight away
+    allowed, remaining, reset_at = await check_rate_limit(x_device_id)
+    if not allowed and not await credit_ledger.has_credits(x_device_id, fresh=True):
+        raise _rate_limit_exceeded(reset_at)
+        
     # Validate file extension
     if not file.filename:
         raise HTTPException(status_code=400, detail="Filename is required")
@@ -75,41 +299,118 @@ async def remove_bg(
             status_code=400,
             detail=f"File type not allowed. Supported: {', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
-    
-    # Read file
-    contents = await file.read()
-    file_size = len(contents)
+        
+    # Validate processing options
+    try:
+        options = parse_options(quality, model, output_format, region, crop)
+    except InvalidOptions as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    output = OUTPUT_FORMATS[options.output_format]
     
     # Check file size
     max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
-    if file_size > max_bytes:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE_MB}MB"
-        )
+    file_too_large = HTTPException(
+        status_code=400,
+        detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE_MB}MB"
+    )
+    if upload_size(file) > max_bytes:
+        raise file_too_large
+        
+    # Validate format and pixel count from the header before reading the rest
+    try:
+        header = await sniff_image_header(file)
+        if header.format not in ALLOWED_FORMATS:
+            raise InvalidImage()
+        check_megapixels(header.width, header.height, settings.MAX_MEGAPIXELS)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="Invalid or unsupported image")
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+        
+    # Read file in chunks, stopping as soon as it crosses the size limit
+    try:
+        contents = await read_upload(file, max_bytes)
+    except UploadTooLarge:
+        raise file_too_large
+    file_size = len(contents)
     
     # Record file size metric
-    file_size_bytes.labels(tool=TOOL_NAME).observe(file_size)
+    uploaded_file_bytes.observe(file_size)
     
-    try:
-        # Process image
-        result = await remove_background(contents)
+    # Take one paid credit or free use; concurrent requests can't both spend the last one
+    charge = await charge_use(x_device_id)
+    if not charge.allowed:
+        raise _rate_limit_exceeded(charge.reset_at)
         
-        # Record usage
-        new_remaining = record_usage(x_device_id)
-        
-        # Return as streaming response
+    if progressive:
         return StreamingResponse(
-            io.BytesIO(result),
-            media_type="image/png",
-            headers={
-                "Content-Disposition": f"attachment; filename=bggone_{file.filename.rsplit('.', 1)[0]}.png",
-                "X-Remaining-Uses": str(new_remaining),
-                "X-Daily-Limit": str(settings.FREE_DAILY_LIMIT),
-            }
+            _progressive_events(contents, options, file.filename, x_device_id, charge, deadline),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        
+    profiling = profiling_requested(x_profile)
+    timings = StageTimings(options.quality, options.model)
+    started = time.perf_counter()
+    
+    try:
+        # Process image (identical uploads are served from the result cache)
+        removal = remove_background_cached(
+            contents, options, timings, profile=profiling and should_dump_profile(), deadline=deadline
         )
+        result, cache_hit = await _unless_disconnected(request, removal)
         
+        # Cache hits are free unless configured otherwise
+        if cache_hit and not settings.RESULT_CACHE_CHARGE_HITS:
+            charge = await refund_use(x_device_id, charge)
+            
+        headers = {
+            "Content-Disposition": f"attachment; filename=bggone_{file.filename.rsplit('.', 1)[0]}.{output.extension}",
+            "X-Daily-Limit": str(settings.FREE_DAILY_LIMIT),
+            "X-Cache": "HIT" if cache_hit else "MISS",
+        }
+        if charge.paid:
+            headers["X-Credits-Remaining"] = "unlimited" if charge.credits.unlimited else str(charge.credits.credits)
+        else:
+            headers["X-Remaining-Uses"] = str(charge.free_remaining)
+        if profiling:
+            total = f"total;dur={(time.perf_counter() - started) * 1000:.1f}"
+            headers["Server-Timing"] = ", ".join(filter(None, [timings.server_timing(), total]))
+            
+        # The encoded bytes are the response body as-is (no copy, sent with Content-Length)
+        return Response(
+            content=result,
+            media_type=output.media_type,
+            headers=headers,
+        )
+        
+    except InferenceQueueFull as e:
+        await refund_use(x_device_id, charge)
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "server_busy",
+                "message": "Too many images are being processed, please retry shortly",
+            },
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except DeadlineExceeded:
+        abandoned_on_deadline.inc()
+        await refund_use(x_device_id, charge)
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "error": "deadline_exceeded",
+                "message": "The image could not be processed within the request's time limit",
+            },
+        )
+    except ClientDisconnected:
+        abandoned_on_disconnect.inc()
+        await refund_use(x_device_id, charge)
+        # Nobody is listening; 499 is what proxies log for a client-closed request
+        return Response(status_code=499)
     except Exception as e:
+        await refund_use(x_device_id, charge)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to process image: {str(e)}"
@@ -118,12 +419,18 @@ async def remove_bg(
 
 @router.post("/image-info", response_model=ImageInfoResponse)
 async def get_image_info_endpoint(file: UploadFile = File(...)):
-    """Get information about an uploaded image."""
-    contents = await file.read()
-    info = get_image_info(contents)
+    """
+    Get information about an uploaded image.
+    
+    Answered from the image header alone; the pixels are never decoded.
+    """
+    try:
+        header = await sniff_image_header(file)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="Invalid or unsupported image")
     return ImageInfoResponse(
-        width=info["width"],
-        height=info["height"],
-        format=info["format"] or "unknown",
-        size_bytes=len(contents)
+        width=header.width,
+        height=header.height,
+        format=header.format or "unknown",
+        size_bytes=upload_size(file)
     )
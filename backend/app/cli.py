@@ -0,0 +1,309 @@
+"""
+Bulk background removal without the HTTP server.
+
+Processes a directory (recursively), a glob pattern or a manifest file
+listing one image path per line, using the same pipeline and parameters
+as /api/v1/remove-bg. Work is spread over --processes worker processes
+that each load the model once and keep it warm; ONNX_INTRA_OP_THREADS=0
+divides the CPUs between them as in multi-process serving.
+
+Each result is written to the output directory under the input's
+relative path, with the output format's extension, as soon as it's
+done; inputs that differ only in extension keep theirs in the name.
+Outputs newer than their input are skipped, so an interrupted run picks
+up where it stopped (--force redoes them).
+
+Usage (from backend/):
+    python -m app.cli photos/ -o cutouts/
+    python -m app.cli "catalogue/**/*.jpg" -o cutouts/ --processes 4 --quality fast
+    python -m app.cli --manifest images.txt -o cutouts/ --output-format webp
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from app.config import settings
+from app.services.background_remover import InvalidOptions, RemovalOptions, parse_options, remove_background_sync
+from app.services.encoding import OUTPUT_FORMATS
+
+
+@dataclass(frozen=True)
+class BulkItem:
+    """One input image and where its result goes."""
+    source: str
+    output: str
+
+
+def _is_image(path: str) -> bool:
+    return os.path.isfile(path) and path.rsplit(".", 1)[-1].lower() in settings.ALLOWED_EXTENSIONS
+
+
+def _glob_base(pattern: str) -> str:
+    """The leading part of a glob pattern without wildcards."""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or "."
+
+
+def _same_dir(a: str, b: str) -> bool:
+    return os.path.realpath(a) == os.path.realpath(b)
+
+
+def _is_within(path: str, directory: str) -> bool:
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _expand(source: str, exclude: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """
+    (path, path relative to the source) for each image a source names.
+    
+    When the directory `exclude` is inside a directory or glob source,
+    nothing under it is included.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            if exclude:
+                dirs[:] = [name for name in dirs if not _same_dir(os.path.join(root, name), exclude)]
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if _is_image(path):
+                    yield path, os.path.relpath(path, source)
+    elif glob.has_magic(source):
+        base = _glob_base(source)
+        skip = exclude if exclude and _is_within(exclude, base) and not _same_dir(exclude, base) else None
+        for path in sorted(glob.glob(source, recursive=True)):
+            if _is_image(path) and not (skip and _is_within(path, skip)):
+                yield path, os.path.relpath(path, base)
+    elif _is_image(source):
+        yield source, os.path.basename(source)
+
+
+def read_manifest(path: str) -> List[str]:
+    """Image paths listed in a manifest, relative to its directory (blank and # lines skipped)."""
+    directory = os.path.dirname(path)
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(directory, line) for line in lines if line and not line.startswith("#")]
+
+
+def collect_items(sources: Iterable[str], output_dir: str, options: RemovalOptions) -> List[BulkItem]:
+    """
+    The images named by `sources` (directories, globs or files) and their output paths.
+    
+    Duplicates are dropped, so overlapping sources process each image once,
+    and an output directory inside a source isn't read back as input.
+    Inputs that would share an output name (a.jpg and a.png) keep their
+    own extension in it (a.jpg.png, a.png.png).
+    
+    Raises:
+        ValueError: If two inputs still map to one output (e.g. files with
+            the same name given from different directories), or an output
+            would overwrite its input
+    """
+    extension = OUTPUT_FORMATS[options.output_format].extension
+    found = []
+    seen = set()
+    for source in sources:
+        for path, relative in _expand(source, exclude=output_dir):
+            key = os.path.realpath(path)
+            if key in seen:
+                continue
+            seen.add(key)
+            found.append((path, relative))
+            
+    stems = Counter(os.path.normcase(os.path.splitext(relative)[0]) for _, relative in found)
+    items = []
+    sources_by_output = {}
+    for path, relative in found:
+        if stems[os.path.normcase(os.path.splitext(relative)[0])] > 1:
+            relative = f"{relative}.{extension}"
+        else:
+            relative = f"{os.path.splitext(relative)[0]}.{extension}"
+        output = os.path.join(output_dir, relative)
+        if os.path.realpath(output) == os.path.realpath(path):
+            raise ValueError(f"{path} would be overwritten by its result; choose another output directory")
+        other = sources_by_output.setdefault(os.path.normcase(os.path.realpath(output)), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both be written to {output}")
+        items.append(BulkItem(path, output))
+    return items
+
+
+def is_up_to_date(item: BulkItem) -> bool:
+    """Whether the output exists and is at least as new as its input."""
+    try:
+        return os.path.getmtime(item.output) >= os.path.getmtime(item.source)
+    except OSError:
+        return False
+
+
+def process_item(item: BulkItem, options: dict) -> Tuple[BulkItem, int, Optional[str]]:
+    """
+    Remove the background from one file and write the result.
+    
+    The output is written under a temporary name and renamed, so an
+    interrupted run never leaves a truncated file that looks up to date.
+    
+    Returns:
+        Tuple of (item, input size in bytes, error message or None)
+    """
+    try:
+        with open(item.source, "rb") as f:
+            data = f.read()
+        result = remove_background_sync(data, RemovalOptions(**options))
+        os.makedirs(os.path.dirname(item.output) or ".", exist_ok=True)
+        partial = f"{item.output}.part"
+        with open(partial, "wb") as f:
+            f.write(result)
+        os.replace(partial, item.output)
+        return item, len(data), None
+    except Exception as e:
+        return item, 0, f"{type(e).__name__}: {e}"
+
+
+def _init_worker(model: str):
+    # Load the model before the first file arrives; it stays warm for the whole run
+    from app.services.model_registry import model_registry
+    from app.services.model_warmup import load_and_warm
+    
+    load_and_warm(model_registry, model)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """Counts finished images and reports throughput and the remaining time."""
+    
+    def __init__(self, total: int, skipped: int = 0, out=sys.stdout):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.input_bytes = 0
+        self.out = out
+        self.started = time.perf_counter()
+        
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+        
+    @property
+    def rate(self) -> float:
+        """Images per second so far."""
+        return self.done / self.elapsed if self.done else 0.0
+        
+    def eta(self) -> Optional[float]:
+        """Seconds until the rest is done at the current rate."""
+        return (self.total - self.done) / self.rate if self.rate else None
+        
+    def record(self, item: BulkItem, size: int, error: Optional[str]):
+        self.done += 1
+        self.input_bytes += size
+        if error:
+            self.failed += 1
+        eta = self.eta()
+        status = f"FAILED {error}" if error else "ok"
+        print(
+            f"[{self.done}/{self.total}] {self.rate:.2f} img/s, "
+            f"ETA {_format_duration(eta) if eta is not None else '-'}  {item.source}: {status}",
+            file=self.out,
+            flush=True,
+        )
+        
+    def summary(self) -> str:
+        return (
+            f"Processed {self.done - self.failed} images, {self.failed} failed, "
+            f"{self.skipped} up to date, in {_format_duration(self.elapsed)} "
+            f"({self.rate:.2f} img/s, {self.input_bytes / 1e6 / max(self.elapsed, 1e-9):.1f} MB/s in)"
+        )
+
+
+def run(items: List[BulkItem], options: RemovalOptions, processes: int, progress: Progress):
+    """Process `items`, in this process if `processes` is 1, else in a pool of warm workers."""
+    options_dict = asdict(options)
+    if processes <= 1:
+        _init_worker(options.model)
+        for item in items:
+            progress.record(*process_item(item, options_dict))
+        return
+        
+    # Children read their settings from the environment: share the CPUs between them
+    os.environ.setdefault("WEB_CONCURRENCY", str(processes))
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(options.model,),
+    ) as executor:
+        futures = [executor.submit(process_item, item, options_dict) for item in items]
+        try:
+            for future in as_completed(futures):
+                progress.record(*future.result())
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="*", help="Image files, directories or glob patterns")
+    parser.add_argument("--manifest", action="append", default=[], help="File listing one image path per line")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--force", action="store_true", help="Also redo outputs that are up to date")
+    parser.add_argument("--quality", help="fast, balanced or best")
+    parser.add_argument("--model")
+    parser.add_argument("--output-format")
+    parser.add_argument("--region", help="full, roi or tiled")
+    parser.add_argument("--crop", action="store_true", help="Trim results to the subject")
+    args = parser.parse_args(argv)
+    
+    try:
+        options = parse_options(args.quality, args.model, args.output_format, args.region, args.crop or None)
+    except InvalidOptions as e:
+        parser.error(str(e))
+    sources = list(args.sources)
+    for manifest in args.manifest:
+        sources.extend(read_manifest(manifest))
+    if not sources:
+        parser.error("Give at least one source or --manifest")
+        
+    try:
+        items = collect_items(sources, args.output_dir, options)
+    except ValueError as e:
+        parser.error(str(e))
+    todo = items if args.force else [item for item in items if not is_up_to_date(item)]
+    progress = Progress(len(todo), skipped=len(items) - len(todo))
+    print(f"{len(items)} images, {len(todo)} to process with {max(1, args.processes)} processes")
+    try:
+        if todo:
+            run(todo, options, args.processes, progress)
+    except KeyboardInterrupt:
+        print("Interrupted; run again to resume")
+        print(progress.summary())
+        return 130
+    print(progress.summary())
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,21 +4,47 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.config import settings
-from app.api.v1 import remove_bg, health, payment
+from app.api.v1 import remove_bg, health, payment, jobs
 from app.metrics import metrics_router
+from app.middleware import BodySizeLimitMiddleware
+from app.services.model_warmup import record_import_time
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events."""
-    # Startup: preload rembg model
-    from app.services.background_remover import get_session
-    print("Loading rembg model...")
-    get_session()
-    print("Model loaded successfully!")
+    # Startup: load and warm rembg models in the background; /ready reports progress
+    from app.services import inference_workers
+    from app.services.model_warmup import model_warmup
+    preload = [name.strip() for name in settings.PRELOAD_MODELS.split(",") if name.strip()]
+    if inference_workers.client is not None:
+        # Multi-process serving: the inference workers hold the models
+        model_warmup.track_workers(preload, lambda: inference_workers.client.ready_workers)
+    else:
+        print(f"Loading rembg models in the background: {', '.join(preload)}...")
+        model_warmup.start(preload)
+    from app.services.credits import credit_ledger
+    try:
+        await credit_ledger.start()
+    except Exception as e:
+        # Paid credits are unavailable until the database is reachable; free uses still work
+        print(f"Credit ledger not ready: {e}")
+    await payment.creem_client.start()
+    await payment.webhook_processor.start()
+    from app.services.jobs import job_manager
+    await job_manager.start()
     yield
     # Shutdown
     print("Shutting down BgGone...")
+    await job_manager.stop()
+    await model_warmup.stop()
+    await payment.webhook_processor.stop()
+    await credit_ledger.close()
+    await payment.creem_client.close()
+    from app.services.inference_pool import inference_pool
+    from app.services.model_registry import model_registry
+    inference_pool.shutdown(wait=False)
+    model_registry.unload_all()
 
 
 app = FastAPI(
@@ -28,6 +54,14 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Reject oversized bodies while they stream in (allowance for multipart framing).
+# Added before CORS so CORS stays outermost and 413s carry CORS headers
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_bytes=settings.MAX_FILE_SIZE_MB * 1024 * 1024 + 64 * 1024,
+    path_limits={"/api/v1/jobs": settings.JOB_MAX_UPLOAD_MB * 1024 * 1024 + 64 * 1024},
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,15 +69,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Remaining-Uses", "X-Daily-Limit"],
+    expose_headers=["X-Remaining-Uses", "X-Credits-Remaining", "X-Daily-Limit", "X-Cache", "Server-Timing"],
 )
 
 # Include routers
 app.include_router(health.router)
 app.include_router(remove_bg.router)
+app.include_router(jobs.router)
 app.include_router(payment.router)
 app.include_router(metrics_router)
 
+record_import_time()
+
 
 @app.get("/")
 async def root():
@@ -1,10 +1,39 @@
-"""Prometheus metrics for BgGone."""
+"""
+Prometheus metrics for BgGone.
+
+With several worker processes (app.serve, or any server configured with
+PROMETHEUS_MULTIPROC_DIR before this module is imported) every process
+writes its values to files in that directory and /metrics aggregates them,
+so a scrape reports the whole server rather than one random worker. Gauges
+declare how they combine across processes (multiprocess_mode).
+"""
+import asyncio
 import os
-from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import threading
+import time
+
+from app.config import settings
+
+# prometheus_client picks its value storage from the environment when it's
+# imported, so a directory configured in .env has to be exported first
+if settings.PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = settings.PROMETHEUS_MULTIPROC_DIR
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    CONTENT_TYPE_LATEST,
+)
+from prometheus_client import multiprocess
 from fastapi import APIRouter
 from fastapi.responses import Response
 
-TOOL_NAME = os.getenv("TOOL_NAME", "bggone")
+TOOL_NAME = settings.TOOL_NAME
 
 # Core metrics
 bg_removal_total = Counter(
@@ -20,12 +49,169 @@ bg_removal_duration = Histogram(
     buckets=[0.5, 1, 2, 5, 10, 30, 60]
 )
 
+bg_requests_abandoned = Counter(
+    "bg_requests_abandoned_total",
+    "Removal requests given up before the result was sent (client disconnected or deadline passed)",
+    ["tool", "reason"]
+)
+
+bg_preview_latency = Histogram(
+    "bg_preview_latency_seconds",
+    "Time from the start of a progressive request to its preview (or to the result, if that came first)",
+    ["tool", "event"],
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+)
+
+bg_removal_stage_duration = Histogram(
+    "bg_removal_stage_duration_seconds",
+    "Time spent in each background removal stage",
+    ["tool", "stage", "quality", "model", "size_class"],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+)
+
+bg_input_megapixels = Histogram(
+    "bg_input_megapixels",
+    "Pixel count of input images, in megapixels",
+    ["tool", "model"],
+    buckets=[0.1, 0.3, 0.5, 1, 2, 4, 8, 12, 24, 40, 50]
+)
+
+bg_encode_duration = Histogram(
+    "bg_encode_duration_seconds",
+    "Time spent encoding the output image",
+    ["tool", "format"],
+    buckets=[0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10]
+)
+
+bg_output_bytes = Histogram(
+    "bg_output_bytes",
+    "Size of encoded output images",
+    ["tool", "format"],
+    buckets=[10000, 50000, 100000, 500000, 1000000, 5000000, 10000000, 50000000]
+)
+
+# Startup metrics
+app_startup_seconds = Gauge(
+    "app_startup_seconds",
+    "Seconds from process start to each startup phase (import, ready)",
+    ["tool", "phase"],
+    multiprocess_mode="max"
+)
+
+model_warmup_duration = Histogram(
+    "model_warmup_duration_seconds",
+    "Time spent loading and warming up a model at startup",
+    ["tool", "model"],
+    buckets=[0.5, 1, 2, 5, 10, 30, 60]
+)
+
+# Model registry metrics
+model_loaded = Gauge(
+    "model_loaded",
+    "Whether a model session is loaded (1) or not (0)",
+    ["tool", "model"],
+    multiprocess_mode="livemax"
+)
+
+model_load_duration = Histogram(
+    "model_load_duration_seconds",
+    "Time spent loading a model session",
+    ["tool", "model"],
+    buckets=[0.5, 1, 2, 5, 10, 30, 60]
+)
+
+model_evictions = Counter(
+    "model_evictions_total",
+    "Model sessions unloaded to stay within the memory budget",
+    ["tool", "model"]
+)
+
+# Inference executor metrics
+inference_queue_depth = Gauge(
+    "inference_queue_depth",
+    "Inference jobs waiting for a free worker",
+    ["tool"],
+    multiprocess_mode="livesum"
+)
+
+inference_queue_wait = Histogram(
+    "inference_queue_wait_seconds",
+    "Time inference jobs spend waiting for a free worker",
+    ["tool"],
+    buckets=[0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30]
+)
+
+inference_rejected = Counter(
+    "inference_rejected_total",
+    "Inference jobs rejected because the admission queue was full",
+    ["tool"]
+)
+
+inference_batch_size = Histogram(
+    "inference_batch_size",
+    "Images per model forward pass",
+    ["tool"],
+    buckets=[1, 2, 4, 8, 16, 32]
+)
+
+inference_worker_restarts = Counter(
+    "inference_worker_restarts_total",
+    "Inference worker processes restarted by the supervisor",
+    ["tool", "reason"]
+)
+
+single_flight_requests = Counter(
+    "single_flight_requests_total",
+    "Background removals by whether they ran (leader) or joined an identical in-flight one (follower)",
+    ["tool", "role"]
+)
+
+# Result cache metrics
+result_cache_requests = Counter(
+    "result_cache_requests_total",
+    "Result cache lookups",
+    ["tool", "tier", "result"]
+)
+
+result_cache_bytes = Gauge(
+    "result_cache_bytes",
+    "Bytes held by the in-memory result cache",
+    ["tool"],
+    multiprocess_mode="livesum"
+)
+
+# Batch job metrics
+jobs_submitted = Counter(
+    "jobs_submitted_total",
+    "Batch jobs submitted",
+    ["tool"]
+)
+
+job_items_processed = Counter(
+    "job_items_processed_total",
+    "Batch job images processed",
+    ["tool", "status"]
+)
+
+job_queue_depth = Gauge(
+    "job_queue_depth",
+    "Batch job images waiting to be processed",
+    ["tool"],
+    multiprocess_mode="livesum"
+)
+
 free_trial_used = Counter(
     "free_trial_used_total",
     "Free trials used",
     ["tool"]
 )
 
+free_trial_refunded = Counter(
+    "free_trial_refunded_total",
+    "Free trials given back after a failed or uncharged request",
+    ["tool"]
+)
+
 # Payment metrics
 payment_checkout_created = Counter(
     "payment_checkout_created_total",
@@ -51,6 +237,53 @@ payment_webhook_received = Counter(
     ["tool", "event_type", "status"]
 )
 
+webhook_journal_pending = Gauge(
+    "webhook_journal_pending",
+    "Webhook events journaled but not yet applied",
+    ["tool"],
+    multiprocess_mode="livemax"
+)
+
+webhook_batch_size = Histogram(
+    "webhook_batch_size",
+    "Webhook events applied per batch",
+    ["tool"],
+    buckets=[1, 2, 5, 10, 25, 50, 100, 250]
+)
+
+webhook_events_applied = Counter(
+    "webhook_events_applied_total",
+    "Journaled webhook events by result (applied, duplicate or error)",
+    ["tool", "result"]
+)
+
+# Upstream (third-party API) metrics
+upstream_requests = Counter(
+    "upstream_requests_total",
+    "Calls to upstream APIs by outcome (status class, or error for network failures)",
+    ["tool", "upstream", "outcome"]
+)
+
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Time per upstream API call attempt",
+    ["tool", "upstream"],
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+)
+
+upstream_retries = Counter(
+    "upstream_retries_total",
+    "Upstream API calls retried",
+    ["tool", "upstream"]
+)
+
+upstream_circuit_state = Gauge(
+    "upstream_circuit_state",
+    "Upstream circuit breaker state (0 closed, 1 half open, 2 open)",
+    ["tool", "upstream"],
+    multiprocess_mode="livemax"
+)
+
 tokens_created = Counter(
     "tokens_created_total",
     "Tokens created",
@@ -66,6 +299,19 @@ tokens_consumed = Counter(
 tokens_remaining = Gauge(
     "tokens_remaining",
     "Remaining tokens",
+    ["tool"],
+    multiprocess_mode="livesum"
+)
+
+credit_cache_requests = Counter(
+    "credit_cache_requests_total",
+    "Credit balance lookups served from the in-process cache (hit) or the database (miss)",
+    ["tool", "result"]
+)
+
+credit_ledger_errors = Counter(
+    "credit_ledger_errors_total",
+    "Credit ledger database errors (requests fall back to the free tier)",
     ["tool"]
 )
 
@@ -77,11 +323,107 @@ file_size_bytes = Histogram(
     buckets=[100000, 500000, 1000000, 5000000, 10000000, 20000000]
 )
 
+
+class BoundLabels:
+    """
+    Label children of `metric` for this tool, cached by the other label values.
+    
+    For hot-path metrics whose labels vary per call (stage, model, ...);
+    fixed combinations are bound once below.
+    """
+    
+    def __init__(self, metric):
+        self.metric = metric
+        self._children = {}
+        
+    def __call__(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self.metric.labels(TOOL_NAME, *values)
+        return child
+
+
+# Children used on every request, bound once: .labels() takes a lock and
+# validates the label values on each call
+removals_succeeded = bg_removal_total.labels(TOOL_NAME, "success")
+removals_failed = bg_removal_total.labels(TOOL_NAME, "error")
+removals_cancelled = bg_removal_total.labels(TOOL_NAME, "cancelled")
+removals_past_deadline = bg_removal_total.labels(TOOL_NAME, "deadline_exceeded")
+abandoned_on_disconnect = bg_requests_abandoned.labels(TOOL_NAME, "disconnect")
+abandoned_on_deadline = bg_requests_abandoned.labels(TOOL_NAME, "deadline")
+removal_duration = bg_removal_duration.labels(TOOL_NAME)
+stage_duration = BoundLabels(bg_removal_stage_duration)
+preview_latency = bg_preview_latency.labels(TOOL_NAME, "preview")
+progressive_result_latency = bg_preview_latency.labels(TOOL_NAME, "result")
+input_megapixels = BoundLabels(bg_input_megapixels)
+encode_duration = BoundLabels(bg_encode_duration)
+output_size = BoundLabels(bg_output_bytes)
+queue_depth = inference_queue_depth.labels(TOOL_NAME)
+queue_wait = inference_queue_wait.labels(TOOL_NAME)
+queue_rejected = inference_rejected.labels(TOOL_NAME)
+batch_size = inference_batch_size.labels(TOOL_NAME)
+single_flight_leaders = single_flight_requests.labels(TOOL_NAME, "leader")
+single_flight_followers = single_flight_requests.labels(TOOL_NAME, "follower")
+result_cache_memory_hits = result_cache_requests.labels(TOOL_NAME, "memory", "hit")
+result_cache_disk_hits = result_cache_requests.labels(TOOL_NAME, "disk", "hit")
+result_cache_misses = result_cache_requests.labels(TOOL_NAME, "all", "miss")
+result_cache_size = result_cache_bytes.labels(TOOL_NAME)
+free_trials_used = free_trial_used.labels(TOOL_NAME)
+free_trials_refunded = free_trial_refunded.labels(TOOL_NAME)
+credit_cache_hits = credit_cache_requests.labels(TOOL_NAME, "hit")
+credit_cache_misses = credit_cache_requests.labels(TOOL_NAME, "miss")
+credits_consumed = tokens_consumed.labels(TOOL_NAME)
+uploaded_file_bytes = file_size_bytes.labels(TOOL_NAME)
+
+
+def multiprocess_dir() -> str:
+    return settings.PROMETHEUS_MULTIPROC_DIR
+
+
+def mark_process_dead(pid: int):
+    """Drop an exited worker's live gauges (the "live*" multiprocess modes)."""
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
+
+
+class Exposition:
+    """
+    Renders the metrics page, at most once per `max_age` seconds.
+    
+    Rendering walks every metric (and in multiprocess mode reads every
+    worker's files), so it runs in a thread, and scrapes arriving within
+    `max_age` of each other (several Prometheus replicas, or retries) get
+    the same bytes.
+    """
+    
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._body = b""
+        self._rendered_at = float("-inf")
+        
+    def registry(self):
+        if not multiprocess_dir():
+            return REGISTRY
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+        
+    def render(self) -> bytes:
+        with self._lock:
+            if time.monotonic() - self._rendered_at >= self.max_age:
+                self._body = generate_latest(self.registry())
+                self._rendered_at = time.monotonic()
+            return self._body
+
+
+exposition = Exposition(settings.METRICS_CACHE_SECONDS)
+
 # Metrics router
 metrics_router = APIRouter()
 
 
 @metrics_router.get("/metrics")
 async def metrics():
-    """Prometheus metrics endpoint."""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    """Prometheus metrics endpoint (aggregated across worker processes)."""
+    return Response(await asyncio.to_thread(exposition.render), media_type=CONTENT_TYPE_LATEST)
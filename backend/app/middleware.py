@@ -0,0 +1,65 @@
+"""ASGI middleware for BgGone."""
+from typing import Dict, Optional
+
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies larger than `max_body_bytes` while they stream in.
+    
+    Requests that declare a larger Content-Length are answered with 413
+    before any of the body is read. Chunked or lying clients are cut off
+    as soon as the received byte count crosses the limit, instead of after
+    the whole body has been spooled.
+    
+    `path_limits` maps path prefixes to their own limits, for endpoints
+    such as batch uploads that accept more than a single image.
+    """
+    
+    def __init__(self, app: ASGIApp, max_body_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.path_limits = path_limits or {}
+        
+    def _limit_for(self, path: str) -> int:
+        for prefix, limit in self.path_limits.items():
+            if path.startswith(prefix):
+                return limit
+        return self.max_body_bytes
+        
+    def _too_large(self, max_body_bytes: int) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"Request body too large. Maximum size: {max_body_bytes // (1024 * 1024)}MB",
+        )
+        
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+            
+        max_body_bytes = self._limit_for(scope["path"])
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > max_body_bytes:
+            error = self._too_large(max_body_bytes)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+            
+        received = 0
+        
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_bytes:
+                    # Re-raised by FastAPI's body parsing and turned into a 413
+                    raise self._too_large(max_body_bytes)
+            return message
+            
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,128 @@
+"""
+Multi-process launcher.
+
+    python -m app.serve
+
+Runs SERVE_HTTP_WORKERS uvicorn processes on one shared socket and
+INFERENCE_PROCESSES inference worker processes that hold the models.
+The two are sized separately: HTTP workers are cheap and mostly wait on
+I/O, inference workers each hold a copy of the models and use
+ONNX_INTRA_OP_THREADS (by default the CPUs divided between them).
+
+Crashed HTTP workers are restarted; inference workers are supervised by
+InferenceSupervisor. With INFERENCE_PROCESSES=0 every HTTP worker loads
+its own models, as with `uvicorn --workers`.
+
+All processes write metrics to one PROMETHEUS_MULTIPROC_DIR, which any
+HTTP worker's /metrics aggregates. prometheus_client picks its storage
+when it's imported, so app modules that import app.metrics are only
+imported once the directory is set (workers inherit the environment).
+"""
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+
+import uvicorn
+
+from app.config import settings
+
+
+def _http_worker_main(config: uvicorn.Config, sockets, index: int, task_queue, result_queue, ready):
+    if task_queue is not None:
+        from app.services.inference_workers import InferenceClient, connect
+        connect(InferenceClient(index, task_queue, result_queue, ready, settings.INFERENCE_TASK_TIMEOUT_SECONDS))
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def prepare_metrics_dir() -> str:
+    """Create (or empty) the shared metrics directory and export it to child processes."""
+    path = settings.PROMETHEUS_MULTIPROC_DIR or tempfile.mkdtemp(prefix="bggone-metrics-")
+    os.makedirs(path, exist_ok=True)
+    # Files left by a previous run would be added to this run's counters
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    settings.PROMETHEUS_MULTIPROC_DIR = path
+    return path
+
+
+def main():
+    http_workers = max(1, settings.SERVE_HTTP_WORKERS)
+    inference_processes = max(0, settings.INFERENCE_PROCESSES)
+    config = uvicorn.Config("app.main:app", host=settings.HOST, port=settings.PORT)
+    if http_workers > 1 and settings.JOB_STORE == "memory":
+        # Each worker would keep its own jobs, invisible to the others
+        raise SystemExit("SERVE_HTTP_WORKERS > 1 needs JOB_STORE=sqlite so the workers share batch jobs")
+    if http_workers == 1 and not inference_processes:
+        uvicorn.Server(config).run()
+        return
+        
+    if not inference_processes:
+        # Each HTTP worker runs its own models; share the CPUs between them
+        os.environ.setdefault("WEB_CONCURRENCY", str(http_workers))
+    prepare_metrics_dir()
+    from app.metrics import mark_process_dead
+    from app.services.inference_workers import InferenceSupervisor
+    
+    ctx = multiprocessing.get_context("spawn")
+    sock = config.bind_socket()
+    supervisor = None
+    task_queue = None
+    result_queues = [None] * http_workers
+    if inference_processes:
+        preload = [name.strip() for name in settings.PRELOAD_MODELS.split(",") if name.strip()]
+        task_queue = ctx.Queue()
+        result_queues = [ctx.Queue() for _ in range(http_workers)]
+        supervisor = InferenceSupervisor(
+            ctx,
+            inference_processes,
+            task_queue,
+            result_queues,
+            preload,
+            max_rss_mb=settings.INFERENCE_WORKER_MAX_RSS_MB,
+            max_tasks=settings.INFERENCE_WORKER_MAX_TASKS,
+        )
+        supervisor.start()
+        
+    def spawn_http(index: int):
+        process = ctx.Process(
+            target=_http_worker_main,
+            args=(
+                config, [sock], index, task_queue, result_queues[index],
+                supervisor.ready if supervisor else None,
+            ),
+            name=f"http-worker-{index}",
+        )
+        process.start()
+        return process
+        
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+        
+    print(f"Serving on {settings.HOST}:{settings.PORT} with {http_workers} HTTP and {inference_processes} inference processes")
+    http = [spawn_http(index) for index in range(http_workers)]
+    while not stopping.wait(1):
+        for index, process in enumerate(http):
+            if not process.is_alive():
+                mark_process_dead(process.pid)
+                print(f"Restarting {process.name} (exit code {process.exitcode})")
+                http[index] = spawn_http(index)
+        if supervisor:
+            supervisor.check()
+            
+    # Let HTTP workers finish their requests before the inference workers go away
+    for process in http:
+        process.terminate()
+    for process in http:
+        process.join(30)
+    if supervisor:
+        supervisor.stop()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
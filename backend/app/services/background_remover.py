@@ -1,67 +1,398 @@
 """Background removal service using rembg."""
+import asyncio
 import io
 import time
+from dataclasses import asdict, dataclass, replace
+from typing import Optional, Tuple
 from PIL import Image
-from rembg import remove, new_session
-from app.metrics import bg_removal_total, bg_removal_duration, TOOL_NAME
+from app.config import settings
+from app.metrics import (
+    removal_duration,
+    removals_cancelled,
+    removals_failed,
+    removals_past_deadline,
+    removals_succeeded,
+)
+from app.services.cancellation import CancelScope, DeadlineExceeded, RemovalCancelled
+from app.services.encoding import OUTPUT_FORMATS, encode_output
+from app.services.image_io import (
+    composite_alpha,
+    decode_full,
+    decode_working_copy,
+    guided_upsample_alpha,
+    open_image,
+    oriented_size,
+)
+from app.services import inference_workers
+from app.services.inference_pool import inference_pool
+from app.services.matting import QUALITY_MODES, refine_cutout
+from app.services.model_registry import model_registry
+from app.services.profiling import profile_call
+from app.services.regions import REGION_MODES, locate_subject, predict_tiled, scale_box
+from app.services.result_cache import cache_key, result_cache
+from app.services.single_flight import single_flight
+from app.services.timing import StageTimings
 
 
-# Initialize rembg session (load model once)
-_session = None
+@dataclass(frozen=True)
+class RemovalOptions:
+    """Parameters that determine the output for a given input image."""
+    model: str = settings.DEFAULT_MODEL
+    alpha_matting_foreground_threshold: int = 240
+    alpha_matting_background_threshold: int = 10
+    alpha_matting_erode_size: int = 10
+    output_format: str = settings.DEFAULT_OUTPUT_FORMAT
+    quality: str = "best"
+    region: str = "full"
+    crop: bool = False
+    # Work at no more than this many pixels per side and return the result at
+    # that size instead of upsampling (0 = full resolution); used for previews
+    max_output_side: int = 0
+    
+    def cache_params(self) -> dict:
+        """Parameters as a dict, for building cache keys."""
+        return asdict(self)
+
+
+DEFAULT_OPTIONS = RemovalOptions(quality=settings.DEFAULT_QUALITY)
+
+# Quick low-resolution mask shown while the full result is computed
+PREVIEW_OPTIONS = RemovalOptions(
+    model=settings.PREVIEW_MODEL,
+    output_format="mask",
+    quality="fast",
+    max_output_side=settings.PREVIEW_MAX_SIDE,
+)
 
 
-def get_session():
-    """Get or create rembg session."""
-    global _session
-    if _session is None:
-        _session = new_session("u2net")
-    return _session
+class InvalidOptions(ValueError):
+    """Raised when a requested processing parameter isn't supported."""
 
 
-async def remove_background(image_bytes: bytes) -> bytes:
+def parse_options(
+    quality: Optional[str] = None,
+    model: Optional[str] = None,
+    output_format: Optional[str] = None,
+    region: Optional[str] = None,
+    crop: Optional[bool] = None,
+) -> RemovalOptions:
+    """
+    Build RemovalOptions from user-supplied parameters, falling back to defaults.
+    
+    Raises:
+        InvalidOptions: If a parameter has an unsupported value
+    """
+    if quality is not None and quality not in QUALITY_MODES:
+        raise InvalidOptions(f"Invalid quality. Supported: {', '.join(QUALITY_MODES)}")
+    if model is not None and model not in model_registry.available:
+        raise InvalidOptions(f"Invalid model. Supported: {', '.join(model_registry.available)}")
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise InvalidOptions(f"Invalid output format. Supported: {', '.join(OUTPUT_FORMATS)}")
+    if region is not None and region not in REGION_MODES:
+        raise InvalidOptions(f"Invalid region. Supported: {', '.join(REGION_MODES)}")
+    return replace(
+        DEFAULT_OPTIONS,
+        quality=quality or DEFAULT_OPTIONS.quality,
+        model=model or DEFAULT_OPTIONS.model,
+        output_format=output_format or DEFAULT_OPTIONS.output_format,
+        region=region or DEFAULT_OPTIONS.region,
+        crop=DEFAULT_OPTIONS.crop if crop is None else crop,
+    )
+
+
+def get_session(model: str = settings.DEFAULT_MODEL):
+    """Use the warm rembg session for a model, loading it if needed (`with get_session() as session:`)."""
+    return model_registry.session(model)
+
+
+async def remove_background(
+    image_bytes: bytes,
+    options: RemovalOptions = DEFAULT_OPTIONS,
+    timings: Optional[StageTimings] = None,
+    profile: bool = False,
+    key: Optional[str] = None,
+    deadline: Optional[float] = None,
+) -> bytes:
     """
     Remove background from an image.
     
+    The work runs on the inference pool so the event loop stays free. In
+    multi-process serving the pool threads only wait on an inference
+    worker process, which does the actual work.
+    
+    With COALESCE_REQUESTS, a request for an image that's already being
+    processed with the same options shares that result; `timings` then
+    stays empty since this request did no work of its own.
+    
+    Cancelling the call abandons the removal once no other request is
+    waiting for it: it stops at the next stage boundary. (In multi-process
+    serving the inference worker still finishes the image, unless its
+    deadline passes.)
+    
+    With a `deadline` (time.monotonic()) the call gives up at that time.
+    The removal itself is dropped if it's still queued by then, or stops
+    at the next stage boundary; work shared with other requests stops at
+    the deadline of the request that started it, and a request with a
+    later deadline then starts it again.
+    
     Args:
         image_bytes: Input image as bytes
+        options: Processing parameters
+        timings: Collects per-stage durations
+        profile: Run under a profiler and write the dump to PROFILE_DIR
+        key: cache_key() of the image and options, if already computed
+        deadline: time.monotonic() by which the result is needed
         
     Returns:
-        PNG image bytes with transparent background
+        Image bytes with transparent background, encoded as options.output_format
+        
+    Raises:
+        InferenceQueueFull: If the inference pool is at capacity
+        InferenceWorkerError: If an inference worker process failed the image
+        DeadlineExceeded: If `deadline` passed first
     """
-    start_time = time.time()
-    
+    if deadline is None:
+        return await _coalesced_removal(image_bytes, options, timings, profile, key, deadline)
     try:
-        # Open image
-        input_image = Image.open(io.BytesIO(image_bytes))
+        async with asyncio.timeout(deadline - time.monotonic()):
+            return await _coalesced_removal(image_bytes, options, timings, profile, key, deadline)
+    except TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def _coalesced_removal(
+    image_bytes: bytes,
+    options: RemovalOptions,
+    timings: Optional[StageTimings],
+    profile: bool,
+    key: Optional[str],
+    deadline: Optional[float],
+) -> bytes:
+    if not settings.COALESCE_REQUESTS:
+        return await _run_removal(image_bytes, options, timings, profile, deadline)
+    key = key or cache_key(image_bytes, options.cache_params())
+    while True:
+        try:
+            result, _ = await single_flight.run(
+                key, lambda: _run_removal(image_bytes, options, timings, profile, deadline)
+            )
+            return result
+        except DeadlineExceeded:
+            # Only our own deadline counts, not that of the request we were sharing with
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+
+
+async def _run_removal(
+    image_bytes: bytes,
+    options: RemovalOptions,
+    timings: Optional[StageTimings],
+    profile: bool,
+    deadline: Optional[float] = None,
+) -> bytes:
+    if inference_workers.client is not None:
+        return await inference_pool.run(inference_workers.client.process, image_bytes, asdict(options), deadline)
+    cancel = CancelScope(deadline)
+    try:
+        if profile:
+            return await inference_pool.run(profile_call, remove_background_sync, image_bytes, options, timings, cancel)
+        return await inference_pool.run(remove_background_sync, image_bytes, options, timings, cancel)
+    except asyncio.CancelledError:
+        # Awaiting stopped, but the thread keeps going until it next checks
+        cancel.cancel()
+        raise
+
+
+async def remove_background_cached(
+    image_bytes: bytes,
+    options: RemovalOptions = DEFAULT_OPTIONS,
+    timings: Optional[StageTimings] = None,
+    profile: bool = False,
+    deadline: Optional[float] = None,
+) -> Tuple[bytes, bool]:
+    """
+    Remove background, reusing the cached result for identical input.
+    
+    Args:
+        image_bytes: Input image as bytes
+        options: Processing parameters
+        timings: Collects per-stage durations (untouched on a cache hit)
+        profile: Profile the removal if it isn't served from the cache
+        deadline: time.monotonic() by which the result is needed
+        
+    Returns:
+        Tuple of (output bytes, whether the result came from the cache)
+    """
+    if not settings.RESULT_CACHE_ENABLED:
+        return await remove_background(image_bytes, options, timings, profile, deadline=deadline), False
+        
+    key = cache_key(image_bytes, options.cache_params())
+    cached = await result_cache.get(key)
+    if cached is not None:
+        return cached, True
+        
+    result = await remove_background(image_bytes, options, timings, profile, key=key, deadline=deadline)
+    await result_cache.put(key, result)
+    return result, False
+
+
+def remove_background_sync(
+    image_bytes: bytes,
+    options: RemovalOptions = DEFAULT_OPTIONS,
+    timings: Optional[StageTimings] = None,
+    cancel: Optional[CancelScope] = None,
+) -> bytes:
+    """
+    Remove background from an image on the calling thread.
+    
+    Args:
+        image_bytes: Input image as bytes
+        options: Processing parameters
+        timings: Collects per-stage durations; a new one is used if omitted
+        cancel: Checked before starting and between stages
         
-        # Remove background using rembg
-        session = get_session()
-        output_image = remove(
-            input_image,
-            session=session,
-            alpha_matting=True,
-            alpha_matting_foreground_threshold=240,
-            alpha_matting_background_threshold=10,
-            alpha_matting_erode_size=10,
-        )
+    Returns:
+        Image bytes with transparent background, encoded as options.output_format
         
-        # Convert to PNG bytes
-        output_buffer = io.BytesIO()
-        output_image.save(output_buffer, format="PNG", optimize=True)
-        output_bytes = output_buffer.getvalue()
+    Raises:
+        ImageTooLarge: If the image exceeds MAX_MEGAPIXELS
+        RemovalCancelled: If `cancel` was cancelled
+        DeadlineExceeded: If `cancel` expired
+    """
+    start_time = time.time()
+    timings = timings or StageTimings(options.quality, options.model)
+    checkpoint = cancel.check if cancel is not None else lambda: None
+    
+    try:
+        # Skip work that sat in the queue past its deadline
+        checkpoint()
         
+        # Open image: check the pixel count from the header, then decode a
+        # bounded-resolution working copy for segmentation and matting
+        max_side = settings.TILED_WORKING_MAX_SIDE if options.region == "tiled" else settings.WORKING_MAX_SIDE
+        if options.max_output_side:
+            max_side = min(max_side, options.max_output_side)
+        with timings.stage("decode"):
+            source_image = open_image(image_bytes, settings.MAX_MEGAPIXELS)
+            full_size = oriented_size(source_image)
+            timings.set_image_size(*full_size)
+            input_image = decode_working_copy(source_image, max_side)
+            
+        # Region modes: find the subject at low resolution and process only its crop
+        checkpoint()
+        box = None
+        region_size = input_image.size if options.max_output_side else full_size
+        load_region = lambda: decode_full(image_bytes)
+        if options.region != "full":
+            with timings.stage("locate"), model_registry.acquire(options.model) as batcher:
+                box = locate_subject(
+                    batcher,
+                    input_image,
+                    settings.ROI_PREVIEW_SIDE,
+                    settings.ROI_THRESHOLD,
+                    settings.ROI_PADDING,
+                )
+            if box is not None:
+                box = scale_box(box, input_image.size, full_size)
+                region_area = (box[2] - box[0]) * (box[3] - box[1])
+                if region_area > settings.ROI_MAX_AREA_FRACTION * full_size[0] * full_size[1]:
+                    # Subject fills most of the frame; cropping wouldn't save anything
+                    box = None
+            if box is not None:
+                with timings.stage("decode"):
+                    input_image, load_region = _crop_region(image_bytes, input_image, full_size, box, max_side)
+                    region_size = (box[2] - box[0], box[3] - box[1])
+                    
+        # Predict the foreground mask (batched with concurrent requests)
+        checkpoint()
+        with timings.stage("inference"), model_registry.acquire(options.model) as batcher:
+            if options.region == "tiled":
+                mask = predict_tiled(batcher, input_image, settings.TILE_SIZE, settings.TILE_OVERLAP)
+            else:
+                mask = batcher.predict(input_image)
+                
+        # Refine the mask edges according to the quality mode
+        checkpoint()
+        with timings.stage("matting"):
+            output_image = refine_cutout(
+                input_image, mask, options, settings.BALANCED_MATTING_MAX_SIDE
+            )
+            
+        # Large images: upsample the alpha along the original's edges and
+        # attach it to the full-resolution pixels
+        if output_image.size != region_size:
+            checkpoint()
+            with timings.stage("upsample"):
+                alpha = output_image.getchannel("A")
+                del output_image, input_image, mask
+                full_image = load_region()
+                alpha = guided_upsample_alpha(
+                    alpha,
+                    full_image,
+                    radius=settings.GUIDED_FILTER_RADIUS,
+                    eps=settings.GUIDED_FILTER_EPS,
+                )
+                output_image = composite_alpha(full_image, alpha)
+                del full_image, alpha
+                
+        # Trim to the subject, or put a processed region back on a full-size canvas
+        if options.crop:
+            subject = output_image.getchannel("A").getbbox()
+            if subject is not None:
+                output_image = output_image.crop(subject)
+        elif box is not None:
+            canvas = Image.new("RGBA", full_size, 0)
+            canvas.paste(output_image, box[:2])
+            output_image = canvas
+            
+        # Encode in the requested output format
+        checkpoint()
+        with timings.stage("encode"):
+            output_bytes = encode_output(output_image, options.output_format)
+            
         # Record metrics
         duration = time.time() - start_time
-        bg_removal_total.labels(tool=TOOL_NAME, status="success").inc()
-        bg_removal_duration.labels(tool=TOOL_NAME).observe(duration)
+        removals_succeeded.inc()
+        removal_duration.observe(duration)
         
         return output_bytes
         
+    except DeadlineExceeded:
+        removals_past_deadline.inc()
+        raise
+    except RemovalCancelled:
+        removals_cancelled.inc()
+        raise
     except Exception as e:
-        bg_removal_total.labels(tool=TOOL_NAME, status="error").inc()
+        removals_failed.inc()
         raise e
 
 
+def _crop_region(image_bytes: bytes, working: Image.Image, full_size, box, max_side: int):
+    """
+    Cut `box` (full-resolution coordinates) out of the image.
+    
+    Returns:
+        Tuple of (working copy of the region, function returning it at full resolution)
+    """
+    if working.size == full_size:
+        region = working.crop(box)
+        return region, lambda: region
+        
+    # The working copy is downscaled: take the region from the full decode,
+    # then drop the rest of the frame
+    full_image = decode_full(image_bytes)
+    region = full_image.crop(box)
+    del full_image
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    working = region
+    if max(region.size) > max_side:
+        working = region.copy()
+        working.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return working, lambda: region
+
+
 def get_image_info(image_bytes: bytes) -> dict:
     """Get image dimensions and format."""
     image = Image.open(io.BytesIO(image_bytes))
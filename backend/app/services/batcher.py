@@ -0,0 +1,155 @@
+"""Dynamic micro-batching of mask predictions."""
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.metrics import batch_size
+
+# Preprocessing used by rembg for each model: (mean, std, input size).
+# Models not listed here are never batched and go through session.predict().
+MODEL_PREPROCESSING = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+class _PendingMask:
+    """A single image waiting for its mask."""
+    
+    __slots__ = ("tensor", "size", "mask", "error", "done")
+    
+    def __init__(self, tensor: np.ndarray, size):
+        self.tensor = tensor
+        self.size = size
+        self.mask: Optional[Image.Image] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+def prediction_to_mask(pred: np.ndarray, size) -> Image.Image:
+    """Normalize a raw model output to an 8-bit mask of the given size."""
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / max(ma - mi, 1e-6)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+class MaskBatcher:
+    """
+    Collects concurrent mask predictions into one ONNX run.
+    
+    Callers block in predict() from inference worker threads. The first
+    request to arrive opens a window of `window_ms`; everything that
+    arrives before it closes (up to `max_batch_size`) is stacked into a
+    single input tensor and run together, then the masks are split back
+    out to each caller.
+    """
+    
+    def __init__(self, session, window_ms: float, max_batch_size: int):
+        self.session = session
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._preprocessing = MODEL_PREPROCESSING.get(session.model_name)
+        self._cond = threading.Condition()
+        self._pending: List[_PendingMask] = []
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        
+    @property
+    def enabled(self) -> bool:
+        """Whether predictions are batched for this session."""
+        if self._closed or self.max_batch_size <= 1 or self._preprocessing is None:
+            return False
+        # Models exported with a fixed batch dimension of 1 can't be batched
+        batch_dim = self.session.inner_session.get_inputs()[0].shape[0]
+        return not (isinstance(batch_dim, int) and batch_dim == 1)
+        
+    def predict(self, image: Image.Image) -> Image.Image:
+        """Predict the foreground mask for `image`, batching when possible."""
+        return self.predict_many([image])[0]
+        
+    def predict_many(self, images: List[Image.Image]) -> List[Image.Image]:
+        """
+        Predict masks for several images (e.g. tiles of one image).
+        
+        They're queued together, so they share batches with each other and
+        with concurrent requests instead of each waiting out a window.
+        """
+        if not self.enabled:
+            masks = []
+            for image in images:
+                batch_size.observe(1)
+                masks.append(self.session.predict(image)[0])
+            return masks
+            
+        mean, std, size = self._preprocessing
+        requests = []
+        for image in images:
+            # Resize first: rembg's normalize() would otherwise make a full-size RGB copy
+            inputs = self.session.normalize(image.resize(size, Image.Resampling.LANCZOS), mean, std, size)
+            requests.append(_PendingMask(next(iter(inputs.values())), image.size))
+            
+        with self._cond:
+            self._ensure_thread()
+            self._pending.extend(requests)
+            self._cond.notify()
+            
+        for request in requests:
+            request.done.wait()
+        for request in requests:
+            if request.error is not None:
+                raise request.error
+        return [request.mask for request in requests]
+        
+    def close(self):
+        """Stop the batching thread once pending requests are served."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._loop, name="mask-batcher", daemon=True
+            )
+            self._thread.start()
+            
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._run_batch(batch)
+            
+    def _run_batch(self, batch: List[_PendingMask]):
+        try:
+            input_name = self.session.inner_session.get_inputs()[0].name
+            stacked = np.concatenate([request.tensor for request in batch])
+            outputs = self.session.inner_session.run(None, {input_name: stacked})
+            batch_size.observe(len(batch))
+            for request, pred in zip(batch, outputs[0][:, 0, :, :]):
+                request.mask = prediction_to_mask(pred, request.size)
+        except Exception as e:
+            for request in batch:
+                if request.mask is None:
+                    request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,46 @@
+"""Cooperative cancellation of removals running on worker threads."""
+import threading
+import time
+from typing import Optional
+
+
+class RemovalCancelled(Exception):
+    """Everyone waiting for this removal went away, so it was abandoned."""
+
+
+class DeadlineExceeded(RemovalCancelled):
+    """The request's deadline passed before its removal finished."""
+
+
+class CancelScope:
+    """
+    Cancelled from the event loop, checked by the pipeline between stages.
+    
+    A thread can't be interrupted, so an abandoned removal stops at the next
+    stage boundary instead of finishing matting and encoding for nobody.
+    With a `deadline` (a time.monotonic() value, which is shared by the
+    processes on a host) the scope also expires by itself, so work that
+    waited too long in a queue is dropped without the event loop's help.
+    """
+    
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self._event = threading.Event()
+        
+    def cancel(self):
+        self._event.set()
+        
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+        
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+        
+    def check(self):
+        """Raise RemovalCancelled (or DeadlineExceeded) if the work should stop."""
+        if self.expired:
+            raise DeadlineExceeded()
+        if self._event.is_set():
+            raise RemovalCancelled()
@@ -0,0 +1,398 @@
+"""Paid credit ledger, and charging a use to paid credits or the free tier."""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app.config import settings
+from app.metrics import credit_cache_hits, credit_cache_misses, credit_ledger_errors, credits_consumed, TOOL_NAME
+from app.services.rate_limiter import refund_usage, try_consume
+
+metadata = sa.MetaData()
+
+# One row per device: the hot path reads and decrements it by primary key
+credit_accounts = sa.Table(
+    "credit_accounts",
+    metadata,
+    sa.Column("device_id", sa.String(128), primary_key=True),
+    sa.Column("credits", sa.Integer, nullable=False, server_default="0"),
+    sa.Column("unlimited_until", sa.BigInteger, nullable=False, server_default="0"),
+    sa.Column("updated_at", sa.BigInteger, nullable=False),
+    sa.CheckConstraint("credits >= 0", name="ck_credit_accounts_credits"),
+)
+
+# Purchases, for audit; order_id makes repeated webhooks for one order harmless
+credit_grants = sa.Table(
+    "credit_grants",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("order_id", sa.String(128), nullable=False, unique=True),
+    sa.Column("device_id", sa.String(128), nullable=False, index=True),
+    sa.Column("product_sku", sa.String(64), nullable=False),
+    sa.Column("credits", sa.Integer, nullable=False),
+    sa.Column("unlimited_days", sa.Integer, nullable=False, server_default="0"),
+    sa.Column("amount_cents", sa.Integer, nullable=False, server_default="0"),
+    sa.Column("currency", sa.String(8), nullable=False, server_default="USD"),
+    sa.Column("created_at", sa.BigInteger, nullable=False),
+)
+
+# Webhook events already applied, so provider retries are skipped
+processed_events = sa.Table(
+    "processed_events",
+    metadata,
+    sa.Column("event_key", sa.String(128), primary_key=True),
+    sa.Column("event_type", sa.String(64), nullable=False),
+    sa.Column("processed_at", sa.BigInteger, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Balance:
+    """A device's paid credits."""
+    credits: int = 0
+    unlimited_until: int = 0
+    
+    @property
+    def unlimited(self) -> bool:
+        return self.unlimited_until > time.time()
+        
+    @property
+    def usable(self) -> bool:
+        return self.unlimited or self.credits > 0
+
+
+NO_CREDITS = Balance()
+
+
+class CreditLedger:
+    """
+    Paid credits per device, stored with SQLAlchemy's async engine.
+    
+    Works with PostgreSQL (asyncpg) in production and SQLite (aiosqlite)
+    locally and in tests. Taking a credit is a single conditional UPDATE,
+    so concurrent requests can never spend the same credit twice.
+    
+    Balances are cached in memory for `cache_ttl` seconds so the
+    per-request "does this device have credits?" check usually needs no
+    database round trip; this process's own writes update the cache
+    immediately. If the database is unreachable the ledger reports no
+    credits for `retry_after` seconds instead of failing requests.
+    """
+    
+    def __init__(
+        self,
+        url: str,
+        cache_ttl: float = 30,
+        cache_max_entries: int = 100_000,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        retry_after: float = 5,
+    ):
+        self.url = url
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.retry_after = retry_after
+        self._engine = None
+        self._schema_ready = False
+        self._cache: "OrderedDict[str, Tuple[Balance, float]]" = OrderedDict()
+        self._unavailable_until = 0.0
+        
+    @property
+    def engine(self):
+        if self._engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            
+            options = {"pool_pre_ping": True}
+            if self.url.startswith("sqlite"):
+                if ":memory:" in self.url:
+                    # One shared connection, or every checkout would see an empty database
+                    options["poolclass"] = sa.pool.StaticPool
+            else:
+                options.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+            self._engine = create_async_engine(self.url, **options)
+        return self._engine
+        
+    async def start(self):
+        """Create the tables if they don't exist yet."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+        self._schema_ready = True
+        
+    async def close(self):
+        """Close pooled connections."""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+        self._schema_ready = False
+        self._cache.clear()
+        
+    def clear_cache(self):
+        self._cache.clear()
+        
+    async def _ready(self):
+        if not self._schema_ready:
+            await self.start()
+            
+    def _available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+        
+    def _failed(self, e: Exception):
+        credit_ledger_errors.labels(tool=TOOL_NAME).inc()
+        self._unavailable_until = time.monotonic() + self.retry_after
+        print(f"Credit ledger unavailable, using the free tier only for {self.retry_after:g}s: {e}")
+        
+    def _cached(self, device_id: str) -> Optional[Balance]:
+        entry = self._cache.get(device_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        self._cache.move_to_end(device_id)
+        return entry[0]
+        
+    def _remember(self, device_id: str, balance: Balance):
+        self._cache[device_id] = (balance, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(device_id)
+        while len(self._cache) > self.cache_max_entries:
+            self._cache.popitem(last=False)
+            
+    async def balance(self, device_id: str, fresh: bool = False) -> Balance:
+        """A device's balance, from the cache unless `fresh` (read-through)."""
+        if not fresh:
+            cached = self._cached(device_id)
+            if cached is not None:
+                credit_cache_hits.inc()
+                return cached
+            credit_cache_misses.inc()
+        if not self._available():
+            return NO_CREDITS
+            
+        try:
+            await self._ready()
+            async with self.engine.connect() as conn:
+                row = (await conn.execute(
+                    sa.select(credit_accounts.c.credits, credit_accounts.c.unlimited_until)
+                    .where(credit_accounts.c.device_id == device_id)
+                )).first()
+        except (SQLAlchemyError, OSError) as e:
+            self._failed(e)
+            return NO_CREDITS
+        balance = Balance(row.credits, row.unlimited_until) if row else NO_CREDITS
+        self._remember(device_id, balance)
+        return balance
+        
+    async def has_credits(self, device_id: str, fresh: bool = False) -> bool:
+        return (await self.balance(device_id, fresh)).usable
+        
+    async def consume(self, device_id: str) -> Optional[Balance]:
+        """
+        Take one credit, or one use of an active unlimited plan, atomically.
+        
+        Returns:
+            The balance afterwards, or None if the device had nothing to spend
+        """
+        if not self._available():
+            return None
+        now = int(time.time())
+        unlimited = credit_accounts.c.unlimited_until > now
+        statement = (
+            sa.update(credit_accounts)
+            .where(credit_accounts.c.device_id == device_id)
+            .where(sa.or_(credit_accounts.c.credits > 0, unlimited))
+            .values(
+                credits=sa.case((unlimited, credit_accounts.c.credits), else_=credit_accounts.c.credits - 1),
+                updated_at=now,
+            )
+            .returning(credit_accounts.c.credits, credit_accounts.c.unlimited_until)
+        )
+        try:
+            await self._ready()
+            async with self.engine.begin() as conn:
+                row = (await conn.execute(statement)).first()
+        except (SQLAlchemyError, OSError) as e:
+            self._failed(e)
+            return None
+        if row is None:
+            self._remember(device_id, NO_CREDITS)
+            return None
+        balance = Balance(row.credits, row.unlimited_until)
+        self._remember(device_id, balance)
+        credits_consumed.inc()
+        return balance
+        
+    async def refund(self, device_id: str) -> Optional[Balance]:
+        """Give back a credit taken by consume() for a request that failed."""
+        try:
+            await self._ready()
+            async with self.engine.begin() as conn:
+                row = (await conn.execute(
+                    sa.update(credit_accounts)
+                    .where(credit_accounts.c.device_id == device_id)
+                    .values(credits=credit_accounts.c.credits + 1, updated_at=int(time.time()))
+                    .returning(credit_accounts.c.credits, credit_accounts.c.unlimited_until)
+                )).first()
+        except (SQLAlchemyError, OSError) as e:
+            self._failed(e)
+            return None
+        if row is None:
+            return None
+        balance = Balance(row.credits, row.unlimited_until)
+        self._remember(device_id, balance)
+        return balance
+        
+    async def grant(
+        self,
+        device_id: str,
+        order_id: str,
+        product_sku: str,
+        credits: int = 0,
+        unlimited_days: int = 0,
+        amount_cents: int = 0,
+        currency: str = "USD",
+    ) -> bool:
+        """
+        Add purchased credits (or unlimited days) to a device's account.
+        
+        Returns:
+            False if this order was already granted (e.g. a redelivered webhook)
+            
+        Raises:
+            SQLAlchemyError: If the database write fails; the payment must not be lost
+        """
+        now = int(time.time())
+        await self._ready()
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(credit_grants.insert().values(
+                    order_id=order_id,
+                    device_id=device_id,
+                    product_sku=product_sku,
+                    credits=credits,
+                    unlimited_days=unlimited_days,
+                    amount_cents=amount_cents,
+                    currency=currency,
+                    created_at=now,
+                ))
+                await conn.execute(self._upsert_account(device_id, credits, unlimited_days * 86400, now))
+        except IntegrityError:
+            return False
+        self._cache.pop(device_id, None)
+        return True
+        
+    async def seen_events(self, event_keys) -> set:
+        """Which of these webhook events were already applied (one indexed lookup)."""
+        if not event_keys:
+            return set()
+        await self._ready()
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(
+                sa.select(processed_events.c.event_key)
+                .where(processed_events.c.event_key.in_(list(event_keys)))
+            )
+            return {row.event_key for row in rows}
+            
+    async def record_events(self, events):
+        """Mark (event_key, event_type) pairs as applied."""
+        if not events:
+            return
+        now = int(time.time())
+        await self._ready()
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                self._insert(processed_events).on_conflict_do_nothing(),
+                [{"event_key": key, "event_type": kind, "processed_at": now} for key, kind in events],
+            )
+            
+    def _insert(self, table):
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(table)
+        
+    def _upsert_account(self, device_id: str, credits: int, unlimited_seconds: int, now: int):
+        statement = self._insert(credit_accounts).values(
+            device_id=device_id,
+            credits=credits,
+            unlimited_until=now + unlimited_seconds if unlimited_seconds else 0,
+            updated_at=now,
+        )
+        current = credit_accounts.c.unlimited_until
+        # Unlimited time extends an active plan rather than overlapping it
+        extended = sa.case((current > now, current), else_=now) + unlimited_seconds
+        return statement.on_conflict_do_update(
+            index_elements=[credit_accounts.c.device_id],
+            set_={
+                "credits": credit_accounts.c.credits + credits,
+                "unlimited_until": extended if unlimited_seconds else current,
+                "updated_at": now,
+            },
+        )
+
+
+@dataclass(frozen=True)
+class Charge:
+    """How one use was paid for."""
+    allowed: bool
+    paid: bool = False
+    # Credit taken from the balance (False under an unlimited plan or on the free tier)
+    credit_taken: bool = False
+    credits: Optional[Balance] = None
+    free_remaining: int = 0
+    reset_at: int = 0
+
+
+async def charge_use(device_id: str, ledger: Optional[CreditLedger] = None) -> Charge:
+    """
+    Charge one use to the device's paid credits, falling back to the free tier.
+    
+    A cached "no credits" is trusted only while free uses remain; once
+    they're gone the ledger is asked directly, so a purchase made through
+    another worker is honoured before the request is refused.
+    """
+    ledger = ledger or credit_ledger
+    tried_ledger = False
+    if await ledger.has_credits(device_id):
+        tried_ledger = True
+        balance = await ledger.consume(device_id)
+        if balance is not None:
+            return _paid_charge(balance)
+            
+    allowed, remaining, reset_at = await try_consume(device_id)
+    if allowed:
+        return Charge(allowed=True, free_remaining=remaining, reset_at=reset_at)
+        
+    if not tried_ledger:
+        balance = await ledger.consume(device_id)
+        if balance is not None:
+            return _paid_charge(balance)
+    return Charge(allowed=False, free_remaining=0, reset_at=reset_at)
+
+
+def _paid_charge(balance: Balance) -> Charge:
+    return Charge(allowed=True, paid=True, credit_taken=not balance.unlimited, credits=balance)
+
+
+async def refund_use(device_id: str, charge: Charge, ledger: Optional[CreditLedger] = None) -> Charge:
+    """Undo `charge`; returns the charge updated with the new remaining count."""
+    if not charge.allowed:
+        return charge
+    if charge.paid:
+        if charge.credit_taken:
+            balance = await (ledger or credit_ledger).refund(device_id)
+            return Charge(allowed=True, paid=True, credit_taken=False, credits=balance or charge.credits)
+        return charge
+    return Charge(allowed=True, free_remaining=await refund_usage(device_id), reset_at=charge.reset_at)
+
+
+credit_ledger = CreditLedger(
+    settings.DATABASE_URL,
+    cache_ttl=settings.CREDIT_CACHE_TTL_SECONDS,
+    cache_max_entries=settings.CREDIT_CACHE_MAX_ENTRIES,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    retry_after=settings.CREDIT_LEDGER_RETRY_SECONDS,
+)
@@ -0,0 +1,62 @@
+"""Output image encoding."""
+import io
+import time
+from dataclasses import dataclass
+
+from PIL import Image
+
+from app.config import settings
+from app.metrics import encode_duration, output_size
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """How a result is returned to the client."""
+    media_type: str
+    extension: str
+
+
+OUTPUT_FORMATS = {
+    # Low zlib level, no optimize pass: fastest PNG, somewhat larger files
+    "png-fast": OutputFormat("image/png", "png"),
+    # Max compression with Pillow's optimize pass: smallest PNG, slowest
+    "png-optimized": OutputFormat("image/png", "png"),
+    # Lossy RGB with alpha
+    "webp": OutputFormat("image/webp", "webp"),
+    "webp-lossless": OutputFormat("image/webp", "webp"),
+    # 8-bit grayscale alpha only, for clients that composite themselves
+    "mask": OutputFormat("image/png", "png"),
+}
+
+
+def encode_output(image: Image.Image, output_format: str) -> bytes:
+    """
+    Encode an RGBA cutout in the requested output format.
+    
+    Args:
+        image: RGBA cutout
+        output_format: One of OUTPUT_FORMATS
+        
+    Returns:
+        Encoded image bytes
+    """
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    
+    if output_format == "png-fast":
+        image.save(buffer, format="PNG", compress_level=settings.PNG_FAST_COMPRESS_LEVEL)
+    elif output_format == "png-optimized":
+        image.save(buffer, format="PNG", optimize=True)
+    elif output_format == "webp":
+        image.save(buffer, format="WEBP", quality=settings.WEBP_QUALITY, method=settings.WEBP_METHOD)
+    elif output_format == "webp-lossless":
+        image.save(buffer, format="WEBP", lossless=True, quality=0, method=settings.WEBP_METHOD)
+    elif output_format == "mask":
+        image.getchannel("A").save(buffer, format="PNG", compress_level=settings.PNG_FAST_COMPRESS_LEVEL)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+        
+    output_bytes = buffer.getvalue()
+    encode_duration(output_format).observe(time.perf_counter() - start)
+    output_size(output_format).observe(len(output_bytes))
+    return output_bytes
@@ -0,0 +1,179 @@
+"""Image decoding and alpha compositing for large inputs."""
+import io
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image has more pixels than MAX_MEGAPIXELS."""
+
+
+def check_megapixels(width: int, height: int, max_megapixels: float):
+    """
+    Raises:
+        ImageTooLarge: If width x height exceeds `max_megapixels`
+    """
+    megapixels = width * height / 1_000_000
+    if megapixels > max_megapixels:
+        raise ImageTooLarge(
+            f"Image is {megapixels:.1f} megapixels. Maximum: {max_megapixels:g} megapixels"
+        )
+
+
+def open_image(image_bytes: bytes, max_megapixels: float) -> Image.Image:
+    """
+    Open an image lazily and enforce the pixel limit.
+    
+    Only the header is parsed, so oversized images are rejected before
+    any pixel data is decoded.
+    
+    Raises:
+        ImageTooLarge: If the image exceeds `max_megapixels`
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    check_megapixels(image.width, image.height, max_megapixels)
+    return image
+
+
+def oriented_size(image: Image.Image) -> Tuple[int, int]:
+    """Size of an opened image once its EXIF orientation is applied, without decoding."""
+    # Orientations 5-8 rotate by 90 degrees
+    if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+        return image.height, image.width
+    return image.size
+
+
+def decode_working_copy(image: Image.Image, max_side: int) -> Image.Image:
+    """
+    Decode an opened image at no more than `max_side` pixels on the long edge.
+    
+    JPEGs are decoded directly at a reduced scale (draft mode), so the
+    full-resolution pixels never need to be in memory for segmentation.
+    The result is always RGB, converted once here so later stages never
+    need a converted copy of their own.
+    """
+    scale = max_side / max(image.size)
+    if scale < 1:
+        image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+    image.load()
+    ImageOps.exif_transpose(image, in_place=True)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def decode_full(image_bytes: bytes) -> Image.Image:
+    """Decode an image at full resolution with EXIF orientation applied."""
+    # BytesIO over bytes shares the buffer rather than copying it
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    ImageOps.exif_transpose(image, in_place=True)
+    return image
+
+
+def _box(values: np.ndarray, radius: int, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    return cv2.boxFilter(values, -1, (2 * radius + 1, 2 * radius + 1), dst=dst, borderType=cv2.BORDER_REFLECT)
+
+
+def guided_upsample_alpha(
+    alpha: Image.Image,
+    guide: Image.Image,
+    radius: int,
+    eps: float,
+    band_rows: int = 256,
+) -> Image.Image:
+    """
+    Upsample a low-resolution alpha matte to the guide's size, edge-aware.
+    
+    Fast guided filter (He & Sun, 2015): the linear coefficients that map
+    guide intensity to alpha are fitted at the alpha's resolution, then
+    bilinearly upsampled and applied to the full-resolution guide. Edges
+    in the output follow edges in the original photo rather than the
+    blurry outline of a plain resize.
+    
+    The full-resolution pass runs in bands of `band_rows` rows so its
+    temporary float buffers stay small regardless of image size.
+    
+    Args:
+        alpha: Alpha matte ("L") at working resolution
+        guide: Image at output resolution
+        radius: Filter radius in working-resolution pixels
+        eps: Regularization; larger values smooth more
+        
+    Returns:
+        Alpha matte ("L") at the guide's size
+    """
+    small_w, small_h = alpha.size
+    full_w, full_h = guide.size
+    
+    # The fit runs at working resolution in float32; intermediates are
+    # computed in place so only a handful of working-size buffers are alive
+    guide_gray = guide.convert("L")
+    p = np.asarray(alpha, dtype=np.float32)
+    p *= 1 / 255
+    i_small = np.asarray(guide_gray.resize(alpha.size, Image.Resampling.BILINEAR), dtype=np.float32)
+    i_small *= 1 / 255
+    
+    mean_i = _box(i_small, radius)
+    mean_p = _box(p, radius)
+    scratch = np.multiply(i_small, p, out=p)
+    cov_ip = _box(scratch, radius)
+    cov_ip -= np.multiply(mean_i, mean_p, out=scratch)
+    var_i = _box(np.multiply(i_small, i_small, out=i_small), radius)
+    var_i -= np.multiply(mean_i, mean_i, out=scratch)
+    var_i += eps
+    del i_small
+    a = np.divide(cov_ip, var_i, out=cov_ip)
+    b = np.subtract(mean_p, np.multiply(a, mean_i, out=scratch), out=mean_p)
+    mean_a = _box(a, radius, dst=var_i)
+    mean_b = _box(b, radius, dst=mean_i)
+    del a, b, scratch
+    
+    output = np.empty((full_h, full_w), dtype=np.uint8)
+    map_x = ((np.arange(full_w, dtype=np.float32) + 0.5) * (small_w / full_w) - 0.5)
+    
+    for y0 in range(0, full_h, band_rows):
+        y1 = min(full_h, y0 + band_rows)
+        rows = (np.arange(y0, y1, dtype=np.float32) + 0.5) * (small_h / full_h) - 0.5
+        band_map_x = np.broadcast_to(map_x, (y1 - y0, full_w)).copy()
+        band_map_y = np.broadcast_to(rows[:, None], (y1 - y0, full_w)).copy()
+        band = cv2.remap(mean_a, band_map_x, band_map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        band_b = cv2.remap(mean_b, band_map_x, band_map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        # Only this band of the guide is copied out of Pillow
+        guide_band = np.asarray(guide_gray.crop((0, y0, full_w, y1)), dtype=np.float32)
+        band *= guide_band
+        band *= 1 / 255
+        band += band_b
+        band *= 255
+        band += 0.5
+        np.clip(band, 0, 255, out=band)
+        output[y0:y1] = band
+        
+    # fromarray wraps the array's buffer for "L" rather than copying it
+    return Image.fromarray(output, mode="L")
+
+
+def composite_alpha(image: Image.Image, alpha: Image.Image) -> Image.Image:
+    """
+    Attach `alpha` to the original pixels of `image`.
+    
+    An RGB `image` is turned into the RGBA result in place, so the decoded
+    pixels are reused rather than copied; don't use `image` afterwards.
+    Fully transparent pixels are cleared to black so the removed
+    background can't be recovered from the output (and compresses well).
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.putalpha(alpha)
+    image.paste(0, mask=alpha.point(_TRANSPARENT))
+    return image
+
+
+# Point table selecting fully transparent pixels
+_TRANSPARENT = [255] + [0] * 255
+
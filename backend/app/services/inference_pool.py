@@ -0,0 +1,112 @@
+"""Bounded worker pool for CPU-bound inference work."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from app.config import settings
+from app.metrics import queue_depth, queue_rejected, queue_wait
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference pool cannot admit more work."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Thread pool that keeps inference off the event loop.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more
+    may wait for a worker. Anything beyond that is rejected immediately
+    with InferenceQueueFull so callers can shed load instead of queueing
+    without bound.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after: int = 5):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of jobs running or waiting at once."""
+        return self.max_workers + self.max_queue
+
+    @property
+    def queued(self) -> int:
+        """Number of admitted jobs still waiting for a worker."""
+        return max(0, self._admitted - self._running)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+            )
+        return self._executor
+
+    def _update_depth(self):
+        queue_depth.set(self.queued)
+
+    def _release(self, _future):
+        with self._lock:
+            self._admitted -= 1
+            self._update_depth()
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run `fn(*args)` on a worker thread and await its result.
+
+        Raises:
+            InferenceQueueFull: If the pool is already at capacity
+        """
+        with self._lock:
+            if self._admitted >= self.capacity:
+                queue_rejected.inc()
+                raise InferenceQueueFull(self.retry_after)
+            self._admitted += 1
+            self._update_depth()
+
+        queued_at = time.perf_counter()
+
+        def job():
+            with self._lock:
+                self._running += 1
+                self._update_depth()
+            queue_wait.observe(time.perf_counter() - queued_at)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            future = self._get_executor().submit(job)
+        except Exception:
+            self._release(None)
+            raise
+        # Released on completion or cancellation, even if the caller goes away
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+inference_pool = InferencePool(
+    settings.INFERENCE_WORKERS,
+    settings.INFERENCE_QUEUE_SIZE,
+    settings.INFERENCE_RETRY_AFTER_SECONDS,
+)
@@ -0,0 +1,355 @@
+"""
+Inference worker processes shared by several HTTP worker processes.
+
+In multi-process serving (python -m app.serve) model sessions live only
+in a few inference processes; HTTP workers hand them image buffers
+through shared memory and get the encoded result back the same way, so
+adding HTTP workers doesn't add copies of the models.
+
+    HTTP worker --(task queue: shm name, options)--> supervisor dispatcher
+    dispatcher --(inbox of an idle worker)---------> inference worker
+    HTTP worker <--(its result queue: shm name)----- inference worker
+
+The supervisor restarts inference workers that crash, recycles those
+that grow past INFERENCE_WORKER_MAX_RSS_MB, and fails the task a crashed
+worker was holding so its caller doesn't wait for a timeout. Tasks carry
+their request's deadline; a worker skips tasks that waited past it.
+"""
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+from app.metrics import inference_worker_restarts, mark_process_dead, TOOL_NAME
+from app.services.cancellation import CancelScope, DeadlineExceeded
+
+# Set in HTTP worker processes started by app.serve; None means in-process inference
+client: Optional["InferenceClient"] = None
+
+# Kill (rather than wait to recycle) workers this far over the RSS limit, e.g. when stuck
+HARD_RSS_FACTOR = 1.5
+
+CRASHED_MESSAGE = "Inference worker crashed while processing this image"
+
+
+class InferenceWorkerError(Exception):
+    """Raised in the HTTP worker when an inference worker fails a task."""
+
+
+def rss_mb(pid: Optional[int] = None) -> float:
+    """Resident memory of a process in MB (Linux; 0 if unavailable)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+
+def write_shared(data: bytes) -> str:
+    """Copy `data` into a new shared memory block and return its name."""
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    name = block.name
+    block.close()
+    return name
+
+
+def read_shared(name: str, size: int, unlink: bool = False) -> bytes:
+    """Copy `size` bytes out of the named shared memory block."""
+    block = shared_memory.SharedMemory(name=name)
+    # Attaching registers the block with this process's resource tracker too;
+    # only the creator's registration should decide when it's cleaned up
+    resource_tracker.unregister(block._name, "shared_memory")
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        if unlink:
+            _unlink(name)
+
+
+def _unlink(name: str):
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def inference_worker_main(
+    slot: int,
+    inbox,
+    result_queues: List,
+    done,
+    ready,
+    preload: List[str],
+    max_rss_mb: int = 0,
+    max_tasks: int = 0,
+):
+    """
+    Body of an inference worker process.
+    
+    Loads and warms `preload`, then processes tasks from its inbox until it
+    receives None, handles `max_tasks` tasks or grows past `max_rss_mb`;
+    the supervisor starts a fresh worker in its place.
+    """
+    from app.config import settings
+    from app.services.background_remover import RemovalOptions, remove_background_sync
+    from app.services.model_registry import model_registry
+    from app.services.model_warmup import load_and_warm, warm_pipeline
+    
+    for name in preload:
+        load_and_warm(model_registry, name)
+    if settings.WARMUP_PIPELINE and preload:
+        warm_pipeline(preload[0])
+    ready[slot] = 1
+    
+    handled = 0
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+        task_id, http_index, input_name, size, options, deadline = task
+        try:
+            cancel = CancelScope(deadline)
+            cancel.check()
+            data = read_shared(input_name, size)
+            result = remove_background_sync(data, RemovalOptions(**options), None, cancel)
+            reply = (task_id, write_shared(result), len(result), None)
+        except Exception as e:
+            reply = (task_id, None, 0, f"{type(e).__name__}: {e}")
+        result_queues[http_index].put(reply)
+        done[slot] += 1
+        
+        handled += 1
+        if (max_tasks and handled >= max_tasks) or (max_rss_mb and rss_mb() > max_rss_mb):
+            break
+
+
+class InferenceClient:
+    """
+    HTTP worker side: sends images to the inference workers and waits for results.
+    
+    process() blocks, so it runs on the inference pool threads and keeps
+    that pool's admission control.
+    """
+    
+    def __init__(self, index: int, task_queue, result_queue, ready, timeout: float = 120):
+        self.index = index
+        self.task_queue = task_queue
+        self.result_queue = result_queue
+        self.ready = ready
+        self.timeout = timeout
+        # Start from the pid so results meant for a previous HTTP worker in
+        # this slot can't be mistaken for ours
+        self._ids = itertools.count(os.getpid() << 32)
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._reader: Optional[threading.Thread] = None
+        
+    @property
+    def ready_workers(self) -> int:
+        """Inference workers that have loaded their models."""
+        return sum(self.ready)
+        
+    def _ensure_reader(self):
+        with self._lock:
+            if self._reader is None:
+                self._reader = threading.Thread(target=self._read_results, name="inference-results", daemon=True)
+                self._reader.start()
+                
+    def _read_results(self):
+        while True:
+            task_id, name, size, error = self.result_queue.get()
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is None:
+                # The caller gave up waiting; nobody will read this result
+                if name:
+                    _unlink(name)
+                continue
+            future.set_result((name, size, error))
+            
+    def process(self, image_bytes: bytes, options: dict, deadline: Optional[float] = None) -> bytes:
+        """
+        Remove the background in an inference worker.
+        
+        Args:
+            image_bytes: Input image
+            options: RemovalOptions as a dict
+            deadline: time.monotonic() after which the worker drops the task
+            
+        Raises:
+            InferenceWorkerError: If the worker failed, crashed or timed out
+            DeadlineExceeded: If `deadline` passed first
+        """
+        self._ensure_reader()
+        task_id = next(self._ids)
+        future: Future = Future()
+        with self._lock:
+            self._pending[task_id] = future
+        input_name = write_shared(image_bytes)
+        timeout = self.timeout if deadline is None else min(self.timeout, max(0, deadline - time.monotonic()))
+        try:
+            self.task_queue.put((task_id, self.index, input_name, len(image_bytes), options, deadline))
+            try:
+                name, size, error = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded()
+                raise InferenceWorkerError(f"Inference timed out after {self.timeout:g}s")
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+            _unlink(input_name)
+            
+        if error:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded()
+            raise InferenceWorkerError(error)
+        return read_shared(name, size, unlink=True)
+
+
+class InferenceSupervisor:
+    """
+    Starts the inference workers, hands them tasks and keeps them running.
+    
+    A dispatcher thread takes tasks from the shared task queue and gives
+    each to an idle, warmed worker through that worker's own inbox. Workers
+    never read a queue shared with other workers, so one killed mid-read
+    can't leave a lock held for its replacement, and the supervisor always
+    knows which task each worker is holding.
+    
+    check() is called periodically by the launcher; it restarts workers
+    that exited (crash, or recycled after hitting a limit) and kills
+    workers far over the memory limit.
+    """
+    
+    def __init__(
+        self,
+        ctx,
+        processes: int,
+        task_queue,
+        result_queues: List,
+        preload: List[str],
+        max_rss_mb: int = 0,
+        max_tasks: int = 0,
+    ):
+        self.ctx = ctx
+        self.processes = processes
+        self.task_queue = task_queue
+        self.result_queues = result_queues
+        self.preload = preload
+        self.max_rss_mb = max_rss_mb
+        self.max_tasks = max_tasks
+        # Tasks finished per slot (written by the worker) and warmed-up flags
+        self.done = ctx.Array("q", processes, lock=False)
+        self.ready = ctx.Array("b", processes, lock=False)
+        self.workers: List = [None] * processes
+        self.inboxes: List = [None] * processes
+        # Per slot: tasks handed out, and the last one as (HTTP worker index, task id)
+        self.assigned = [0] * processes
+        self.in_flight: List[Optional[Tuple[int, int]]] = [None] * processes
+        self._lock = threading.Lock()
+        self._dispatcher: Optional[threading.Thread] = None
+        
+    def _spawn(self, slot: int):
+        self.ready[slot] = 0
+        self.done[slot] = 0
+        self.assigned[slot] = 0
+        self.in_flight[slot] = None
+        self.inboxes[slot] = self.ctx.SimpleQueue()
+        process = self.ctx.Process(
+            target=inference_worker_main,
+            args=(
+                slot, self.inboxes[slot], self.result_queues, self.done, self.ready,
+                self.preload, self.max_rss_mb, self.max_tasks,
+            ),
+            name=f"inference-worker-{slot}",
+            daemon=True,
+        )
+        process.start()
+        self.workers[slot] = process
+        
+    def start(self):
+        for slot in range(self.processes):
+            self._spawn(slot)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="inference-dispatch", daemon=True)
+        self._dispatcher.start()
+        
+    def _idle_slot(self) -> Optional[int]:
+        with self._lock:
+            for slot in range(self.processes):
+                if self.ready[slot] and self.assigned[slot] == self.done[slot]:
+                    return slot
+        return None
+        
+    def _dispatch(self):
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            # Workers report completion through shared counters, so poll for a free one
+            slot = self._idle_slot()
+            while slot is None:
+                time.sleep(0.002)
+                slot = self._idle_slot()
+            with self._lock:
+                self.assigned[slot] += 1
+                self.in_flight[slot] = (task[1], task[0])
+                self.inboxes[slot].put(task)
+                
+    def check(self) -> List[Tuple[int, str]]:
+        """Restart exited workers. Returns (slot, reason) for each restart."""
+        restarted = []
+        for slot, process in enumerate(self.workers):
+            if process.is_alive():
+                if self.max_rss_mb and rss_mb(process.pid) > self.max_rss_mb * HARD_RSS_FACTOR:
+                    print(f"Killing {process.name}: {rss_mb(process.pid):.0f}MB resident")
+                    process.kill()
+                    process.join(5)
+                else:
+                    continue
+                    
+            process.join(0)
+            mark_process_dead(process.pid)
+            reason = "recycle" if process.exitcode == 0 else "crash"
+            with self._lock:
+                if self.assigned[slot] > self.done[slot] and self.in_flight[slot] is not None:
+                    # Fail the image it was working on instead of leaving the caller waiting
+                    http_index, task_id = self.in_flight[slot]
+                    self.result_queues[http_index].put((task_id, None, 0, CRASHED_MESSAGE))
+                self._spawn(slot)
+            inference_worker_restarts.labels(tool=TOOL_NAME, reason=reason).inc()
+            print(f"Restarting {process.name} ({reason}, exit code {process.exitcode})")
+            restarted.append((slot, reason))
+        return restarted
+        
+    def stop(self, timeout: float = 10):
+        """Stop dispatching, ask every worker to exit, then terminate stragglers."""
+        if self._dispatcher is not None:
+            self.task_queue.put(None)
+            self._dispatcher.join(timeout)
+        for inbox in self.inboxes:
+            if inbox is not None:
+                inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.workers:
+            if process is not None:
+                process.join(max(0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+                    process.join(1)
+
+
+def connect(inference_client: InferenceClient):
+    """Route this process's background removals to the inference workers."""
+    global client
+    client = inference_client
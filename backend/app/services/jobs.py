@@ -0,0 +1,635 @@
+"""Asynchronous batch jobs for background removal."""
+import asyncio
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.metrics import jobs_submitted, job_items_processed, job_queue_depth, TOOL_NAME
+from app.services.background_remover import RemovalOptions, remove_background_cached
+from app.services.cancellation import DeadlineExceeded
+from app.services.encoding import OUTPUT_FORMATS
+from app.services.inference_pool import InferenceQueueFull
+from app.services.credits import Charge, charge_use, refund_use
+
+# Lower values are served first
+PRIORITY_PAID = 0
+PRIORITY_FREE = 1
+
+ITEM_QUEUED = "queued"
+ITEM_RUNNING = "running"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+FINISHED_STATUSES = (ITEM_DONE, ITEM_FAILED)
+
+# A running item whose claim is this much older than JOB_ITEM_TIMEOUT_SECONDS
+# belongs to a process that died; it's refunded and queued again
+STALE_CLAIM_GRACE_SECONDS = 60
+
+
+@dataclass
+class JobItem:
+    """One image within a job."""
+    index: int
+    filename: str
+    status: str = ITEM_QUEUED
+    error: Optional[str] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+        
+    def output_filename(self, output_format: str) -> str:
+        stem = self.filename.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        return f"{self.index + 1:03d}_bggone_{stem}.{OUTPUT_FORMATS[output_format].extension}"
+
+
+@dataclass
+class Job:
+    """A batch of images processed in the background."""
+    id: str
+    device_id: str
+    priority: int
+    options: RemovalOptions
+    items: List[JobItem]
+    created_at: float = field(default_factory=time.time)
+    
+    @property
+    def completed(self) -> int:
+        return sum(1 for item in self.items if item.status == ITEM_DONE)
+        
+    @property
+    def failed(self) -> int:
+        return sum(1 for item in self.items if item.status == ITEM_FAILED)
+        
+    @property
+    def finished(self) -> bool:
+        return all(item.finished for item in self.items)
+        
+    @property
+    def status(self) -> str:
+        if self.finished:
+            return ITEM_FAILED if self.completed == 0 else ITEM_DONE
+        if any(item.status != ITEM_QUEUED for item in self.items):
+            return ITEM_RUNNING
+        return ITEM_QUEUED
+
+
+class JobStore:
+    """
+    Storage for jobs, their inputs and their results.
+    
+    Methods are synchronous and may block; JobManager calls them from a
+    worker thread.
+    """
+    
+    def create(self, job: Job, inputs: List[bytes]):
+        raise NotImplementedError
+        
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+        
+    def update_item(self, job_id: str, item: JobItem):
+        raise NotImplementedError
+        
+    def claim(self, job_id: str, index: int) -> bool:
+        """
+        Mark a queued item running. Returns False if it isn't queued.
+        
+        Atomic across every process sharing the store, so each item is
+        processed (and charged) by one worker only.
+        """
+        raise NotImplementedError
+        
+    def record_charge(self, job_id: str, index: int, charge: str):
+        """Note how a claimed item was paid for, so it can be refunded if its worker dies."""
+        raise NotImplementedError
+        
+    def requeue_stale(self, claimed_before: float) -> List[Tuple[str, int, Optional[str]]]:
+        """
+        Put items claimed before `claimed_before` and still running back in
+        the queue. Returns their (job_id, index, charge).
+        """
+        raise NotImplementedError
+        
+    def load_input(self, job_id: str, index: int) -> bytes:
+        raise NotImplementedError
+        
+    def save_result(self, job_id: str, index: int, data: bytes):
+        raise NotImplementedError
+        
+    def load_result(self, job_id: str, index: int) -> Optional[bytes]:
+        raise NotImplementedError
+        
+    def unfinished(self) -> List[Job]:
+        """Jobs with items still queued or running, e.g. after a restart."""
+        raise NotImplementedError
+        
+    def delete_before(self, timestamp: float) -> int:
+        """Delete jobs created before `timestamp`. Returns how many were deleted."""
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """Keeps jobs in process memory. Jobs are lost on restart."""
+    
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._inputs: Dict[Tuple[str, int], bytes] = {}
+        self._results: Dict[Tuple[str, int], bytes] = {}
+        # (job_id, index) -> (claimed_at, charge) for running items
+        self._claims: Dict[Tuple[str, int], Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        
+    def create(self, job, inputs):
+        with self._lock:
+            self._jobs[job.id] = job
+            for index, data in enumerate(inputs):
+                self._inputs[(job.id, index)] = data
+                
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            # Hand out a snapshot so callers can't race with workers
+            return Job(**{**job.__dict__, "items": [JobItem(**asdict(item)) for item in job.items]})
+            
+    def update_item(self, job_id, item):
+        with self._lock:
+            self._jobs[job_id].items[item.index] = JobItem(**asdict(item))
+            if item.status != ITEM_RUNNING:
+                self._claims.pop((job_id, item.index), None)
+            if item.finished:
+                self._inputs.pop((job_id, item.index), None)
+                
+    def claim(self, job_id, index):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.items[index].status != ITEM_QUEUED:
+                return False
+            job.items[index].status = ITEM_RUNNING
+            self._claims[(job_id, index)] = (time.time(), None)
+            return True
+            
+    def record_charge(self, job_id, index, charge):
+        with self._lock:
+            if (job_id, index) in self._claims:
+                self._claims[(job_id, index)] = (self._claims[(job_id, index)][0], charge)
+                
+    def requeue_stale(self, claimed_before):
+        with self._lock:
+            stale = [key for key, (claimed_at, _) in self._claims.items() if claimed_at < claimed_before]
+            requeued = []
+            for job_id, index in stale:
+                _, charge = self._claims.pop((job_id, index))
+                self._jobs[job_id].items[index].status = ITEM_QUEUED
+                requeued.append((job_id, index, charge))
+            return requeued
+            
+    def load_input(self, job_id, index):
+        with self._lock:
+            return self._inputs[(job_id, index)]
+            
+    def save_result(self, job_id, index, data):
+        with self._lock:
+            self._results[(job_id, index)] = data
+            
+    def load_result(self, job_id, index):
+        with self._lock:
+            return self._results.get((job_id, index))
+            
+    def unfinished(self):
+        with self._lock:
+            job_ids = [job.id for job in self._jobs.values() if not job.finished]
+        return [self.get(job_id) for job_id in job_ids]
+        
+    def delete_before(self, timestamp):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.created_at < timestamp]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                for item in job.items:
+                    self._inputs.pop((job_id, item.index), None)
+                    self._results.pop((job_id, item.index), None)
+                    self._claims.pop((job_id, item.index), None)
+            return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Keeps jobs, inputs and results in a local SQLite database.
+    
+    Survives restarts: queued items are re-queued on startup. Several
+    processes may share one database; claim() makes sure each item is
+    processed by only one of them.
+    """
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    device_id TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    options TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_jobs_created_at ON jobs (created_at);
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+                    idx INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    input BLOB,
+                    result BLOB,
+                    claimed_at REAL,
+                    charge TEXT,
+                    PRIMARY KEY (job_id, idx)
+                );
+                CREATE INDEX IF NOT EXISTS ix_job_items_status ON job_items (status);
+                PRAGMA foreign_keys = ON;
+            """)
+            
+    def create(self, job, inputs):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, device_id, priority, options, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job.id, job.device_id, job.priority, json.dumps(asdict(job.options)), job.created_at),
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_items (job_id, idx, filename, status, error, input) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (job.id, item.index, item.filename, item.status, item.error, data)
+                        for item, data in zip(job.items, inputs)
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+                
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, device_id, priority, options, created_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            items = self._conn.execute(
+                "SELECT idx, filename, status, error FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return Job(
+            id=row[0],
+            device_id=row[1],
+            priority=row[2],
+            options=RemovalOptions(**json.loads(row[3])),
+            created_at=row[4],
+            items=[JobItem(index=i[0], filename=i[1], status=i[2], error=i[3]) for i in items],
+        )
+        
+    def update_item(self, job_id, item):
+        with self._lock:
+            if item.finished:
+                # Inputs aren't needed once an item is finished
+                self._conn.execute(
+                    "UPDATE job_items SET status = ?, error = ?, input = NULL, claimed_at = NULL, charge = NULL"
+                    " WHERE job_id = ? AND idx = ?",
+                    (item.status, item.error, job_id, item.index),
+                )
+            elif item.status == ITEM_QUEUED:
+                self._conn.execute(
+                    "UPDATE job_items SET status = ?, error = ?, claimed_at = NULL, charge = NULL"
+                    " WHERE job_id = ? AND idx = ?",
+                    (item.status, item.error, job_id, item.index),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE job_items SET status = ?, error = ? WHERE job_id = ? AND idx = ?",
+                    (item.status, item.error, job_id, item.index),
+                )
+                
+    def claim(self, job_id, index):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE job_items SET status = ?, claimed_at = ?, charge = NULL"
+                " WHERE job_id = ? AND idx = ? AND status = ?",
+                (ITEM_RUNNING, time.time(), job_id, index, ITEM_QUEUED),
+            )
+            return cursor.rowcount == 1
+            
+    def record_charge(self, job_id, index, charge):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_items SET charge = ? WHERE job_id = ? AND idx = ? AND status = ?",
+                (charge, job_id, index, ITEM_RUNNING),
+            )
+            
+    def requeue_stale(self, claimed_before):
+        with self._lock:
+            # Read and requeue in one write transaction, so only one process refunds each item
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = self._conn.execute(
+                    "SELECT job_id, idx, charge FROM job_items"
+                    " WHERE status = ? AND (claimed_at IS NULL OR claimed_at < ?)",
+                    (ITEM_RUNNING, claimed_before),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE job_items SET status = ?, claimed_at = NULL, charge = NULL WHERE job_id = ? AND idx = ?",
+                    [(ITEM_QUEUED, job_id, index) for job_id, index, _ in stale],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return stale
+        
+    def load_input(self, job_id, index):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT input FROM job_items WHERE job_id = ? AND idx = ?", (job_id, index)
+            ).fetchone()
+        return row[0]
+        
+    def save_result(self, job_id, index, data):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_items SET result = ? WHERE job_id = ? AND idx = ?", (data, job_id, index)
+            )
+            
+    def load_result(self, job_id, index):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM job_items WHERE job_id = ? AND idx = ?", (job_id, index)
+            ).fetchone()
+        return row[0] if row else None
+        
+    def unfinished(self):
+        with self._lock:
+            job_ids = [
+                row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT job_id FROM job_items WHERE status IN (?, ?)", (ITEM_QUEUED, ITEM_RUNNING)
+                )
+            ]
+        return [self.get(job_id) for job_id in job_ids]
+        
+    def delete_before(self, timestamp):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE created_at < ?", (timestamp,))
+            return cursor.rowcount
+
+
+def create_job_store() -> JobStore:
+    """Create the job store selected by JOB_STORE."""
+    if settings.JOB_STORE == "sqlite":
+        return SQLiteJobStore(settings.JOB_STORE_PATH)
+    if settings.JOB_STORE == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"Unknown JOB_STORE: {settings.JOB_STORE}")
+
+
+class JobManager:
+    """
+    Runs job items from an in-process priority queue.
+    
+    Items from paid jobs are dequeued before free ones; within a priority
+    items run in submission order. Each item goes through the same cached
+    pipeline as /api/v1/remove-bg and is charged individually, once the
+    worker has claimed it in the store.
+    
+    With JOB_STORE=sqlite several processes can share one database: each
+    queues every waiting item, and the claim decides which one runs it.
+    JOB_STORE=memory only works with a single process, since the other
+    processes can't see its jobs.
+    """
+    
+    def __init__(self, store: JobStore, workers: int):
+        self.store = store
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Set[asyncio.TimerHandle] = set()
+        self._sequence = itertools.count()
+        self._updated: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
+    @property
+    def running(self) -> bool:
+        # Workers belong to the loop that started them
+        return bool(self._tasks) and self._loop is asyncio.get_running_loop()
+        
+    async def start(self):
+        """Start the workers and re-queue items left over from a previous run."""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._updated = asyncio.Condition()
+        
+        await self._delete_expired()
+        await self._requeue_stale()
+        for job in await asyncio.to_thread(self.store.unfinished):
+            for item in job.items:
+                # Running items belong to a live worker, possibly in another process
+                if item.status == ITEM_QUEUED:
+                    self._enqueue(job, item.index)
+                    
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        
+    async def stop(self):
+        """Stop the workers. Unfinished items stay in the store."""
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if not self.running:
+            self._tasks = []
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        
+    async def _requeue_stale(self):
+        """Refund and re-queue items whose worker died mid-way, e.g. in a crashed process."""
+        claimed_before = time.time() - settings.JOB_ITEM_TIMEOUT_SECONDS - STALE_CLAIM_GRACE_SECONDS
+        for job_id, index, charge in await asyncio.to_thread(self.store.requeue_stale, claimed_before):
+            job = await self.get(job_id)
+            if job is None:
+                continue
+            if charge is not None:
+                await refund_use(job.device_id, _charge_from_record(charge))
+            self._enqueue(job, index)
+            
+    async def _delete_expired(self):
+        """Drop jobs older than JOB_TTL_HOURS, with their inputs and results."""
+        await asyncio.to_thread(self.store.delete_before, time.time() - settings.JOB_TTL_HOURS * 3600)
+        
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(STALE_CLAIM_GRACE_SECONDS)
+            try:
+                await self._requeue_stale()
+                await self._delete_expired()
+            except Exception as e:
+                print(f"Job store maintenance failed: {e}")
+                
+    def _enqueue(self, job: Job, index: int):
+        self._queue.put_nowait((job.priority, next(self._sequence), job.id, index))
+        job_queue_depth.labels(tool=TOOL_NAME).set(self._queue.qsize())
+        
+    async def submit(
+        self,
+        device_id: str,
+        files: List[Tuple[str, bytes]],
+        options: RemovalOptions,
+        priority: int = PRIORITY_FREE,
+    ) -> Job:
+        """Create a job for `files` (filename, bytes) and queue its items."""
+        await self.start()
+        job = Job(
+            id=uuid.uuid4().hex,
+            device_id=device_id,
+            priority=priority,
+            options=options,
+            items=[JobItem(index=i, filename=name) for i, (name, _) in enumerate(files)],
+        )
+        await asyncio.to_thread(self.store.create, job, [data for _, data in files])
+        for item in job.items:
+            self._enqueue(job, item.index)
+        jobs_submitted.labels(tool=TOOL_NAME).inc()
+        return job
+        
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.store.get, job_id)
+        
+    async def load_result(self, job_id: str, index: int) -> Optional[bytes]:
+        return await asyncio.to_thread(self.store.load_result, job_id, index)
+        
+    async def _notify(self):
+        async with self._updated:
+            self._updated.notify_all()
+            
+    async def wait_for_update(self, timeout: float):
+        """Wait until any job item changes state, or `timeout` seconds."""
+        await self.start()
+        async with self._updated:
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+                
+    async def iter_finished(self, job_id: str) -> AsyncIterator[JobItem]:
+        """Yield the job's items as they finish, until all are finished."""
+        seen = set()
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            for item in job.items:
+                if item.finished and item.index not in seen:
+                    seen.add(item.index)
+                    yield item
+            if job.finished:
+                return
+            await self.wait_for_update(timeout=1.0)
+            
+    async def _worker(self):
+        while True:
+            _, _, job_id, index = await self._queue.get()
+            job_queue_depth.labels(tool=TOOL_NAME).set(self._queue.qsize())
+            try:
+                await self._process(job_id, index)
+            except Exception as e:
+                print(f"Job {job_id} item {index} crashed: {e}")
+            finally:
+                self._queue.task_done()
+                
+    async def _update(self, job_id: str, item: JobItem):
+        await asyncio.to_thread(self.store.update_item, job_id, item)
+        await self._notify()
+        
+    def _retry_later(self, job: Job, index: int, delay: float):
+        def retry():
+            self._retries.discard(handle)
+            self._enqueue(job, index)
+            
+        handle = self._loop.call_later(delay, retry)
+        self._retries.add(handle)
+        
+    async def _process(self, job_id: str, index: int):
+        job = await self.get(job_id)
+        if job is None or job.items[index].status != ITEM_QUEUED:
+            return
+        # Another worker (or process) may have taken it since it was queued
+        if not await asyncio.to_thread(self.store.claim, job_id, index):
+            return
+        item = job.items[index]
+        item.status = ITEM_RUNNING
+        await self._notify()
+        
+        # Quota is charged per image, at processing time
+        charge = await charge_use(job.device_id)
+        if not charge.allowed:
+            item.status, item.error = ITEM_FAILED, "No credits or free uses left"
+        else:
+            try:
+                await asyncio.to_thread(self.store.record_charge, job_id, index, _charge_record(charge))
+                data = await asyncio.to_thread(self.store.load_input, job_id, index)
+                deadline = time.monotonic() + settings.JOB_ITEM_TIMEOUT_SECONDS
+                result, cache_hit = await remove_background_cached(data, job.options, deadline=deadline)
+                await asyncio.to_thread(self.store.save_result, job_id, index, result)
+                if cache_hit and not settings.RESULT_CACHE_CHARGE_HITS:
+                    await refund_use(job.device_id, charge)
+                item.status = ITEM_DONE
+            except InferenceQueueFull as e:
+                # Interactive requests have the pool; give the item back and try again shortly
+                await refund_use(job.device_id, charge)
+                item.status = ITEM_QUEUED
+                await self._update(job_id, item)
+                self._retry_later(job, index, e.retry_after)
+                return
+            except asyncio.CancelledError:
+                # Shutting down: leave the item queued for the next run, uncharged
+                await asyncio.shield(self._release(job, item, charge))
+                raise
+            except DeadlineExceeded:
+                await refund_use(job.device_id, charge)
+                item.status, item.error = ITEM_FAILED, f"Timed out after {settings.JOB_ITEM_TIMEOUT_SECONDS:g}s"
+            except Exception as e:
+                await refund_use(job.device_id, charge)
+                item.status, item.error = ITEM_FAILED, f"Failed to process image: {e or type(e).__name__}"
+                
+        job_items_processed.labels(tool=TOOL_NAME, status=item.status).inc()
+        await self._update(job_id, item)
+        
+    async def _release(self, job: Job, item: JobItem, charge: Charge):
+        await refund_use(job.device_id, charge)
+        item.status = ITEM_QUEUED
+        await asyncio.to_thread(self.store.update_item, job.id, item)
+
+
+def _charge_record(charge: Charge) -> str:
+    if charge.credit_taken:
+        return "credit"
+    return "paid" if charge.paid else "free"
+
+
+def _charge_from_record(record: str) -> Charge:
+    return Charge(allowed=True, paid=record != "free", credit_taken=record == "credit")
+
+
+job_manager = JobManager(create_job_store(), settings.JOB_WORKERS)
@@ -0,0 +1,437 @@
+"""Registry of warm rembg model sessions."""
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from typing import TYPE_CHECKING, Callable, Dict, List
+
+from app.config import settings
+from app.metrics import model_loaded, model_load_duration, model_evictions, TOOL_NAME
+from app.services.batcher import MaskBatcher
+
+if TYPE_CHECKING:
+    import onnxruntime as ort
+
+# onnxruntime and rembg take seconds to import, so they are imported when
+# the first session is created rather than with this module. Settings map
+# to names in ort.GraphOptimizationLevel and ort.ExecutionMode.
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+
+# Model file variants: fp32 is the published model, int8 is produced by
+# app.services.quantization
+MODEL_VARIANTS = ("fp32", "int8")
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    """How to load one model."""
+    name: str
+    # Approximate resident size (weights + ONNX arenas), used for the memory budget
+    memory_mb: int
+    # 0 means ONNX Runtime's default (one thread per core)
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    graph_optimization: str = "all"
+    execution_mode: str = "sequential"
+    cpu_mem_arena: bool = True
+    variant: str = "fp32"
+
+
+# Known models and their approximate footprint once loaded
+MODEL_CONFIGS = {
+    "u2netp": ModelConfig("u2netp", memory_mb=40),
+    "u2net": ModelConfig("u2net", memory_mb=450),
+    "u2net_human_seg": ModelConfig("u2net_human_seg", memory_mb=450),
+    "isnet-general-use": ModelConfig("isnet-general-use", memory_mb=700),
+}
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honouring CPU affinity and cgroup v2 quotas."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        # "<quota> <period>", or "max <period>" when unlimited
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_intra_op_threads(cpus: int, processes: int, concurrent_runs: int) -> int:
+    """
+    Threads per session run so that every worker process together uses
+    the available CPUs without oversubscribing them.
+    """
+    return max(1, cpus // max(1, processes * concurrent_runs))
+
+
+def rembg_session_classes() -> dict:
+    """rembg's model name -> session class table."""
+    from rembg.sessions import sessions
+    
+    return sessions
+
+
+def build_session_options(config: ModelConfig) -> "ort.SessionOptions":
+    """Translate a ModelConfig into ONNX Runtime session options."""
+    import onnxruntime as ort
+    
+    sess_opts = ort.SessionOptions()
+    if config.intra_op_threads > 0:
+        sess_opts.intra_op_num_threads = config.intra_op_threads
+    if config.inter_op_threads > 0:
+        sess_opts.inter_op_num_threads = config.inter_op_threads
+    sess_opts.graph_optimization_level = getattr(
+        ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[config.graph_optimization]
+    )
+    sess_opts.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[config.execution_mode])
+    sess_opts.enable_cpu_mem_arena = config.cpu_mem_arena
+    return sess_opts
+
+
+def model_path(session_class, config: ModelConfig) -> str:
+    """
+    Path of the ONNX file for `config`, downloading the fp32 model if needed.
+    
+    Raises:
+        FileNotFoundError: If the int8 variant hasn't been generated yet
+    """
+    path = str(session_class.download_models())
+    if config.variant == "int8":
+        path = quantized_model_path(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No int8 model for {config.name}; run: python -m app.services.quantization {config.name}"
+            )
+    return path
+
+
+def quantized_model_path(path: str) -> str:
+    """Where the int8 variant of the model at `path` is stored."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.int8{ext}"
+
+
+def optimized_model_path(path: str, config: ModelConfig, cache_dir: str) -> str:
+    """
+    Where the optimized graph for `path` is cached.
+    
+    Fully optimized graphs can contain kernels specific to the CPU and
+    ONNX Runtime version, so both are part of the file name along with the
+    source file's size and mtime.
+    """
+    import onnxruntime as ort
+    
+    stat = os.stat(path)
+    key = hashlib.sha256(
+        f"{path}:{stat.st_size}:{stat.st_mtime_ns}:{config.graph_optimization}:"
+        f"{ort.__version__}:{platform.machine()}".encode()
+    ).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{config.name}.{config.variant}.{key}.onnx")
+
+
+def _execution_providers() -> List[str]:
+    import onnxruntime as ort
+    
+    available = ort.get_available_providers()
+    providers = [p for p in ("CUDAExecutionProvider", "ROCMExecutionProvider") if p in available]
+    return providers + ["CPUExecutionProvider"]
+
+
+def _open_session(session_class, name: str, path: str, sess_opts: "ort.SessionOptions"):
+    """
+    Build a rembg session for an explicit model file.
+    
+    rembg's constructor loads whatever download_models() returns, so a
+    subclass pointing that at `path` goes through its normal set-up.
+    """
+    class ModelFileSession(session_class):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return path
+            
+    ModelFileSession.__name__ = ModelFileSession.__qualname__ = session_class.__name__
+    return ModelFileSession(name, sess_opts, providers=_execution_providers())
+
+
+def create_session(config: ModelConfig, graph_cache_dir: str = None):
+    """
+    Create a rembg session for `config` with its own session options.
+    
+    With `graph_cache_dir`, the first load saves ONNX Runtime's optimized
+    graph there and later loads (e.g. the next container start) reuse it
+    instead of optimizing again.
+    """
+    session_class = rembg_session_classes().get(config.name)
+    if session_class is None:
+        raise ValueError(f"No session class found for model '{config.name}'")
+    path = model_path(session_class, config)
+    if graph_cache_dir is None:
+        graph_cache_dir = settings.ONNX_GRAPH_CACHE_DIR
+    if not graph_cache_dir or config.graph_optimization == "disable":
+        return _open_session(session_class, config.name, path, build_session_options(config))
+        
+    cached_path = optimized_model_path(path, config, graph_cache_dir)
+    if os.path.exists(cached_path):
+        # Already optimized; don't spend start-up time doing it again
+        sess_opts = build_session_options(replace(config, graph_optimization="disable"))
+        try:
+            return _open_session(session_class, config.name, cached_path, sess_opts)
+        except Exception as e:
+            print(f"Discarding unusable optimized graph {cached_path}: {e}")
+            os.unlink(cached_path)
+            
+    os.makedirs(graph_cache_dir, exist_ok=True)
+    sess_opts = build_session_options(config)
+    # Written under a temporary name so a crash never leaves a partial cache file
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    sess_opts.optimized_model_filepath = tmp_path
+    session = _open_session(session_class, config.name, path, sess_opts)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)
+    return session
+
+
+def load_model_configs(
+    names: str,
+    overrides: str,
+    intra_op_threads: int = 0,
+    variant: str = "fp32",
+) -> Dict[str, ModelConfig]:
+    """
+    Build model configs from settings.
+    
+    Args:
+        names: Comma-separated model names to serve
+        overrides: JSON object of per-model ModelConfig fields,
+            e.g. '{"u2net": {"intra_op_threads": 4}}'
+        intra_op_threads: Default threads per session run (0: ONNX Runtime's default)
+        variant: Default model variant, fp32 or int8
+    """
+    try:
+        overrides_by_model = json.loads(overrides or "{}")
+    except json.JSONDecodeError:
+        raise ValueError("MODEL_SESSION_OPTIONS must be a JSON object")
+        
+    configs = {}
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        config = MODEL_CONFIGS.get(name, ModelConfig(name, memory_mb=500))
+        config = replace(
+            config,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=1 if intra_op_threads else 0,
+            variant=variant,
+        )
+        override = overrides_by_model.get(name, {})
+        unknown = sorted(set(override) - {f.name for f in fields(ModelConfig)})
+        if unknown:
+            raise ValueError(f"Unknown option for {name} in MODEL_SESSION_OPTIONS: {', '.join(unknown)}")
+        config = replace(config, **override)
+        if config.graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Invalid graph_optimization for {name}: {config.graph_optimization}")
+        if config.execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Invalid execution_mode for {name}: {config.execution_mode}")
+        if config.variant not in MODEL_VARIANTS:
+            raise ValueError(f"Invalid variant for {name}: {config.variant}")
+        configs[name] = config
+    return configs
+
+
+class _LoadedModel:
+    """A warm session, its batcher and how many requests are using it."""
+    
+    def __init__(self, config: ModelConfig, session, batcher: MaskBatcher):
+        self.config = config
+        self.session = session
+        self.batcher = batcher
+        self.in_use = 0
+
+
+class ModelRegistry:
+    """
+    Keeps several model sessions warm within a memory budget.
+    
+    Sessions are loaded on first use and kept in LRU order. When loading
+    a model would exceed `memory_budget_mb`, the least recently used idle
+    models are unloaded first. Models in use by a request are never
+    unloaded; if they alone exceed the budget the new model is loaded anyway.
+    """
+    
+    def __init__(
+        self,
+        configs: Dict[str, ModelConfig],
+        memory_budget_mb: int,
+        batch_window_ms: float = 0,
+        max_batch_size: int = 1,
+        session_factory: Callable[[ModelConfig], object] = create_session,
+    ):
+        self.configs = configs
+        self.memory_budget_mb = memory_budget_mb
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self.session_factory = session_factory
+        self._loaded: "OrderedDict[str, _LoadedModel]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in configs}
+        
+    @property
+    def available(self) -> List[str]:
+        """Models this registry can serve."""
+        return list(self.configs)
+        
+    @property
+    def loaded(self) -> List[str]:
+        """Models currently warm, least recently used first."""
+        with self._lock:
+            return list(self._loaded)
+            
+    @property
+    def memory_mb(self) -> int:
+        """Estimated memory held by loaded models."""
+        with self._lock:
+            return sum(model.config.memory_mb for model in self._loaded.values())
+            
+    def _get_or_load(self, name: str) -> _LoadedModel:
+        if name not in self.configs:
+            raise KeyError(f"Unknown model: {name}")
+            
+        with self._lock:
+            model = self._loaded.get(name)
+            if model is not None:
+                self._loaded.move_to_end(name)
+                model.in_use += 1
+                return model
+                
+        # Load outside the registry lock so other models stay usable
+        with self._load_locks[name]:
+            with self._lock:
+                model = self._loaded.get(name)
+                if model is not None:
+                    self._loaded.move_to_end(name)
+                    model.in_use += 1
+                    return model
+                    
+            config = self.configs[name]
+            start = time.perf_counter()
+            session = self.session_factory(config)
+            model_load_duration.labels(tool=TOOL_NAME, model=name).observe(time.perf_counter() - start)
+            model = _LoadedModel(
+                config,
+                session,
+                MaskBatcher(session, self.batch_window_ms, self.max_batch_size),
+            )
+            
+            with self._lock:
+                self._evict_for(config.memory_mb)
+                self._loaded[name] = model
+                model.in_use += 1
+                model_loaded.labels(tool=TOOL_NAME, model=name).set(1)
+            return model
+            
+    def _evict_for(self, needed_mb: int):
+        """Unload idle models, least recently used first, to make room."""
+        used = sum(model.config.memory_mb for model in self._loaded.values())
+        for name in list(self._loaded):
+            if used + needed_mb <= self.memory_budget_mb:
+                break
+            model = self._loaded[name]
+            if model.in_use:
+                continue
+            self._unload(name)
+            used -= model.config.memory_mb
+            model_evictions.labels(tool=TOOL_NAME, model=name).inc()
+            
+    def _unload(self, name: str):
+        model = self._loaded.pop(name)
+        model.batcher.close()
+        model_loaded.labels(tool=TOOL_NAME, model=name).set(0)
+        
+    def _release(self, model: _LoadedModel):
+        with self._lock:
+            model.in_use -= 1
+            
+    @contextmanager
+    def acquire(self, name: str):
+        """
+        Use a model's batcher, loading the model if needed.
+        
+        The model can't be unloaded while the context is open.
+        """
+        model = self._get_or_load(name)
+        try:
+            yield model.batcher
+        finally:
+            self._release(model)
+            
+    @contextmanager
+    def session(self, name: str):
+        """
+        Use the raw rembg session for a model, loading it if needed.
+        
+        Like acquire(), the model can't be unloaded while the context is open.
+        """
+        model = self._get_or_load(name)
+        try:
+            yield model.session
+        finally:
+            self._release(model)
+            
+    def preload(self, names: List[str]):
+        """Warm the given models."""
+        for name in names:
+            with self.acquire(name):
+                pass
+                
+    def unload_all(self):
+        """Drop every loaded model."""
+        with self._lock:
+            for name in list(self._loaded):
+                self._unload(name)
+
+
+def _configured_intra_op_threads() -> int:
+    if settings.ONNX_INTRA_OP_THREADS:
+        return settings.ONNX_INTRA_OP_THREADS
+    if settings.INFERENCE_PROCESSES:
+        # Multi-process serving: only the inference processes run models, one image at a time
+        return default_intra_op_threads(available_cpus(), settings.INFERENCE_PROCESSES, 1)
+    # Batched models run one batch at a time; otherwise each inference worker runs its own
+    concurrent_runs = 1 if settings.INFERENCE_MAX_BATCH_SIZE > 1 else settings.INFERENCE_WORKERS
+    return default_intra_op_threads(available_cpus(), settings.WEB_CONCURRENCY, concurrent_runs)
+
+
+model_registry = ModelRegistry(
+    load_model_configs(
+        settings.AVAILABLE_MODELS,
+        settings.MODEL_SESSION_OPTIONS,
+        intra_op_threads=_configured_intra_op_threads(),
+        variant=settings.MODEL_VARIANT,
+    ),
+    memory_budget_mb=settings.MODEL_MEMORY_BUDGET_MB,
+    batch_window_ms=settings.INFERENCE_BATCH_WINDOW_MS,
+    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+)
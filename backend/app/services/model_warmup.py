@@ -0,0 +1,162 @@
+"""Background model loading, warm-up and readiness state."""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import app_startup_seconds, model_warmup_duration, TOOL_NAME
+from app.services.batcher import MODEL_PREPROCESSING
+from app.services.model_registry import ModelRegistry, model_registry
+
+STATE_PENDING = "pending"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+_IMPORTED_AT = time.time()
+
+
+def process_start_time() -> float:
+    """When this process started (Linux), or when this module was imported."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot; the command
+            # name (field 2) may contain spaces, so split after its ")"
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return _IMPORTED_AT
+
+
+def _dummy_input(session, model: str) -> Dict[str, np.ndarray]:
+    """A zero tensor matching the model's input, for warm-up runs."""
+    model_input = session.inner_session.get_inputs()[0]
+    _, _, (width, height) = MODEL_PREPROCESSING.get(model, (None, None, (320, 320)))
+    shape = [
+        dim if isinstance(dim, int) and dim > 0 else default
+        for dim, default in zip(model_input.shape, (1, 3, height, width))
+    ]
+    return {model_input.name: np.zeros(shape, dtype=np.float32)}
+
+
+def load_and_warm(registry: ModelRegistry, name: str):
+    """Load a model and run one inference on a dummy tensor."""
+    start = time.perf_counter()
+    with registry.session(name) as session:
+        session.inner_session.run(None, _dummy_input(session, name))
+    model_warmup_duration.labels(tool=TOOL_NAME, model=name).observe(time.perf_counter() - start)
+
+
+def warm_pipeline(model: str):
+    """Run one small image through the whole pipeline."""
+    import io
+    
+    from PIL import Image, ImageDraw
+    
+    from app.services.background_remover import parse_options, remove_background_sync
+    
+    image = Image.new("RGB", (96, 96), (30, 30, 30))
+    ImageDraw.Draw(image).ellipse((24, 16, 72, 88), fill=(220, 200, 180))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    remove_background_sync(buffer.getvalue(), parse_options(model=model))
+
+
+class ModelWarmup:
+    """
+    Loads models in the background so the app can serve /health at once.
+    
+    Each model gets one inference on a dummy tensor so ONNX Runtime
+    allocates its buffers before the first real request. With
+    WARMUP_PIPELINE, one small image also goes through the whole pipeline,
+    which compiles the matting kernels.
+    """
+    
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+        self.state = STATE_PENDING
+        self.models: Dict[str, str] = {}
+        self.error: Optional[str] = None
+        self.startup_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+        
+    def start(self, names: List[str]) -> asyncio.Task:
+        """Start loading `names` in the background."""
+        self.state = STATE_LOADING
+        self.error = None
+        self.models = {name: STATE_PENDING for name in names}
+        self._task = asyncio.create_task(self._run(names))
+        return self._task
+        
+    async def stop(self):
+        """Stop waiting for a load in progress (the current model still finishes loading)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        
+    async def wait(self):
+        """Wait until loading has finished or failed."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+            
+    async def _run(self, names: List[str]):
+        try:
+            for name in names:
+                self.models[name] = STATE_LOADING
+                await asyncio.to_thread(load_and_warm, self.registry, name)
+                self.models[name] = STATE_READY
+            if settings.WARMUP_PIPELINE and names:
+                await asyncio.to_thread(warm_pipeline, names[0])
+        except Exception as e:
+            failed = next((name for name, state in self.models.items() if state == STATE_LOADING), None)
+            if failed:
+                self.models[failed] = STATE_FAILED
+            self.state = STATE_FAILED
+            self.error = str(e)
+            print(f"Model warm-up failed: {e}")
+            return
+            
+        self._mark_ready()
+        
+    def track_workers(self, names: List[str], ready_workers: Callable[[], int]) -> asyncio.Task:
+        """
+        Report readiness of models loaded by inference worker processes.
+        
+        Used in multi-process serving, where this process loads no models:
+        ready once `ready_workers()` reports at least one warmed worker.
+        """
+        self.state = STATE_LOADING
+        self.error = None
+        self.models = {name: STATE_LOADING for name in names}
+        self._task = asyncio.create_task(self._wait_for_workers(ready_workers))
+        return self._task
+        
+    async def _wait_for_workers(self, ready_workers: Callable[[], int]):
+        while not ready_workers():
+            await asyncio.sleep(0.2)
+        self.models = {name: STATE_READY for name in self.models}
+        self._mark_ready()
+        
+    def _mark_ready(self):
+        self.state = STATE_READY
+        self.startup_seconds = time.time() - process_start_time()
+        app_startup_seconds.labels(tool=TOOL_NAME, phase="ready").set(self.startup_seconds)
+        print(f"Models ready after {self.startup_seconds:.1f}s")
+
+
+def record_import_time():
+    """Record how long the process took to get to a constructed app."""
+    app_startup_seconds.labels(tool=TOOL_NAME, phase="import").set(time.time() - process_start_time())
+
+
+model_warmup = ModelWarmup(model_registry)
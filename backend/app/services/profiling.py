@@ -0,0 +1,56 @@
+"""Opt-in request profiling."""
+import cProfile
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable
+
+from app.config import settings
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pragma: no cover - optional dependency
+    PyinstrumentProfiler = None
+
+
+def profiling_requested(header_value: str = None) -> bool:
+    """Whether a request should get a stage breakdown (setting or X-Profile header)."""
+    if settings.PROFILING_ENABLED:
+        return True
+    return settings.PROFILING_HEADER_ENABLED and (header_value or "").lower() in ("1", "true", "yes")
+
+
+def should_dump_profile() -> bool:
+    """Sample whether a profiled request also writes a profiler dump."""
+    return bool(settings.PROFILE_DIR) and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def profile_call(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run `fn(*args)` under a profiler and write the dump to PROFILE_DIR.
+    
+    Uses pyinstrument (HTML report) when PROFILER is "pyinstrument" and it
+    is installed, otherwise cProfile (.prof, readable with pstats or
+    snakeviz). Must run on the thread doing the work.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    
+    if settings.PROFILER == "pyinstrument" and PyinstrumentProfiler is not None:
+        profiler = PyinstrumentProfiler()
+        profiler.start()
+        try:
+            return fn(*args)
+        finally:
+            profiler.stop()
+            with open(os.path.join(settings.PROFILE_DIR, f"{name}.html"), "w") as f:
+                f.write(profiler.output_html())
+                
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(settings.PROFILE_DIR, f"{name}.prof"))
@@ -0,0 +1,120 @@
+"""
+Produce INT8-quantized variants of the segmentation models.
+
+Static QDQ quantization calibrated on sample images: weights are
+quantized per channel and activation ranges come from running the fp32
+model over the calibration set, so use photos that look like real
+uploads. The result is saved next to the fp32 model as <name>.int8.onnx,
+where MODEL_VARIANT=int8 (or a per-model "variant" override) picks it up.
+
+Needs the `onnx` package.
+
+Usage (from backend/):
+    python -m app.services.quantization u2net --calibration-dir samples/
+"""
+import argparse
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+from PIL import Image
+from app.services.batcher import MODEL_PREPROCESSING
+from app.services.model_registry import quantized_model_path, rembg_session_classes
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def preprocess(image: Image.Image, model: str) -> np.ndarray:
+    """The model input tensor for `image`, matching rembg's normalization."""
+    mean, std, size = MODEL_PREPROCESSING[model]
+    pixels = np.array(image.convert("RGB").resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+    pixels /= max(float(pixels.max()), 1e-6)
+    pixels = (pixels - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+    return pixels.transpose((2, 0, 1))[np.newaxis].astype(np.float32)
+
+
+def load_calibration_images(directory: str, limit: int) -> List[Image.Image]:
+    """Up to `limit` images from `directory`, in name order."""
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [Image.open(os.path.join(directory, name)) for name in names[:limit]]
+
+
+def quantize_model(
+    model: str,
+    source_path: str,
+    output_path: str,
+    calibration_images: Iterable[Image.Image],
+):
+    """
+    Write a static INT8 (QDQ) quantization of `source_path` to `output_path`.
+    
+    Raises:
+        ImportError: If the onnx package isn't installed
+    """
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    
+    input_name = _input_name(source_path)
+    
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._tensors = iter([preprocess(image, model) for image in calibration_images])
+            
+        def get_next(self):
+            tensor = next(self._tensors, None)
+            return None if tensor is None else {input_name: tensor}
+            
+    prepared_path = f"{output_path}.prep.onnx"
+    tmp_path = f"{output_path}.tmp"
+    try:
+        # Shape inference and graph cleanup make quantization more complete
+        quant_pre_process(source_path, prepared_path, skip_symbolic_shape=True)
+        quantize_static(
+            prepared_path,
+            tmp_path,
+            Reader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+        os.replace(tmp_path, output_path)
+    finally:
+        for path in (prepared_path, tmp_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def _input_name(path: str) -> str:
+    import onnxruntime as ort
+    
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return session.get_inputs()[0].name
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", choices=sorted(MODEL_PREPROCESSING))
+    parser.add_argument("--calibration-dir", required=True, help="Directory of sample images")
+    parser.add_argument("--max-images", type=int, default=64)
+    args = parser.parse_args(argv)
+    
+    source_path = str(rembg_session_classes()[args.model].download_models())
+    output_path = quantized_model_path(source_path)
+    images = load_calibration_images(args.calibration_dir, args.max_images)
+    if not images:
+        parser.error(f"No images found in {args.calibration_dir}")
+        
+    print(f"Quantizing {args.model} with {len(images)} calibration images...")
+    quantize_model(args.model, source_path, output_path, images)
+    print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f}MB, "
+          f"fp32 {os.path.getsize(source_path) / 1e6:.1f}MB)")
+
+
+if __name__ == "__main__":
+    main()
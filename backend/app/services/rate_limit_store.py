@@ -0,0 +1,322 @@
+"""Storage backends for free-tier usage counters."""
+import hashlib
+import socket
+import sqlite3
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class RateLimitStore:
+    """
+    Per-device usage counters for one day at a time.
+    
+    `day` identifies the counting window (the UTC midnight at which it
+    resets). Counters from earlier days are expired in bulk, never one
+    device at a time.
+    
+    Stores with `blocking` set do I/O in their methods; async callers run
+    those on a thread (see rate_limiter).
+    """
+    
+    blocking = True
+    
+    def count(self, device_id: str, day: int) -> int:
+        """Uses recorded for `device_id` in `day`."""
+        raise NotImplementedError
+        
+    def increment(self, device_id: str, day: int, limit: Optional[int] = None) -> Optional[int]:
+        """
+        Atomically add one use and return the new count.
+        
+        With a `limit`, the use is only recorded if the count is below it;
+        otherwise nothing changes and None is returned.
+        """
+        raise NotImplementedError
+        
+    def decrement(self, device_id: str, day: int):
+        """Give back one use, e.g. when processing failed after charging."""
+        raise NotImplementedError
+        
+    def device_count(self, day: int) -> int:
+        """Number of devices with usage in `day`."""
+        raise NotImplementedError
+        
+    def clear(self):
+        """Drop all counters."""
+        raise NotImplementedError
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Counters in process memory.
+    
+    Keys are 8-byte digests of the device id and values plain ints, so an
+    entry costs the same however long the id is. The whole table is
+    replaced when the day rolls over. Only correct with a single worker
+    process.
+    """
+    
+    blocking = False
+    
+    def __init__(self):
+        self._day = 0
+        self._counts: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def _key(device_id: str) -> bytes:
+        return hashlib.blake2b(device_id.encode(), digest_size=8).digest()
+        
+    def _roll(self, day: int):
+        if day != self._day:
+            self._day = day
+            self._counts = {}
+            
+    def count(self, device_id, day):
+        with self._lock:
+            self._roll(day)
+            return self._counts.get(self._key(device_id), 0)
+            
+    def increment(self, device_id, day, limit=None):
+        key = self._key(device_id)
+        with self._lock:
+            self._roll(day)
+            count = self._counts.get(key, 0)
+            if limit is not None and count >= limit:
+                return None
+            self._counts[key] = count + 1
+            return count + 1
+            
+    def decrement(self, device_id, day):
+        key = self._key(device_id)
+        with self._lock:
+            self._roll(day)
+            if self._counts.get(key, 0) > 0:
+                self._counts[key] -= 1
+                
+    def device_count(self, day):
+        with self._lock:
+            self._roll(day)
+            return len(self._counts)
+            
+    def clear(self):
+        with self._lock:
+            self._counts = {}
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    Counters in a SQLite database shared by every worker on the host.
+    
+    WAL mode lets readers run alongside the single writer; each check-and-
+    increment is one UPSERT statement, so concurrent workers can't both
+    slip under the limit.
+    """
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_usage (
+                device_id TEXT PRIMARY KEY,
+                day INTEGER NOT NULL,
+                count INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._lock = threading.Lock()
+        self._expired_before = 0
+        
+    def _expire(self, day: int):
+        # Once per day per process; rows from other days never count anyway
+        if day > self._expired_before:
+            self._conn.execute("DELETE FROM device_usage WHERE day < ?", (day,))
+            self._expired_before = day
+            
+    def count(self, device_id, day):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT count FROM device_usage WHERE device_id = ? AND day = ?", (device_id, day)
+            ).fetchone()
+        return row[0] if row else 0
+        
+    def increment(self, device_id, day, limit=None):
+        with self._lock:
+            self._expire(day)
+            row = self._conn.execute(
+                """
+                INSERT INTO device_usage (device_id, day, count) VALUES (:device_id, :day, 1)
+                ON CONFLICT (device_id) DO UPDATE SET
+                    count = CASE WHEN day = excluded.day THEN count + 1 ELSE 1 END,
+                    day = excluded.day
+                WHERE day != excluded.day OR :limit IS NULL OR count < :limit
+                RETURNING count
+                """,
+                {"device_id": device_id, "day": day, "limit": limit},
+            ).fetchone()
+        return row[0] if row else None
+        
+    def decrement(self, device_id, day):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE device_usage SET count = count - 1 WHERE device_id = ? AND day = ? AND count > 0",
+                (device_id, day),
+            )
+            
+    def device_count(self, day):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM device_usage WHERE day = ?", (day,)
+            ).fetchone()[0]
+            
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM device_usage")
+
+
+class RedisError(Exception):
+    """Error reply or connection failure from a Redis server."""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Counters in Redis (or anything speaking its protocol), shared across hosts.
+    
+    Each day's keys carry an EXPIREAT at the reset time, so the server
+    drops them in bulk; every write sets it in the same MULTI/EXEC
+    transaction, so no key is ever left without one. INCR is atomic; an
+    increment that lands over the limit is immediately undone, so the
+    count never admits more than `limit` uses.
+    """
+    
+    def __init__(self, url: str, prefix: str = "bggone:ratelimit", timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+        
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+            
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+        
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+        
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+        
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+        
+    def _multi(self, commands):
+        # Pipelined in one write; the replies are +OK, +QUEUED per command, then EXEC's
+        self._sock.sendall(b"".join(self._encode(args) for args in [("MULTI",), *commands, ("EXEC",)]))
+        for _ in range(len(commands) + 1):
+            self._read_reply()
+        return self._read_reply()
+        
+    def _locked(self, fn, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return fn(*args)
+                except OSError as e:
+                    # Stale or dropped connection: reconnect and retry once
+                    self._close()
+                    if attempt:
+                        raise RedisError(str(e)) from e
+                        
+    def execute(self, *args):
+        """Send one command and return its reply, reconnecting once if needed."""
+        return self._locked(self._call, *args)
+        
+    def transaction(self, *commands):
+        """Run commands atomically in one MULTI/EXEC block and return their replies."""
+        return self._locked(self._multi, commands)
+        
+    def _key(self, device_id: str, day: int) -> str:
+        return f"{self.prefix}:{day}:{device_id}"
+        
+    def count(self, device_id, day):
+        value = self.execute("GET", self._key(device_id, day))
+        return int(value) if value is not None else 0
+        
+    def increment(self, device_id, day, limit=None):
+        key = self._key(device_id, day)
+        devices = f"{self.prefix}:{day}:devices"
+        count = self.transaction(
+            ("INCR", key),
+            ("EXPIREAT", key, day),
+            ("PFADD", devices, device_id),
+            ("EXPIREAT", devices, day),
+        )[0]
+        if limit is not None and count > limit:
+            self.execute("DECR", key)
+            return None
+        return count
+        
+    def decrement(self, device_id, day):
+        key = self._key(device_id, day)
+        # A refund after the key expired recreates it, so it needs the TTL too
+        if self.transaction(("DECR", key), ("EXPIREAT", key, day))[0] < 0:
+            self.execute("SET", key, 0, "KEEPTTL")
+            
+    def device_count(self, day):
+        return self.execute("PFCOUNT", f"{self.prefix}:{day}:devices")
+        
+    def clear(self):
+        cursor = b"0"
+        while True:
+            cursor, keys = self.execute("SCAN", cursor, "MATCH", f"{self.prefix}:*", "COUNT", 1000)
+            if keys:
+                self.execute("DEL", *keys)
+            if cursor == b"0":
+                break
@@ -1,13 +1,30 @@
 """Rate limiting service for free tier usage."""
-import time
+import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Tuple
+from typing import Any, Callable, Tuple
 from app.config import settings
-from app.metrics import free_trial_used, TOOL_NAME
+from app.metrics import free_trials_refunded, free_trials_used
+from app.services.rate_limit_store import (
+    MemoryRateLimitStore,
+    RateLimitStore,
+    RedisRateLimitStore,
+    SQLiteRateLimitStore,
+)
 
-# In-memory storage for device usage
-# Format: {device_id: {"count": int, "reset_at": timestamp}}
-_device_usage: Dict[str, dict] = {}
+
+def create_rate_limit_store() -> RateLimitStore:
+    """Create the store selected by RATE_LIMIT_BACKEND."""
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimitStore()
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimitStore(settings.RATE_LIMIT_SQLITE_PATH)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitStore(settings.RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+
+
+# Usage counters, shared across workers unless the memory backend is used
+limiter_store: RateLimitStore = create_rate_limit_store()
 
 
 def get_daily_reset_timestamp() -> float:
@@ -17,7 +34,15 @@ def get_daily_reset_timestamp() -> float:
     return tomorrow.timestamp()
 
 
-def check_rate_limit(device_id: str) -> Tuple[bool, int, int]:
+async def _run(fn: Callable[..., Any], *args: Any) -> Any:
+    # The SQLite and Redis stores block on I/O (a locked database, a slow
+    # round-trip), so they run on a thread instead of stalling the event loop
+    if limiter_store.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def check_rate_limit(device_id: str) -> Tuple[bool, int, int]:
     """
     Check if device has remaining free uses.
     
@@ -27,29 +52,52 @@ def check_rate_limit(device_id: str) -> Tuple[bool, int, int]:
     Returns:
         Tuple of (allowed: bool, remaining: int, reset_at: int)
     """
-    now = time.time()
-    
-    if device_id not in _device_usage:
-        # New device
-        _device_usage[device_id] = {
-            "count": 0,
-            "reset_at": get_daily_reset_timestamp()
-        }
+    reset_at = int(get_daily_reset_timestamp())
+    remaining = max(0, settings.FREE_DAILY_LIMIT - await _run(limiter_store.count, device_id, reset_at))
+    allowed = remaining > 0
     
-    usage = _device_usage[device_id]
+    return allowed, remaining, reset_at
+
+
+async def try_consume(device_id: str) -> Tuple[bool, int, int]:
+    """
+    Atomically take one free use if any are left.
     
-    # Check if reset is needed
-    if now >= usage["reset_at"]:
-        usage["count"] = 0
-        usage["reset_at"] = get_daily_reset_timestamp()
+    Unlike check_rate_limit followed by record_usage, concurrent requests
+    can't both get through on the last remaining use.
     
-    remaining = settings.FREE_DAILY_LIMIT - usage["count"]
-    allowed = remaining > 0
+    Args:
+        device_id: Device fingerprint ID
+        
+    Returns:
+        Tuple of (allowed: bool, remaining after this use: int, reset_at: int)
+    """
+    reset_at = int(get_daily_reset_timestamp())
+    count = await _run(limiter_store.increment, device_id, reset_at, settings.FREE_DAILY_LIMIT)
+    if count is None:
+        return False, 0, reset_at
+    free_trials_used.inc()
+    return True, settings.FREE_DAILY_LIMIT - count, reset_at
+
+
+def _refund(device_id: str, reset_at: int) -> int:
+    limiter_store.decrement(device_id, reset_at)
+    return limiter_store.count(device_id, reset_at)
+
+
+async def refund_usage(device_id: str) -> int:
+    """
+    Give back a use taken by try_consume.
     
-    return allowed, remaining, int(usage["reset_at"])
+    Returns:
+        Remaining uses after the refund
+    """
+    count = await _run(_refund, device_id, int(get_daily_reset_timestamp()))
+    free_trials_refunded.inc()
+    return settings.FREE_DAILY_LIMIT - count
 
 
-def record_usage(device_id: str) -> int:
+async def record_usage(device_id: str) -> int:
     """
     Record a usage for the device.
     
@@ -59,21 +107,15 @@ def record_usage(device_id: str) -> int:
     Returns:
         Remaining uses after this usage
     """
-    if device_id not in _device_usage:
-        _device_usage[device_id] = {
-            "count": 0,
-            "reset_at": get_daily_reset_timestamp()
-        }
-    
-    _device_usage[device_id]["count"] += 1
-    free_trial_used.labels(tool=TOOL_NAME).inc()
+    count = await _run(limiter_store.increment, device_id, int(get_daily_reset_timestamp()))
+    free_trials_used.inc()
     
-    return settings.FREE_DAILY_LIMIT - _device_usage[device_id]["count"]
+    return settings.FREE_DAILY_LIMIT - count
 
 
-def get_usage_stats() -> dict:
+async def get_usage_stats() -> dict:
     """Get overall usage statistics."""
     return {
-        "total_devices": len(_device_usage),
+        "total_devices": await _run(limiter_store.device_count, int(get_daily_reset_timestamp())),
         "daily_limit": settings.FREE_DAILY_LIMIT,
     }
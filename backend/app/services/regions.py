@@ -0,0 +1,154 @@
+"""Subject localisation and tiled mask prediction for very large or wide images."""
+import math
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.services.batcher import MaskBatcher
+
+# full: segment the whole frame at WORKING_MAX_SIDE
+# roi: find the subject with a low-resolution pass, then process only that crop
+# tiled: like roi, but predict the crop's mask in overlapping square tiles at
+#        TILED_WORKING_MAX_SIDE, for subjects too large or wide for one model input
+REGION_MODES = ("full", "roi", "tiled")
+
+Box = Tuple[int, int, int, int]
+
+
+def subject_box(mask: Image.Image, threshold: int, padding: float) -> Optional[Box]:
+    """
+    Bounding box of mask pixels above `threshold`, grown by `padding`.
+    
+    Args:
+        mask: 8-bit mask ("L")
+        threshold: Mask value counted as subject
+        padding: Margin added on each side, as a fraction of the box size
+        
+    Returns:
+        (left, top, right, bottom) within the mask, or None if there's no subject
+    """
+    box = mask.point([0] * (threshold + 1) + [255] * (255 - threshold)).getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    pad_x = math.ceil((right - left) * padding)
+    pad_y = math.ceil((bottom - top) * padding)
+    return (
+        max(0, left - pad_x),
+        max(0, top - pad_y),
+        min(mask.width, right + pad_x),
+        min(mask.height, bottom + pad_y),
+    )
+
+
+def scale_box(box: Box, from_size: Tuple[int, int], to_size: Tuple[int, int]) -> Box:
+    """Map a box between two resolutions of the same image, rounding outwards."""
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    return (
+        max(0, math.floor(box[0] * sx)),
+        max(0, math.floor(box[1] * sy)),
+        min(to_size[0], math.ceil(box[2] * sx)),
+        min(to_size[1], math.ceil(box[3] * sy)),
+    )
+
+
+def locate_subject(
+    batcher: MaskBatcher,
+    image: Image.Image,
+    preview_side: int,
+    threshold: int,
+    padding: float,
+) -> Optional[Box]:
+    """
+    Find the subject with one inference on a small preview of `image`.
+    
+    Returns:
+        Padded subject box in `image` coordinates, or None if nothing was found
+    """
+    preview = image.copy()
+    preview.thumbnail((preview_side, preview_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    box = subject_box(batcher.predict(preview), threshold, padding)
+    return scale_box(box, preview.size, image.size) if box else None
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """Start offsets of tiles of size `tile` covering `length` with at least `overlap` shared."""
+    if length <= tile:
+        return [0]
+    step = max(1, tile - overlap)
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def _ramp(length: int, overlap: int, fade_in: bool, fade_out: bool) -> np.ndarray:
+    """1-D blend weights: linear ramps over the edges shared with neighbouring tiles."""
+    weights = np.ones(length, dtype=np.float32)
+    overlap = min(overlap, length // 2)
+    if overlap:
+        ramp = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+        if fade_in:
+            weights[:overlap] = ramp
+        if fade_out:
+            weights[-overlap:] = ramp[::-1]
+    return weights
+
+
+def predict_tiled(
+    batcher: MaskBatcher,
+    image: Image.Image,
+    tile_size: int,
+    overlap: int,
+    gate_threshold: int = 16,
+) -> Image.Image:
+    """
+    Predict a mask from overlapping square tiles, blended linearly in the overlaps.
+    
+    Square tiles give the model undistorted input even for panoramas.
+    Each tile's prediction is min-max normalised on its own, so a tile of
+    pure background would come back as noise; a whole-image prediction
+    (one more model input) is dilated and used to gate out anything away
+    from the subject.
+    
+    Args:
+        batcher: Mask predictor for the model
+        image: RGB image at working resolution
+        tile_size: Tile side in pixels (capped at the image's short side)
+        overlap: Pixels shared by neighbouring tiles
+        gate_threshold: Whole-image mask value that counts as near the subject
+        
+    Returns:
+        Mask ("L") the size of `image`
+    """
+    width, height = image.size
+    tile = min(tile_size, width, height)
+    overlap = min(overlap, tile // 2)
+    xs = tile_starts(width, tile, overlap)
+    ys = tile_starts(height, tile, overlap)
+    boxes = [(x, y, x + tile, y + tile) for y in ys for x in xs]
+    if len(boxes) == 1:
+        return batcher.predict(image)
+        
+    masks = batcher.predict_many([image] + [image.crop(box) for box in boxes])
+    coarse, tile_masks = masks[0], masks[1:]
+    
+    blended = np.zeros((height, width), dtype=np.float32)
+    weight_sum = np.zeros((height, width), dtype=np.float32)
+    for (x0, y0, x1, y1), mask in zip(boxes, tile_masks):
+        weights = np.outer(
+            _ramp(tile, overlap, y0 > 0, y1 < height),
+            _ramp(tile, overlap, x0 > 0, x1 < width),
+        )
+        blended[y0:y1, x0:x1] += np.asarray(mask, dtype=np.float32) * weights
+        weight_sum[y0:y1, x0:x1] += weights
+    blended /= weight_sum
+    del weight_sum
+    
+    # Keep only what's near the subject in the whole-image prediction
+    dilate = max(3, (min(width, height) // 50) | 1)
+    gate = cv2.dilate(np.asarray(coarse), np.ones((dilate, dilate), dtype=np.uint8)) > gate_threshold
+    blended[~gate] = 0
+    return Image.fromarray(np.clip(blended + 0.5, 0, 255).astype(np.uint8), mode="L")
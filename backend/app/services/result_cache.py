@@ -0,0 +1,179 @@
+"""Content-addressed cache of background removal results."""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.metrics import result_cache_disk_hits, result_cache_memory_hits, result_cache_misses, result_cache_size
+
+
+def cache_key(image_bytes: bytes, params: dict) -> str:
+    """
+    Build a cache key from the input bytes and processing parameters.
+    
+    Args:
+        image_bytes: Input image as bytes
+        params: Everything that affects the output (model, thresholds, format)
+        
+    Returns:
+        Hex digest identifying the result
+    """
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier result cache.
+    
+    Results live in an in-memory LRU bounded by total bytes. When `disk_dir`
+    is set, results are also written there and memory misses fall back to
+    disk, so the cache survives restarts and can outgrow RAM. Memory
+    lookups happen inline; disk reads, writes and pruning run on a thread
+    so they never hold up the event loop.
+    """
+    
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_files())
+            
+    def __len__(self) -> int:
+        return len(self._entries)
+        
+    @property
+    def size(self) -> int:
+        """Bytes held in memory."""
+        return self._size
+        
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the cached result for `key`, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                result_cache_memory_hits.inc()
+                return value
+                
+        value = await asyncio.to_thread(self._read_disk, key) if self.disk_dir else None
+        if value is not None:
+            result_cache_disk_hits.inc()
+            self._put_memory(key, value)
+            return value
+            
+        result_cache_misses.inc()
+        return None
+        
+    async def put(self, key: str, value: bytes):
+        """Store a result."""
+        self._put_memory(key, value)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value)
+            
+    def clear(self):
+        """Drop every in-memory entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            result_cache_size.set(0)
+            
+    def _put_memory(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+            result_cache_size.set(self._size)
+            
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+        
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+                
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            return None
+        # Touch so disk eviction is least-recently-used too
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+        
+    def _write_disk(self, key: str, value: bytes):
+        if not self.disk_dir or (self.disk_max_bytes and len(value) > self.disk_max_bytes):
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial result
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        with self._lock:
+            self._disk_size += len(value)
+            over_budget = self.disk_max_bytes and self._disk_size > self.disk_max_bytes
+        if over_budget:
+            self._prune_disk()
+            
+    def _prune_disk(self):
+        """Delete the least recently used files until under the disk budget."""
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_size = total
+
+
+result_cache = ResultCache(
+    settings.RESULT_CACHE_MAX_BYTES,
+    disk_dir=settings.RESULT_CACHE_DIR,
+    disk_max_bytes=settings.RESULT_CACHE_DISK_MAX_BYTES,
+)
@@ -0,0 +1,68 @@
+"""Coalescing of identical concurrent work (single-flight)."""
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+from app.metrics import single_flight_followers, single_flight_leaders
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time and shares its result.
+    
+    The first caller for a key starts the work; callers that arrive with
+    the same key while it's running wait for that work instead of
+    starting their own. Nothing is kept once it finishes, so this only
+    deduplicates overlapping requests and is independent of any cache.
+    
+    The work runs as its own task: a caller that disconnects stops
+    waiting without cancelling the computation the others are waiting on.
+    Once the last caller has stopped waiting, the work is cancelled.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        
+    def __len__(self) -> int:
+        return len(self._inflight)
+        
+    async def run(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Return the result of `fn()`, or of the identical call already running.
+        
+        Returns:
+            Tuple of (result, whether it was shared from another caller's call)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None and task.get_loop() is asyncio.get_running_loop()
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        (single_flight_followers if shared else single_flight_leaders).inc()
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1:
+                # Callers arriving from now on start fresh work instead of joining this
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved even if every caller stopped waiting
+        if not task.cancelled():
+            task.exception()
+
+
+single_flight = SingleFlight()
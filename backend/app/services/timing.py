@@ -0,0 +1,56 @@
+"""Per-request pipeline stage timing."""
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from app.metrics import input_megapixels, stage_duration
+
+# Upper megapixel bound -> size class label; keeps histogram cardinality low
+SIZE_CLASSES = ((0.5, "lt0.5mp"), (2, "0.5-2mp"), (8, "2-8mp"), (24, "8-24mp"))
+LARGEST_SIZE_CLASS = "gt24mp"
+
+
+def size_class(width: int, height: int) -> str:
+    """Bucket an image's pixel count into a coarse size class."""
+    megapixels = width * height / 1_000_000
+    for upper, label in SIZE_CLASSES:
+        if megapixels < upper:
+            return label
+    return LARGEST_SIZE_CLASS
+
+
+class StageTimings:
+    """
+    Collects how long each pipeline stage took for one request.
+    
+    Every stage is also observed in the bg_removal_stage_duration_seconds
+    histogram, labelled with the quality mode, model and image size class.
+    Call set_image_size() once the dimensions are known; stages finished
+    before that are labelled "unknown".
+    """
+    
+    def __init__(self, quality: str, model: str = "unknown"):
+        self.quality = quality
+        self.model = model
+        self.size_class = "unknown"
+        self.durations: Dict[str, float] = {}
+        
+    def set_image_size(self, width: int, height: int):
+        """Record the input dimensions for labelling and the megapixel histogram."""
+        self.size_class = size_class(width, height)
+        input_megapixels(self.model).observe(width * height / 1_000_000)
+        
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            stage_duration(name, self.quality, self.model, self.size_class).observe(elapsed)
+            
+    def server_timing(self) -> str:
+        """The stage breakdown as a Server-Timing header value (milliseconds)."""
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in self.durations.items())
@@ -0,0 +1,109 @@
+"""Incremental reading and validation of uploaded images."""
+import io
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+from PIL import Image
+
+# Formats accepted for processing, as reported by Pillow
+ALLOWED_FORMATS = {"PNG", "JPEG", "WEBP", "GIF", "MPO"}
+
+CHUNK_SIZE = 64 * 1024
+
+# JPEGs can carry large EXIF/ICC segments before the frame header
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the allowed size."""
+
+
+class InvalidImage(Exception):
+    """Raised when an upload isn't a readable image."""
+
+
+@dataclass
+class ImageHeader:
+    """Image properties read from the first bytes of an upload."""
+    width: int
+    height: int
+    format: str
+    mode: str
+    
+    @property
+    def megapixels(self) -> float:
+        return self.width * self.height / 1_000_000
+
+
+async def sniff_image_header(file: UploadFile, max_header_bytes: int = MAX_HEADER_BYTES) -> ImageHeader:
+    """
+    Parse the image header from the start of an upload.
+    
+    Reads only as many chunks as Pillow needs to identify the image
+    (usually the first few KB), without decoding or allocating any
+    pixels. The file position is reset afterwards.
+    
+    Raises:
+        InvalidImage: If no image header is found within `max_header_bytes`
+    """
+    head = b""
+    image = None
+    try:
+        await file.seek(0)
+        while image is None and len(head) < max_header_bytes:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            head += chunk
+            try:
+                # Image.open only parses the header; pixels are decoded lazily
+                image = Image.open(io.BytesIO(head))
+            except (OSError, SyntaxError, ValueError):
+                continue
+    finally:
+        await file.seek(0)
+        
+    if image is None:
+        raise InvalidImage("Invalid or unsupported image")
+    return ImageHeader(width=image.width, height=image.height, format=image.format, mode=image.mode)
+
+
+def upload_size(file: UploadFile) -> int:
+    """Total size of an upload in bytes, without reading it."""
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    size = file.file.seek(0, 2)
+    file.file.seek(position)
+    return size
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """
+    Read an upload, stopping as soon as it exceeds `max_bytes`.
+    
+    When the size is known up front the upload is read with a single call
+    into one buffer; otherwise it's read in chunks so oversized bodies are
+    cut off early.
+    
+    Raises:
+        UploadTooLarge: If the upload is larger than `max_bytes`
+    """
+    if file.size is not None:
+        if file.size > max_bytes:
+            raise UploadTooLarge()
+        await file.seek(0)
+        return await file.read()
+        
+    chunks = []
+    total = 0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,235 @@
+"""Pooled async HTTP client for third-party APIs, with retries and a circuit breaker."""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from app.metrics import (
+    upstream_circuit_state,
+    upstream_request_duration,
+    upstream_requests,
+    upstream_retries,
+    TOOL_NAME,
+)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Failures where the request never reached the server, so retrying can't repeat it
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after any retries."""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpen(UpstreamError):
+    """The upstream is failing; calls are refused without being attempted."""
+    
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after `failure_threshold` failures in a row.
+    
+    After `reset_timeout` seconds one trial call is let through (half open):
+    success closes the circuit again, failure reopens it for another period.
+    """
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._set_state(CLOSED)
+        
+    def _set_state(self, state: str):
+        self.state = state
+        upstream_circuit_state.labels(tool=TOOL_NAME, upstream=self.name).set(_STATE_VALUES[state])
+        
+    def before_call(self):
+        """Raise CircuitOpen unless a call may be made now."""
+        if self.state == CLOSED:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and remaining <= 0:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+        raise CircuitOpen(self.name, max(remaining, 1))
+        
+    def record_success(self):
+        self.failures = 0
+        self._trial_running = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+            
+    def release_trial(self):
+        """A call ended without telling us anything (e.g. it was cancelled); let another try."""
+        self._trial_running = False
+        
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+
+class RetryBudget:
+    """
+    Caps retries at `ratio` of recent requests (plus `min_retries` per window).
+    
+    Retries help with isolated blips but multiply load during an outage;
+    the budget keeps them to a fraction of traffic over the last `window`
+    seconds, so a struggling upstream isn't hit with several times the load.
+    """
+    
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window: float = 10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+                
+    def record_request(self):
+        self._requests.append(time.monotonic())
+        
+    def try_retry(self) -> bool:
+        """Take a retry from the budget; False if it's spent."""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+
+class UpstreamClient:
+    """
+    One pooled `httpx.AsyncClient` per upstream, shared by every request.
+    
+    Connections are kept alive between calls, each attempt has its own
+    timeout, failed attempts are retried with jittered backoff (within the
+    retry budget), and the circuit breaker fails fast while the upstream is
+    down. Call start() from the app lifespan and close() on shutdown; if it
+    wasn't started (e.g. in a script) the client is created on first use.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        headers: Optional[dict] = None,
+        timeout: float = 10,
+        connect_timeout: float = 3,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        max_retries: int = 2,
+        backoff: float = 0.2,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(name)
+        self.budget = budget or RetryBudget()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        
+    async def start(self):
+        if self._http is None or self._loop is not asyncio.get_running_loop():
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+            self._loop = asyncio.get_running_loop()
+            
+    async def close(self):
+        if self._http is not None:
+            http, self._http = self._http, None
+            await http.aclose()
+            
+    async def request(self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+        """
+        Make a request, retrying transient failures.
+        
+        Connection failures are always retried (nothing was sent). Timeouts,
+        429 and 5xx responses are retried only for idempotent calls; pass
+        `idempotent=True` for a POST that is safe to repeat.
+        
+        Raises:
+            CircuitOpen: If the upstream has been failing
+            UpstreamError: If the call failed or returned an error status
+        """
+        await self.start()
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        self.budget.record_request()
+        
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                response = await self._http.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                self._observe("error", started)
+                self.breaker.record_failure()
+                retryable = isinstance(e, _NOT_SENT) or (idempotent and isinstance(e, httpx.TransportError))
+                error = UpstreamError(f"{self.name} request failed: {e!r}")
+            except BaseException:
+                # Cancelled (client gone, timeout, shutdown) or a bug on our side;
+                # a half-open trial must not stay claimed forever
+                self.breaker.release_trial()
+                raise
+            else:
+                self._observe(f"{response.status_code // 100}xx", started)
+                transient = response.status_code == 429 or response.status_code >= 500
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if not transient and response.status_code < 400:
+                    return response
+                retryable = transient and idempotent
+                error = UpstreamError(
+                    f"{self.name} returned HTTP {response.status_code}", status_code=response.status_code
+                )
+                
+            if not retryable or attempt >= self.max_retries or not self.budget.try_retry():
+                raise error
+            attempt += 1
+            upstream_retries.labels(tool=TOOL_NAME, upstream=self.name).inc()
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            
+    def _observe(self, outcome: str, started: float):
+        upstream_requests.labels(tool=TOOL_NAME, upstream=self.name, outcome=outcome).inc()
+        upstream_request_duration.labels(tool=TOOL_NAME, upstream=self.name).observe(time.perf_counter() - started)
@@ -0,0 +1,241 @@
+"""Durable webhook intake: journal first, apply in batches in the background."""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from app.config import settings
+from app.metrics import webhook_batch_size, webhook_journal_pending, webhook_events_applied, TOOL_NAME
+
+
+@dataclass
+class JournalEntry:
+    """A received webhook waiting to be applied."""
+    id: int
+    event_key: str
+    event_type: str
+    payload: bytes
+    attempts: int
+
+
+class WebhookJournal:
+    """
+    Append-only local SQLite log of verified webhook payloads.
+    
+    Appending is one small synchronous insert (fsynced, so an acknowledged
+    event survives a crash); entries stay until they're applied, or until
+    they've failed `max_attempts` times and are left for inspection.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        # Opened on first use, so importing the app doesn't create the file
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        
+    def open(self):
+        """Open the database (WEBHOOK_JOURNAL_PATH unless a path was given); a no-op if open."""
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(
+                self.path or settings.WEBHOOK_JOURNAL_PATH, check_same_thread=False, isolation_level=None, timeout=5
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS webhook_journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_key TEXT NOT NULL,
+                    event_type TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    received_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS ix_webhook_journal_attempts ON webhook_journal (attempts, id);
+            """)
+            self._conn = conn
+            
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.open()
+        return self._conn
+        
+    def append(self, event_key: str, event_type: str, payload: bytes) -> int:
+        conn = self._connection()
+        with self._lock:
+            cursor = conn.execute(
+                "INSERT INTO webhook_journal (event_key, event_type, payload, received_at) VALUES (?, ?, ?, ?)",
+                (event_key, event_type, payload, time.time()),
+            )
+            return cursor.lastrowid
+            
+    def pending(self, limit: int, max_attempts: int) -> List[JournalEntry]:
+        """The oldest entries still to apply."""
+        conn = self._connection()
+        with self._lock:
+            rows = conn.execute(
+                "SELECT id, event_key, event_type, payload, attempts FROM webhook_journal "
+                "WHERE attempts < ? ORDER BY id LIMIT ?",
+                (max_attempts, limit),
+            ).fetchall()
+        return [JournalEntry(*row) for row in rows]
+        
+    def remove(self, ids: List[int]):
+        if not ids:
+            return
+        conn = self._connection()
+        with self._lock:
+            conn.executemany("DELETE FROM webhook_journal WHERE id = ?", [(i,) for i in ids])
+            
+    def record_failure(self, entry_id: int, error: str):
+        conn = self._connection()
+        with self._lock:
+            conn.execute(
+                "UPDATE webhook_journal SET attempts = attempts + 1, error = ? WHERE id = ?",
+                (error, entry_id),
+            )
+            
+    def count(self) -> int:
+        conn = self._connection()
+        with self._lock:
+            return conn.execute("SELECT COUNT(*) FROM webhook_journal").fetchone()[0]
+            
+    def clear(self):
+        conn = self._connection()
+        with self._lock:
+            conn.execute("DELETE FROM webhook_journal")
+
+
+def event_key(event: dict) -> str:
+    """Identity used to dedupe deliveries: the event id, else the order or checkout id."""
+    data = event.get("data") or {}
+    key = event.get("id") or (data.get("order") or {}).get("id") or data.get("id")
+    if not key:
+        raise ValueError("Event has no id")
+    return str(key)
+
+
+class WebhookProcessor:
+    """
+    Applies journaled webhooks in batches.
+    
+    The endpoint only appends to the journal and calls notify(); this
+    consumer wakes, waits `window` seconds so a burst lands in one batch,
+    then looks up the whole batch in the ledger's idempotency table with a
+    single query. Events already applied (provider retries, or entries a
+    crashed consumer didn't get to remove) are dropped without running the
+    handler; the rest are applied and recorded. A failed event stays in the
+    journal and is retried on the next pass, up to `max_attempts` times.
+    """
+    
+    def __init__(
+        self,
+        journal: WebhookJournal,
+        ledger,
+        handler: Callable[[dict], Awaitable[None]],
+        batch_size: int = 100,
+        window: float = 0.05,
+        retry_interval: float = 30,
+        max_attempts: int = 10,
+    ):
+        self.journal = journal
+        self.ledger = ledger
+        self.handler = handler
+        self.batch_size = max(1, batch_size)
+        self.window = window
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        
+    async def start(self):
+        await asyncio.to_thread(self.journal.open)
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()  # Apply whatever was journaled before a restart
+        self._task = asyncio.create_task(self._loop())
+        
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            
+    def notify(self):
+        """Wake the consumer; called after each append."""
+        webhook_journal_pending.labels(tool=TOOL_NAME).inc()
+        if self._wakeup is not None:
+            self._wakeup.set()
+            
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await asyncio.sleep(self.window)
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"Webhook batch failed, will retry: {e}")
+                
+    async def drain(self) -> int:
+        """Apply pending entries batch by batch; returns how many were applied."""
+        applied = 0
+        while True:
+            entries = await asyncio.to_thread(self.journal.pending, self.batch_size, self.max_attempts)
+            if not entries:
+                break
+            done, failed = await self.run_batch(entries)
+            applied += done
+            if failed:
+                # Retried after retry_interval rather than spinning on them
+                break
+        webhook_journal_pending.labels(tool=TOOL_NAME).set(await asyncio.to_thread(self.journal.count))
+        return applied
+        
+    async def run_batch(self, entries: List[JournalEntry]):
+        webhook_batch_size.labels(tool=TOOL_NAME).observe(len(entries))
+        seen = await self.ledger.seen_events({entry.event_key for entry in entries})
+        finished, recorded, failed = [], [], 0
+        for entry in entries:
+            if entry.event_key in seen:
+                webhook_events_applied.labels(tool=TOOL_NAME, result="duplicate").inc()
+                finished.append(entry.id)
+                continue
+            try:
+                await self.handler(json.loads(entry.payload))
+            except Exception as e:
+                failed += 1
+                webhook_events_applied.labels(tool=TOOL_NAME, result="error").inc()
+                print(f"Webhook {entry.event_key} ({entry.event_type}) failed: {e}")
+                await asyncio.to_thread(self.journal.record_failure, entry.id, str(e))
+                continue
+            # Duplicates within one batch are skipped too
+            seen.add(entry.event_key)
+            recorded.append((entry.event_key, entry.event_type))
+            finished.append(entry.id)
+            webhook_events_applied.labels(tool=TOOL_NAME, result="applied").inc()
+            
+        # Handlers are idempotent themselves (grants are unique per order), so a
+        # crash between applying and recording only costs a cheap re-check
+        await self.ledger.record_events(recorded)
+        await asyncio.to_thread(self.journal.remove, finished)
+        return len(recorded), failed
+
+
+webhook_journal = WebhookJournal()
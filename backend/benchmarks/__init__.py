@@ -0,0 +1 @@
+# BgGone Benchmarks
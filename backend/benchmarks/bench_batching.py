@@ -0,0 +1,89 @@
+"""
+Benchmark mask throughput against the micro-batching window.
+
+Runs the real model from app.services.background_remover with a number
+of concurrent callers and reports images per second for each window.
+
+Usage (from backend/):
+    python -m benchmarks.bench_batching --concurrency 8 --windows 0 2 5 10 20
+"""
+import argparse
+import json
+import threading
+import time
+
+from PIL import Image
+
+from app.services.background_remover import get_session
+from app.services.batcher import MaskBatcher
+
+
+def run_window(session, window_ms: float, max_batch_size: int, concurrency: int, images_per_caller: int) -> dict:
+    """Measure throughput for a single batching window."""
+    batcher = MaskBatcher(session, window_ms=window_ms, max_batch_size=max_batch_size)
+    image = Image.effect_noise((640, 480), 64).convert("RGB")
+    latencies = []
+    lock = threading.Lock()
+    
+    def caller():
+        for _ in range(images_per_caller):
+            start = time.perf_counter()
+            batcher.predict(image)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                
+    # Warm up the session and the batcher thread
+    batcher.predict(image)
+    
+    threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    return {
+        "window_ms": window_ms,
+        "max_batch_size": max_batch_size,
+        "batching": batcher.enabled,
+        "images": len(latencies),
+        "images_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images-per-caller", type=int, default=8)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10, 20, 50])
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    results = []
+    with get_session() as session:
+        # Window 0 with batch size 1 is the unbatched baseline
+        results.append(run_window(session, 0, 1, args.concurrency, args.images_per_caller))
+        for window_ms in args.windows:
+            results.append(
+                run_window(session, window_ms, args.max_batch_size, args.concurrency, args.images_per_caller)
+            )
+            
+    print(f"{'window_ms':>10} {'batch':>6} {'img/s':>8} {'p50_ms':>8} {'p95_ms':>8}")
+    for result in results:
+        print(
+            f"{result['window_ms']:>10} {result['max_batch_size']:>6} "
+            f"{result['images_per_second']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8}"
+        )
+        
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
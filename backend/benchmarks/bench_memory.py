@@ -0,0 +1,150 @@
+"""
+Measure peak memory per request.
+
+For each corpus image, reports:
+  - traced_peak_mb: peak of Python and NumPy allocations (tracemalloc)
+  - rss_peak_mb: growth of the process's resident high-water mark, which
+    also covers Pillow and ONNX Runtime buffers (Linux only)
+  - copies: rss_peak_mb in units of the decoded RGBA image, i.e. roughly
+    how many full-size buffers were alive at once
+
+By default remove_background_sync is measured; --app sends the image
+through the ASGI app in-process so upload parsing and the response body
+are included too.
+
+Usage (from backend/):
+    python -m benchmarks.bench_memory --sizes 2mp 12mp --formats jpeg --quality fast
+    python -m benchmarks.bench_memory --app --json memory.json
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tracemalloc
+import uuid
+
+from app.services.background_remover import parse_options, remove_background_sync
+from benchmarks.corpus import DEFAULT_CORPUS_DIR, FORMATS, SIZES, build_corpus
+from benchmarks.report import write_report
+
+
+def _status_kb(field: str) -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def reset_rss_peak() -> bool:
+    """Reset VmHWM to the current RSS (Linux 4.0+). Returns False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(fn) -> dict:
+    """Run `fn` once and return its peak memory use."""
+    gc.collect()
+    rss_supported = reset_rss_peak()
+    rss_before = _status_kb("VmRSS")
+    tracemalloc.start()
+    try:
+        fn()
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    rss_peak = _status_kb("VmHWM") - rss_before if rss_supported else 0
+    return {
+        "traced_peak_mb": round(traced_peak / 2**20, 1),
+        "rss_peak_mb": round(rss_peak / 1024, 1) if rss_supported else None,
+    }
+
+
+def app_runner(app, options):
+    """Returns a function that posts an image to /api/v1/remove-bg in-process."""
+    import httpx
+    
+    async def post(data: bytes, filename: str):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post(
+                "/api/v1/remove-bg",
+                headers={"X-Device-ID": f"bench-{uuid.uuid4().hex}"},
+                files={"file": (filename, data)},
+                data={"quality": options.quality, "model": options.model, "output_format": options.output_format},
+            )
+            response.raise_for_status()
+            
+    return lambda data, filename: asyncio.run(post(data, filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["2mp", "12mp"], choices=list(SIZES))
+    parser.add_argument("--formats", nargs="+", default=["jpeg", "png"], choices=list(FORMATS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quality", default="fast")
+    parser.add_argument("--model")
+    parser.add_argument("--output-format")
+    parser.add_argument("--app", action="store_true", help="Measure the whole HTTP request in-process")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    options = parse_options(args.quality, args.model, args.output_format)
+    corpus = build_corpus(args.sizes, args.formats, args.corpus_dir)
+    
+    if args.app:
+        from app.config import settings
+        from app.main import app
+        
+        # Measure processing, not cache hits or the daily limit
+        settings.RESULT_CACHE_ENABLED = False
+        settings.FREE_DAILY_LIMIT = 10**9
+        run = app_runner(app, options)
+    else:
+        run = lambda data, filename: remove_background_sync(data, options)
+        
+    # Warm up: load the model and touch every code path once
+    run(corpus[0].read(), os.path.basename(corpus[0].path))
+    
+    results = []
+    print(f"{'image':<12} {'MP':>6} {'traced_mb':>10} {'rss_mb':>10} {'copies':>8}")
+    for image in corpus:
+        data = image.read()
+        filename = os.path.basename(image.path)
+        samples = [measure(lambda: run(data, filename)) for _ in range(args.repeats)]
+        traced = max(sample["traced_peak_mb"] for sample in samples)
+        rss = max((sample["rss_peak_mb"] or 0) for sample in samples) if samples[0]["rss_peak_mb"] is not None else None
+        decoded_mb = image.width * image.height * 4 / 2**20
+        copies = round(rss / decoded_mb, 2) if rss is not None else None
+        results.append({
+            "name": image.name,
+            "megapixels": image.megapixels,
+            "input_bytes": len(data),
+            "traced_peak_mb": traced,
+            "rss_peak_mb": rss,
+            "copies": copies,
+        })
+        print(f"{image.name:<12} {image.megapixels:>6} {traced:>10} {rss if rss is not None else '-':>10} {copies if copies is not None else '-':>8}")
+        
+    if args.json:
+        config = {
+            "repeats": args.repeats,
+            "quality": options.quality,
+            "model": options.model,
+            "output_format": options.output_format,
+            "app": args.app,
+        }
+        write_report(args.json, "memory", config, results)
+
+
+if __name__ == "__main__":
+    main()
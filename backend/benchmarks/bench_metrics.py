@@ -0,0 +1,122 @@
+"""
+Measure Prometheus instrumentation overhead.
+
+Replays the metric updates one remove-bg request makes (usage counter,
+upload size, cache lookup, single-flight role, stage timings, encoding,
+queue and outcome) in a tight loop, two ways:
+  - labels: resolving every child with .labels(tool=..., ...) per call
+  - bound: the pre-bound children app.metrics exports
+and reports the cost per request in microseconds. Also times rendering
+the /metrics page, uncached and cached.
+
+--multiprocess runs with PROMETHEUS_MULTIPROC_DIR set (as under
+app.serve with several processes), where every update writes to an
+mmap'd file and rendering reads every process's files.
+
+Usage (from backend/):
+    python -m benchmarks.bench_metrics --iterations 20000
+    python -m benchmarks.bench_metrics --multiprocess --json metrics.json
+"""
+import argparse
+import os
+import tempfile
+import time
+
+STAGES = ("decode", "inference", "matting", "encode")
+
+
+def record_with_labels(m, tool: str):
+    """One request's metric updates, resolving each child per call."""
+    m.free_trial_used.labels(tool=tool).inc()
+    m.file_size_bytes.labels(tool=tool).observe(250_000)
+    m.result_cache_requests.labels(tool=tool, tier="all", result="miss").inc()
+    m.single_flight_requests.labels(tool=tool, role="leader").inc()
+    m.inference_queue_depth.labels(tool=tool).set(1)
+    m.inference_queue_wait.labels(tool=tool).observe(0.001)
+    m.inference_queue_depth.labels(tool=tool).set(0)
+    m.bg_input_megapixels.labels(tool=tool, model="u2net").observe(2.0)
+    for stage in STAGES:
+        m.bg_removal_stage_duration.labels(
+            tool=tool, stage=stage, quality="fast", model="u2net", size_class="0.5-2mp"
+        ).observe(0.01)
+    m.inference_batch_size.labels(tool=tool).observe(1)
+    m.bg_encode_duration.labels(tool=tool, format="png-fast").observe(0.01)
+    m.bg_output_bytes.labels(tool=tool, format="png-fast").observe(400_000)
+    m.bg_removal_total.labels(tool=tool, status="success").inc()
+    m.bg_removal_duration.labels(tool=tool).observe(0.1)
+
+
+def record_bound(m):
+    """The same updates through the pre-bound children."""
+    m.free_trials_used.inc()
+    m.uploaded_file_bytes.observe(250_000)
+    m.result_cache_misses.inc()
+    m.single_flight_leaders.inc()
+    m.queue_depth.set(1)
+    m.queue_wait.observe(0.001)
+    m.queue_depth.set(0)
+    m.input_megapixels("u2net").observe(2.0)
+    for stage in STAGES:
+        m.stage_duration(stage, "fast", "u2net", "0.5-2mp").observe(0.01)
+    m.batch_size.observe(1)
+    m.encode_duration("png-fast").observe(0.01)
+    m.output_size("png-fast").observe(400_000)
+    m.removals_succeeded.inc()
+    m.removal_duration.observe(0.1)
+
+
+def per_call_us(fn, iterations: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 2)
+
+
+def bench_instrumentation(iterations: int) -> dict:
+    """Per-request instrumentation cost, and /metrics render times."""
+    from app import metrics
+    
+    labels_us = per_call_us(lambda: record_with_labels(metrics, metrics.TOOL_NAME), iterations)
+    bound_us = per_call_us(lambda: record_bound(metrics), iterations)
+    
+    exposition = metrics.Exposition(max_age=0)
+    render_ms = round(per_call_us(exposition.render, 20) / 1000, 2)
+    cached = metrics.Exposition(max_age=3600)
+    cached_ms = round(per_call_us(cached.render, 200) / 1000, 4)
+    return {
+        "multiprocess": bool(metrics.multiprocess_dir()),
+        "labels_us_per_request": labels_us,
+        "bound_us_per_request": bound_us,
+        "speedup": round(labels_us / bound_us, 2) if bound_us else None,
+        "render_ms": render_ms,
+        "cached_render_ms": cached_ms,
+        "exposition_bytes": len(exposition.render()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--multiprocess", action="store_true", help="Use prometheus_client multiprocess mode")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    if args.multiprocess:
+        # Must be set before prometheus_client is imported
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="bench-metrics-")
+        
+    result = bench_instrumentation(args.iterations)
+    mode = "multiprocess" if result["multiprocess"] else "in-process"
+    print(f"{mode}: {result['labels_us_per_request']}us/request with .labels(), "
+          f"{result['bound_us_per_request']}us bound ({result['speedup']}x)")
+    print(f"/metrics render: {result['render_ms']}ms uncached, {result['cached_render_ms']}ms cached, "
+          f"{result['exposition_bytes']} bytes")
+          
+    if args.json:
+        from benchmarks.report import write_report
+        write_report(args.json, "metrics", {"iterations": args.iterations, "mode": mode}, [result])
+
+
+if __name__ == "__main__":
+    main()
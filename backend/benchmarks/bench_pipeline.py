@@ -0,0 +1,91 @@
+"""
+Benchmark the remove-bg pipeline stage by stage.
+
+Runs remove_background_sync over the synthetic corpus (0.3, 2, 12 and
+40 MP in JPEG, PNG and WebP) and reports decode, inference, matting,
+upsample, encode and end-to-end times for each input.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pipeline --repeats 3 --json pipeline.json
+    python -m benchmarks.bench_pipeline --sizes 0.3mp 2mp --formats jpeg --quality fast
+    python -m benchmarks.bench_pipeline --sizes 40mp --region roi
+"""
+import argparse
+import time
+
+from app.services.background_remover import parse_options, remove_background_sync
+from app.services.timing import StageTimings
+from benchmarks.corpus import DEFAULT_CORPUS_DIR, FORMATS, SIZES, build_corpus
+from benchmarks.report import summarize_ms, write_report
+
+STAGES = ("decode", "locate", "inference", "matting", "upsample", "encode")
+
+
+def bench_image(image, options, repeats: int) -> dict:
+    """Run one corpus image `repeats` times and summarize each stage."""
+    data = image.read()
+    stage_samples = {stage: [] for stage in STAGES}
+    totals = []
+    output_bytes = 0
+    for _ in range(repeats):
+        timings = StageTimings(options.quality, options.model)
+        start = time.perf_counter()
+        output_bytes = len(remove_background_sync(data, options, timings))
+        totals.append(time.perf_counter() - start)
+        for stage, duration in timings.durations.items():
+            stage_samples.setdefault(stage, []).append(duration)
+            
+    return {
+        "name": image.name,
+        "size_class": image.size_class,
+        "format": image.format,
+        "megapixels": image.megapixels,
+        "input_bytes": len(data),
+        "output_bytes": output_bytes,
+        "stages": {stage: summarize_ms(samples) for stage, samples in stage_samples.items() if samples},
+        "end_to_end": summarize_ms(totals),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quality")
+    parser.add_argument("--model")
+    parser.add_argument("--output-format")
+    parser.add_argument("--region", help="full, roi or tiled")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    options = parse_options(args.quality, args.model, args.output_format, args.region)
+    corpus = build_corpus(args.sizes, args.formats, args.corpus_dir)
+    
+    # Warm up: load the model and touch every code path once
+    remove_background_sync(corpus[0].read(), options)
+    
+    results = []
+    print(f"{'image':<12} {'MP':>6} " + " ".join(f"{stage:>10}" for stage in STAGES) + f" {'total_ms':>10}")
+    for image in corpus:
+        result = bench_image(image, options, args.repeats)
+        results.append(result)
+        stages = " ".join(
+            f"{result['stages'][stage]['p50_ms'] if stage in result['stages'] else '-':>10}" for stage in STAGES
+        )
+        print(f"{image.name:<12} {image.megapixels:>6} {stages} {result['end_to_end']['p50_ms']:>10}")
+        
+    if args.json:
+        config = {
+            "repeats": args.repeats,
+            "quality": options.quality,
+            "model": options.model,
+            "output_format": options.output_format,
+            "region": options.region,
+        }
+        write_report(args.json, "pipeline", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compare ONNX Runtime session configurations for a model.
+
+For each configuration reports session load time, single-image inference
+latency and, against the untuned fp32 baseline, how much the mask
+changes (mean absolute difference on a 0-255 scale):
+
+    ort-default    ONNX Runtime defaults (all cores, graph optimized on every load)
+    tuned          intra-op threads sized for --processes x --concurrent-runs
+    graph-cache    tuned, loading a previously saved optimized graph
+    int8           tuned, INT8 variant (if generated; see app.services.quantization)
+
+Usage (from backend/):
+    python -m benchmarks.bench_sessions --model u2net --processes 2 --json sessions.json
+"""
+import argparse
+import os
+import tempfile
+import time
+from dataclasses import replace
+
+import numpy as np
+from PIL import Image
+
+from app.services.batcher import prediction_to_mask
+from app.services.model_registry import (
+    MODEL_CONFIGS,
+    ModelConfig,
+    available_cpus,
+    create_session,
+    default_intra_op_threads,
+    quantized_model_path,
+    rembg_session_classes,
+)
+from app.services.quantization import preprocess
+from benchmarks.corpus import DEFAULT_CORPUS_DIR, build_corpus
+from benchmarks.report import summarize_ms, write_report
+
+
+def bench_config(label: str, config: ModelConfig, graph_cache_dir: str, tensor, size, runs: int) -> dict:
+    """Load a session for `config` and time `runs` inferences."""
+    start = time.perf_counter()
+    session = create_session(config, graph_cache_dir=graph_cache_dir)
+    load_s = time.perf_counter() - start
+    
+    inputs = {session.inner_session.get_inputs()[0].name: tensor}
+    session.inner_session.run(None, inputs)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = session.inner_session.run(None, inputs)
+        latencies.append(time.perf_counter() - start)
+        
+    mask = prediction_to_mask(output[0][0, 0], size)
+    return {
+        "config": label,
+        "intra_op_threads": config.intra_op_threads,
+        "variant": config.variant,
+        "load_s": round(load_s, 3),
+        "inference": summarize_ms(latencies),
+        "_mask": np.asarray(mask, dtype=np.float32),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes sharing the host")
+    parser.add_argument("--concurrent-runs", type=int, default=1, help="Concurrent inferences per process")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    image = Image.open(build_corpus(["2mp"], ["jpeg"], args.corpus_dir)[0].path).convert("RGB")
+    tensor = preprocess(image, args.model)
+    threads = default_intra_op_threads(available_cpus(), args.processes, args.concurrent_runs)
+    base = MODEL_CONFIGS.get(args.model, ModelConfig(args.model, memory_mb=500))
+    tuned = replace(base, intra_op_threads=threads, inter_op_threads=1)
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = [bench_config("ort-default", base, "", tensor, image.size, args.runs)]
+        results.append(bench_config("tuned", tuned, "", tensor, image.size, args.runs))
+        # The first cached load writes the graph; time the second, which reuses it
+        create_session(tuned, graph_cache_dir=cache_dir)
+        results.append(bench_config("graph-cache", tuned, cache_dir, tensor, image.size, args.runs))
+        
+        int8 = replace(tuned, variant="int8")
+        try:
+            results.append(bench_config("int8", int8, "", tensor, image.size, args.runs))
+        except FileNotFoundError as e:
+            print(f"Skipping int8: {e}")
+            
+    baseline = results[0]["_mask"]
+    print(f"{'config':<12} {'threads':>7} {'load_s':>7} {'p50_ms':>8} {'p95_ms':>8} {'mask_diff':>9}")
+    for result in results:
+        result["mask_mean_abs_diff"] = round(float(np.abs(result.pop("_mask") - baseline).mean()), 3)
+        print(
+            f"{result['config']:<12} {result['intra_op_threads']:>7} {result['load_s']:>7} "
+            f"{result['inference']['p50_ms']:>8} {result['inference']['p95_ms']:>8} "
+            f"{result['mask_mean_abs_diff']:>9}"
+        )
+        
+    if args.json:
+        config = {
+            "model": args.model,
+            "processes": args.processes,
+            "concurrent_runs": args.concurrent_runs,
+            "cpus": available_cpus(),
+            "runs": args.runs,
+            "int8_model": os.path.exists(quantized_model_path(str(_model_file(args.model)))),
+        }
+        write_report(args.json, "sessions", config, results)
+
+
+def _model_file(model: str):
+    return rembg_session_classes()[model].download_models()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare two benchmark JSON reports and flag regressions.
+
+Matches results by image (pipeline) or concurrency level (load) and
+prints the p50 change. Exits with status 1 if anything got slower by
+more than --threshold percent, so it can gate CI.
+
+Usage (from backend/):
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def _metrics(report: dict) -> Dict[Tuple[str, str], float]:
+    """Flatten a report into {(case, metric): p50 milliseconds}."""
+    metrics = {}
+    for result in report["results"]:
+        if report["benchmark"] == "pipeline":
+            metrics[(result["name"], "end_to_end")] = result["end_to_end"]["p50_ms"]
+            for stage, summary in result["stages"].items():
+                metrics[(result["name"], stage)] = summary["p50_ms"]
+        elif report["benchmark"] == "load":
+            metrics[(f"c={result['concurrency']}", "p50")] = result["p50_ms"]
+            metrics[(f"c={result['concurrency']}", "p99")] = result["p99_ms"]
+    return metrics
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> Tuple[list, bool]:
+    """Return rows of (case, metric, before, after, change %) and whether any regressed."""
+    before, after = _metrics(baseline), _metrics(candidate)
+    rows = []
+    regressed = False
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        rows.append((*key, before[key], after[key], change))
+        regressed = regressed or change > threshold
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown in percent")
+    args = parser.parse_args()
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["benchmark"] != candidate["benchmark"]:
+        sys.exit("Reports are from different benchmarks")
+    if baseline["environment"].get("cpus") != candidate["environment"].get("cpus"):
+        print("Warning: reports were produced on machines with different CPU counts")
+        
+    rows, regressed = compare(baseline, candidate, args.threshold)
+    print(f"{'case':<14} {'metric':<11} {'before_ms':>10} {'after_ms':>10} {'change':>8}")
+    for case, metric, before, after, change in rows:
+        flag = "  <-- slower" if change > args.threshold else ""
+        print(f"{case:<14} {metric:<11} {before:>10} {after:>10} {change:>+7.1f}%{flag}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Fixed corpus of synthetic images for benchmarks.
+
+Images are generated deterministically (same pixels on every machine and
+every run): a soft-edged subject with fine detail on a textured gradient
+background, which exercises segmentation, matting and the encoders more
+realistically than flat colours. Generated files are cached on disk.
+"""
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# Size class -> (width, height)
+SIZES: Dict[str, tuple] = {
+    "0.3mp": (640, 480),
+    "2mp": (1728, 1152),
+    "12mp": (4000, 3000),
+    "40mp": (7744, 5163),
+}
+
+FORMATS: Dict[str, dict] = {
+    "jpeg": {"format": "JPEG", "quality": 90},
+    "png": {"format": "PNG"},
+    "webp": {"format": "WEBP", "quality": 90},
+}
+
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "bggone-bench-corpus")
+
+
+@dataclass
+class CorpusImage:
+    """One benchmark input."""
+    size_class: str
+    format: str
+    width: int
+    height: int
+    path: str
+    
+    @property
+    def name(self) -> str:
+        return f"{self.size_class}.{self.format}"
+        
+    @property
+    def megapixels(self) -> float:
+        return round(self.width * self.height / 1_000_000, 2)
+        
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Generate the deterministic test scene at the given size."""
+    rng = np.random.default_rng(seed)
+    
+    # Background: diagonal gradient with low-frequency texture
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    gradient = (x / width * 0.6 + y / height * 0.4) * 160 + 40
+    texture = rng.normal(0, 12, (height // 8 + 1, width // 8 + 1)).astype(np.float32)
+    texture = np.kron(texture, np.ones((8, 8), dtype=np.float32))[:height, :width]
+    background = np.stack([gradient + texture, gradient * 0.9 + texture, gradient * 0.7 + texture], axis=-1)
+    image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), "RGB")
+    del y, x, gradient, texture, background
+    
+    # Subject: an ellipse body with a head and thin strands for matting to work on
+    draw = ImageDraw.Draw(image)
+    cx, cy = width // 2, height // 2
+    body = (cx - width // 6, cy - height // 8, cx + width // 6, cy + height // 2.5)
+    head = (cx - width // 12, cy - height // 3, cx + width // 12, cy - height // 10)
+    draw.ellipse(body, fill=(210, 60, 50))
+    draw.ellipse(head, fill=(235, 190, 160))
+    strand_width = max(1, width // 1000)
+    for i in range(60):
+        angle = np.pi * (0.1 + 0.8 * i / 60)
+        length = height // 6 * (0.6 + 0.4 * rng.random())
+        x0, y0 = cx + np.cos(angle) * width // 14, cy - height // 4 - np.sin(angle) * height // 14
+        draw.line(
+            (x0, y0, x0 + np.cos(angle) * length, y0 - np.sin(angle) * length),
+            fill=(60, 40, 30),
+            width=strand_width,
+        )
+    return image.filter(ImageFilter.GaussianBlur(radius=max(1, width // 1500)))
+
+
+def encode(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, **FORMATS[fmt])
+    return buffer.getvalue()
+
+
+def build_corpus(
+    sizes: Sequence[str] = tuple(SIZES),
+    formats: Sequence[str] = tuple(FORMATS),
+    directory: str = DEFAULT_CORPUS_DIR,
+) -> List[CorpusImage]:
+    """Generate (or reuse) the corpus images and return their descriptions."""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for size_class in sizes:
+        width, height = SIZES[size_class]
+        image = None
+        for fmt in formats:
+            path = os.path.join(directory, f"{size_class}.{fmt}")
+            if not os.path.exists(path):
+                if image is None:
+                    image = synthetic_image(width, height)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(encode(image, fmt))
+                os.replace(tmp_path, path)
+            corpus.append(CorpusImage(size_class, fmt, width, height, path))
+    return corpus
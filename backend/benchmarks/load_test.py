@@ -0,0 +1,142 @@
+"""
+HTTP load driver for /api/v1/remove-bg.
+
+Sends requests at each concurrency level and reports p50/p95/p99 latency,
+requests per second and status codes. Runs in-process against the ASGI
+app by default; pass --url to load a running server instead.
+
+The result cache is disabled and the daily limit lifted for in-process
+runs, so every request does the full work.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --concurrency 1 4 8 16 --requests 64 --json load.json
+    python -m benchmarks.load_test --url http://localhost:30066 --size 2mp --format png
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+import httpx
+
+from benchmarks.corpus import DEFAULT_CORPUS_DIR, FORMATS, SIZES, build_corpus
+from benchmarks.report import percentile, write_report
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+
+def make_client(url: Optional[str], timeout: float) -> httpx.AsyncClient:
+    """Client for a running server, or for the app in this process."""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+    from app.config import settings
+    from app.main import app
+    
+    settings.RESULT_CACHE_ENABLED = False
+    settings.FREE_DAILY_LIMIT = 10 ** 9
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=timeout)
+
+
+async def run_level(client, image: bytes, filename: str, media_type: str, form: dict,
+                    concurrency: int, total_requests: int) -> dict:
+    """Send `total_requests` with `concurrency` in flight and summarize."""
+    latencies = []
+    statuses = Counter()
+    remaining = total_requests
+    
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/api/v1/remove-bg",
+                    headers={"X-Device-ID": f"bench-{uuid.uuid4().hex}"},
+                    files={"file": (filename, image, media_type)},
+                    data=form,
+                )
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    
+    ok = statuses.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_second": round(total_requests / elapsed, 2),
+        "successes_per_second": round(ok / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "statuses": dict(statuses),
+    }
+
+
+async def run(args) -> list:
+    image = build_corpus([args.size], [args.format], args.corpus_dir)[0]
+    data = image.read()
+    form = {key: value for key, value in (
+        ("quality", args.quality), ("model", args.model), ("output_format", args.output_format)
+    ) if value}
+    
+    results = []
+    async with make_client(args.url, args.timeout) as client:
+        # Warm up (loads the model in-process)
+        await run_level(client, data, f"bench.{args.format}", MEDIA_TYPES[args.format], form, 1, 1)
+        
+        print(f"{'conc':>5} {'rps':>8} {'ok/s':>8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}  statuses")
+        for concurrency in args.concurrency:
+            result = await run_level(
+                client, data, f"bench.{args.format}", MEDIA_TYPES[args.format], form,
+                concurrency, max(args.requests, concurrency),
+            )
+            results.append(result)
+            print(
+                f"{concurrency:>5} {result['requests_per_second']:>8} {result['successes_per_second']:>8} "
+                f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}  {result['statuses']}"
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process app)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--size", default="0.3mp", choices=list(SIZES))
+    parser.add_argument("--format", default="jpeg", choices=list(FORMATS))
+    parser.add_argument("--quality")
+    parser.add_argument("--model")
+    parser.add_argument("--output-format")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    
+    if args.json:
+        config = {
+            "url": args.url or "asgi",
+            "size": args.size,
+            "format": args.format,
+            "quality": args.quality,
+            "model": args.model,
+            "output_format": args.output_format,
+            "requests": args.requests,
+        }
+        write_report(args.json, "load", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,25 @@
 """Test configuration and fixtures."""
+import asyncio
+import os
+
+# The credit ledger and webhook journal use in-memory SQLite databases in tests
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("WEBHOOK_JOURNAL_PATH", ":memory:")
+# Tests read /metrics right after recording something
+os.environ.setdefault("METRICS_CACHE_SECONDS", "0")
+
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from app.services import rate_limiter
+from app.services.credits import credit_ledger
+
+
+@pytest.fixture(scope="session", autouse=True)
+def close_credit_ledger():
+    """Close the ledger's connection so its aiosqlite thread exits with the tests."""
+    yield
+    asyncio.run(credit_ledger.close())
 
 
 @pytest.fixture
@@ -14,9 +31,33 @@ def client():
 @pytest.fixture
 def reset_rate_limiter():
     """Reset rate limiter between tests."""
-    rate_limiter._device_usage.clear()
+    rate_limiter.limiter_store.clear()
     yield
-    rate_limiter._device_usage.clear()
+    rate_limiter.limiter_store.clear()
+
+
+@pytest.fixture
+async def ledger():
+    """The credit ledger with empty tables."""
+    from app.services.credits import metadata
+    
+    await credit_ledger.start()
+    async with credit_ledger.engine.begin() as conn:
+        for table in reversed(metadata.sorted_tables):
+            await conn.execute(table.delete())
+    credit_ledger.clear_cache()
+    yield credit_ledger
+    credit_ledger.clear_cache()
+
+
+@pytest.fixture
+def reset_result_cache():
+    """Empty the result cache between tests."""
+    from app.services.result_cache import result_cache
+    
+    result_cache.clear()
+    yield result_cache
+    result_cache.clear()
 
 
 @pytest.fixture
@@ -45,3 +86,68 @@ def large_image():
     img.save(buffer, format='PNG')
     buffer.seek(0)
     return buffer.getvalue()
+
+
+class _FakeInput:
+    """Stand-in for an ONNX input description."""
+    
+    def __init__(self, shape):
+        self.name = "input.1"
+        self.shape = shape
+
+
+class _FakeInnerSession:
+    """Stand-in for onnxruntime.InferenceSession used by rembg sessions."""
+    
+    def __init__(self, batch_dim="batch_size"):
+        self.batch_dim = batch_dim
+        self.batch_sizes = []
+        
+    def get_inputs(self):
+        return [_FakeInput([self.batch_dim, 3, 320, 320])]
+        
+    def run(self, output_names, inputs):
+        import numpy as np
+        
+        tensor = next(iter(inputs.values()))
+        self.batch_sizes.append(tensor.shape[0])
+        # Brighter pixels are "foreground"
+        return [tensor.mean(axis=1, keepdims=True)]
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    """Replace rembg model sessions with fast, model-free stand-ins."""
+    from rembg.sessions.u2net import U2netSession
+    from app.services.model_registry import model_registry
+    
+    class FakeSession(U2netSession):
+        def __init__(self, model_name="u2net", batch_dim="batch_size"):
+            self.model_name = model_name
+            self.inner_session = _FakeInnerSession(batch_dim)
+            
+    sessions = {}
+    
+    def factory(config):
+        sessions[config.name] = FakeSession(config.name)
+        return sessions[config.name]
+        
+    model_registry.unload_all()
+    monkeypatch.setattr(model_registry, "session_factory", factory)
+    with model_registry.session("u2net") as session:
+        session.created = sessions
+    yield session
+    model_registry.unload_all()
+
+
+@pytest.fixture
+def subject_image():
+    """Create a test image with a bright subject on a dark background."""
+    from PIL import Image, ImageDraw
+    import io
+    
+    img = Image.new('RGB', (120, 80), color=(10, 10, 10))
+    ImageDraw.Draw(img).ellipse((30, 15, 90, 65), fill=(250, 250, 250))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
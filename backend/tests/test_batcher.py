@@ -0,0 +1,100 @@
+"""Tests for mask micro-batching."""
+import io
+import threading
+
+from PIL import Image
+
+from app.services.batcher import MaskBatcher
+
+
+def _predict_concurrently(batcher, images):
+    masks = [None] * len(images)
+    
+    def worker(i):
+        masks[i] = batcher.predict(images[i])
+        
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return masks
+
+
+def test_concurrent_requests_share_one_run(fake_session):
+    """Test requests arriving within the window run as one batch."""
+    batcher = MaskBatcher(fake_session, window_ms=200, max_batch_size=4)
+    images = [
+        Image.new("RGB", (40 + i * 10, 30), color=(255, 255, 255)) for i in range(4)
+    ]
+    
+    masks = _predict_concurrently(batcher, images)
+    
+    assert fake_session.inner_session.batch_sizes == [4]
+    for image, mask in zip(images, masks):
+        # Each caller gets its own mask at its own size
+        assert mask.size == image.size
+        assert mask.mode == "L"
+
+
+def test_batch_size_is_capped(fake_session):
+    """Test no batch exceeds max_batch_size."""
+    batcher = MaskBatcher(fake_session, window_ms=100, max_batch_size=2)
+    images = [Image.new("RGB", (32, 32)) for _ in range(5)]
+    
+    masks = _predict_concurrently(batcher, images)
+    
+    assert all(mask is not None for mask in masks)
+    assert sum(fake_session.inner_session.batch_sizes) == 5
+    assert max(fake_session.inner_session.batch_sizes) <= 2
+
+
+def test_fixed_batch_models_are_not_batched(fake_session):
+    """Test models exported with batch dimension 1 fall back to predict()."""
+    fake_session.inner_session.batch_dim = 1
+    batcher = MaskBatcher(fake_session, window_ms=50, max_batch_size=4)
+    
+    assert batcher.enabled is False
+    images = [Image.effect_noise((32, 32), 64).convert("RGB") for _ in range(3)]
+    _predict_concurrently(batcher, images)
+    assert fake_session.inner_session.batch_sizes == [1, 1, 1]
+
+
+def test_errors_reach_every_caller(fake_session):
+    """Test a failed batch raises in each waiting caller."""
+    batcher = MaskBatcher(fake_session, window_ms=50, max_batch_size=4)
+    
+    def broken_run(output_names, inputs):
+        raise RuntimeError("onnx failure")
+        
+    fake_session.inner_session.run = broken_run
+    errors = []
+    
+    def worker():
+        try:
+            batcher.predict(Image.new("RGB", (16, 16)))
+        except RuntimeError as e:
+            errors.append(e)
+            
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        
+    assert len(errors) == 2
+
+
+async def test_remove_background_pipeline(fake_session, subject_image):
+    """Test the full pipeline returns a transparent PNG."""
+    from app.services.background_remover import remove_background
+    
+    result = await remove_background(subject_image)
+    
+    output = Image.open(io.BytesIO(result))
+    assert output.format == "PNG"
+    assert output.mode == "RGBA"
+    assert output.size == (120, 80)
+    # Subject kept, background removed
+    assert output.getpixel((60, 40))[3] > 200
+    assert output.getpixel((2, 2))[3] < 50
@@ -0,0 +1,65 @@
+"""Smoke tests for the benchmark suite, run against the fake model."""
+import httpx
+
+from app.main import app
+from app.services.background_remover import parse_options
+from benchmarks.bench_pipeline import bench_image
+from benchmarks.compare import compare
+from benchmarks.corpus import CorpusImage, encode, synthetic_image
+from benchmarks.load_test import run_level
+from benchmarks.report import percentile
+
+
+def test_percentile():
+    """Test percentiles interpolate between samples."""
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+    assert percentile([5], 99) == 5
+
+
+def test_bench_image_reports_stages(fake_session, tmp_path):
+    """Test the pipeline benchmark collects per-stage and end-to-end times."""
+    path = tmp_path / "tiny.jpeg"
+    path.write_bytes(encode(synthetic_image(160, 120), "jpeg"))
+    image = CorpusImage("tiny", "jpeg", 160, 120, str(path))
+    
+    result = bench_image(image, parse_options(quality="fast"), repeats=2)
+    
+    assert set(result["stages"]) == {"decode", "inference", "matting", "encode"}
+    assert result["end_to_end"]["p50_ms"] > 0
+    assert result["output_bytes"] > 0
+
+
+async def test_load_driver_against_asgi_app(fake_session, reset_rate_limiter, reset_result_cache, subject_image):
+    """Test the load driver reports latency percentiles and throughput."""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        result = await run_level(client, subject_image, "bench.png", "image/png", {"quality": "fast"}, 2, 4)
+        
+    assert result["statuses"] == {"200": 4}
+    assert result["requests_per_second"] > 0
+    assert result["p50_ms"] <= result["p99_ms"]
+
+
+def test_compare_flags_regressions():
+    """Test compare() flags metrics slower than the threshold."""
+    def report(p50):
+        return {"benchmark": "load", "results": [{"concurrency": 4, "p50_ms": p50, "p99_ms": 100}]}
+        
+    rows, regressed = compare(report(50), report(60), threshold=10)
+    assert regressed is True
+    assert ("c=4", "p50", 50, 60, 20.0) in rows
+    
+    _, regressed = compare(report(50), report(52), threshold=10)
+    assert regressed is False
+
+
+def test_instrumentation_benchmark():
+    """Test the metrics benchmark reports per-request costs for both styles."""
+    from benchmarks.bench_metrics import bench_instrumentation
+    
+    result = bench_instrumentation(iterations=50)
+    
+    assert result["labels_us_per_request"] > 0
+    assert result["bound_us_per_request"] > 0
+    assert result["exposition_bytes"] > 0
@@ -0,0 +1,111 @@
+"""Tests for bulk processing from the command line."""
+import os
+
+import pytest
+from PIL import Image
+
+from app.cli import BulkItem, collect_items, is_up_to_date, main, read_manifest
+from app.services.background_remover import parse_options
+
+
+@pytest.fixture
+def image_tree(tmp_path, subject_image):
+    """A directory of images in nested folders, plus a file that isn't an image."""
+    root = tmp_path / "photos"
+    (root / "shoes").mkdir(parents=True)
+    (root / "a.png").write_bytes(subject_image)
+    (root / "shoes" / "b.png").write_bytes(subject_image)
+    (root / "notes.txt").write_text("not an image")
+    return root
+
+
+def test_collect_items_from_directory_glob_and_manifest(tmp_path, image_tree):
+    """Test every kind of source maps to outputs under the same relative paths."""
+    options = parse_options(output_format="webp")
+    out = str(tmp_path / "out")
+    
+    from_dir = collect_items([str(image_tree)], out, options)
+    assert sorted(os.path.relpath(item.output, out) for item in from_dir) == ["a.webp", os.path.join("shoes", "b.webp")]
+    
+    from_glob = collect_items([str(image_tree / "**" / "*.png")], out, options)
+    assert {item.output for item in from_glob} == {item.output for item in from_dir}
+    
+    manifest = image_tree / "list.txt"
+    manifest.write_text("# catalogue\nshoes/b.png\n\n")
+    assert [item.source for item in collect_items(read_manifest(str(manifest)), out, options)] == [
+        str(image_tree / "shoes" / "b.png")
+    ]
+    
+    # Overlapping sources process each image once
+    assert len(collect_items([str(image_tree), str(image_tree / "a.png")], out, options)) == 2
+
+
+def test_colliding_outputs_are_disambiguated_or_refused(tmp_path, subject_image):
+    """Test inputs that would share an output keep their extension, and true clashes are errors."""
+    options = parse_options(output_format="png-fast")
+    out = str(tmp_path / "out")
+    for directory in ("x", "y"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "a.png").write_bytes(subject_image)
+    (tmp_path / "x" / "a.jpg").write_bytes(subject_image)
+    (tmp_path / "x" / "b.jpg").write_bytes(subject_image)
+    
+    items = collect_items([str(tmp_path / "x")], out, options)
+    assert sorted(os.path.relpath(item.output, out) for item in items) == ["a.jpg.png", "a.png.png", "b.png"]
+    
+    with pytest.raises(ValueError, match="both be written"):
+        collect_items([str(tmp_path / "x" / "a.png"), str(tmp_path / "y" / "a.png")], out, options)
+    with pytest.raises(ValueError, match="overwritten"):
+        collect_items([str(tmp_path / "y")], str(tmp_path / "y"), options)
+
+
+def test_output_directory_inside_source_is_not_read(image_tree):
+    """Test results from an earlier run aren't picked up as inputs."""
+    options = parse_options(output_format="png-fast")
+    out = image_tree / "cutouts"
+    (out / "shoes").mkdir(parents=True)
+    (out / "a.png").write_bytes(b"result")
+    (out / "shoes" / "b.png").write_bytes(b"result")
+    
+    for source in (str(image_tree), str(image_tree / "**" / "*.png")):
+        items = collect_items([source], str(out), options)
+        assert sorted(os.path.relpath(item.source, image_tree) for item in items) == [
+            "a.png", os.path.join("shoes", "b.png")
+        ]
+
+
+def test_is_up_to_date(tmp_path):
+    """Test an output counts as done only if it's at least as new as its input."""
+    source, output = tmp_path / "in.png", tmp_path / "out.png"
+    source.write_bytes(b"input")
+    item = BulkItem(str(source), str(output))
+    assert not is_up_to_date(item)
+    
+    output.write_bytes(b"output")
+    os.utime(source, (1000, 1000))
+    assert is_up_to_date(item)
+    os.utime(source, (os.path.getmtime(output) + 10,) * 2)
+    assert not is_up_to_date(item)
+
+
+def test_main_processes_and_resumes(tmp_path, image_tree, fake_session, capsys):
+    """Test a run writes every result and a second run skips them."""
+    out = tmp_path / "out"
+    args = [str(image_tree), "-o", str(out), "--processes", "1", "--quality", "fast", "--output-format", "png-fast"]
+    
+    assert main(args) == 0
+    result = out / "shoes" / "b.png"
+    assert Image.open(result).mode == "RGBA"
+    assert not list(out.rglob("*.part"))
+    assert "Processed 2 images, 0 failed, 0 up to date" in capsys.readouterr().out
+    
+    assert main(args) == 0
+    assert "Processed 0 images, 0 failed, 2 up to date" in capsys.readouterr().out
+
+
+def test_main_rejects_invalid_options(tmp_path, image_tree):
+    """Test pipeline parameters are validated like the API's."""
+    with pytest.raises(SystemExit):
+        main([str(image_tree), "-o", str(tmp_path / "out"), "--quality", "perfect"])
+    with pytest.raises(SystemExit):
+        main([str(image_tree / "a.png"), str(image_tree / "shoes" / "b.png"), "-o", str(image_tree / "shoes")])
@@ -0,0 +1,122 @@
+"""Tests for the credit ledger and paid usage."""
+import asyncio
+import io
+
+import pytest
+
+from app.services.credits import CreditLedger, charge_use, refund_use
+
+
+async def test_consume_never_overspends(ledger):
+    """Test concurrent consumes take exactly the credits available."""
+    assert await ledger.grant("paid_device", "order_1", "starter_50", credits=3)
+    
+    results = await asyncio.gather(*(ledger.consume("paid_device") for _ in range(8)))
+    
+    assert sum(result is not None for result in results) == 3
+    assert (await ledger.balance("paid_device", fresh=True)).credits == 0
+    assert await ledger.consume("paid_device") is None
+
+
+async def test_unlimited_plan_is_not_decremented(ledger):
+    """Test an active unlimited plan allows use without spending credits."""
+    await ledger.grant("unlimited_device", "order_u", "unlimited_monthly", unlimited_days=30)
+    
+    balance = await ledger.consume("unlimited_device")
+    assert balance is not None and balance.unlimited
+    assert balance.credits == 0
+    
+    # Renewing extends the plan instead of restarting it
+    await ledger.grant("unlimited_device", "order_u2", "unlimited_monthly", unlimited_days=30)
+    renewed = await ledger.balance("unlimited_device", fresh=True)
+    assert renewed.unlimited_until >= balance.unlimited_until + 30 * 86400
+
+
+async def test_grant_is_idempotent_per_order(ledger):
+    """Test a redelivered order is only credited once."""
+    assert await ledger.grant("dup_device", "order_2", "pro_200", credits=200)
+    assert not await ledger.grant("dup_device", "order_2", "pro_200", credits=200)
+    assert await ledger.grant("dup_device", "order_3", "starter_50", credits=50)
+    assert (await ledger.balance("dup_device")).credits == 250
+
+
+async def test_balance_is_cached(ledger):
+    """Test balances are read through the cache, and own writes update it."""
+    from app.services.credits import credit_accounts
+    
+    await ledger.grant("cached_device", "order_4", "starter_50", credits=50)
+    assert (await ledger.balance("cached_device")).credits == 50
+    
+    # Changed behind the ledger's back: the cached value stands until refreshed
+    async with ledger.engine.begin() as conn:
+        await conn.execute(credit_accounts.update().values(credits=7))
+    assert (await ledger.balance("cached_device")).credits == 50
+    assert (await ledger.balance("cached_device", fresh=True)).credits == 7
+    
+    # consume() returns the new balance, which is cached
+    await ledger.consume("cached_device")
+    assert (await ledger.balance("cached_device")).credits == 6
+
+
+async def test_paid_credits_are_used_before_free_tier(ledger, reset_rate_limiter):
+    """Test charge_use spends paid credits first, then free uses, and refunds either."""
+    from app.services.rate_limiter import check_rate_limit
+    
+    await ledger.grant("mixed_device", "order_5", "starter_50", credits=1)
+    
+    charge = await charge_use("mixed_device")
+    assert charge.allowed and charge.paid and charge.credits.credits == 0
+    assert (await check_rate_limit("mixed_device"))[1] == 5
+    
+    refunded = await refund_use("mixed_device", charge)
+    assert refunded.credits.credits == 1
+    
+    await charge_use("mixed_device")
+    charge = await charge_use("mixed_device")
+    assert charge.allowed and not charge.paid
+    assert charge.free_remaining == 4
+
+
+async def test_database_outage_falls_back_to_free_tier(tmp_path, reset_rate_limiter):
+    """Test an unreachable database means free uses only, not errors."""
+    broken = CreditLedger(f"sqlite+aiosqlite:///{tmp_path}/missing/credits.db", retry_after=60)
+    try:
+        assert not await broken.has_credits("outage_device", fresh=True)
+        charge = await charge_use("outage_device", broken)
+        assert charge.allowed and not charge.paid
+    finally:
+        await broken.close()
+
+
+def test_remove_bg_spends_credits_after_free_limit(client, ledger, fake_session, reset_rate_limiter, reset_result_cache, subject_image):
+    """Test remove-bg uses paid credits first and keeps working once free uses are gone."""
+    from app.services import rate_limiter
+    
+    asyncio.run(ledger.grant("paying_user", "order_6", "starter_50", credits=2))
+    for _ in range(5):
+        asyncio.run(rate_limiter.try_consume("paying_user"))
+        
+    def post():
+        return client.post(
+            "/api/v1/remove-bg",
+            headers={"X-Device-ID": "paying_user"},
+            files={"file": ("test.png", io.BytesIO(subject_image), "image/png")},
+            data={"output_format": "png-fast"},
+        )
+        
+    first = post()
+    assert first.status_code == 200
+    assert first.headers["X-Credits-Remaining"] == "1"
+    assert "X-Remaining-Uses" not in first.headers
+    assert post().headers["X-Credits-Remaining"] == "0"
+    assert post().status_code == 429
+
+
+def test_paid_jobs_are_queued_first(ledger):
+    """Test devices with credits get paid job priority."""
+    from app.api.v1.jobs import _job_priority
+    from app.services.jobs import PRIORITY_FREE, PRIORITY_PAID
+    
+    asyncio.run(ledger.grant("job_buyer", "order_7", "pro_200", credits=200))
+    assert _job_priority(asyncio.run(ledger.balance("job_buyer"))) == PRIORITY_PAID
+    assert _job_priority(asyncio.run(ledger.balance("nobody"))) == PRIORITY_FREE
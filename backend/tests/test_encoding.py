@@ -0,0 +1,70 @@
+"""Tests for output encoding."""
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.services.encoding import OUTPUT_FORMATS, encode_output
+
+
+@pytest.fixture
+def cutout():
+    """An RGBA cutout with a soft-edged subject."""
+    image = Image.new("RGBA", (200, 150), (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((50, 25, 150, 125), fill=(200, 40, 40, 255))
+    return image
+
+
+@pytest.mark.parametrize("output_format", list(OUTPUT_FORMATS))
+def test_encode_output_formats(cutout, output_format):
+    """Test every output format decodes back to the expected mode."""
+    data = encode_output(cutout, output_format)
+    
+    decoded = Image.open(io.BytesIO(data))
+    assert decoded.size == cutout.size
+    assert decoded.format == OUTPUT_FORMATS[output_format].extension.upper()
+    if output_format == "mask":
+        assert decoded.mode == "L"
+        assert decoded.getpixel((100, 75)) == 255
+        assert decoded.getpixel((0, 0)) == 0
+    else:
+        assert decoded.mode == "RGBA"
+        assert decoded.getpixel((0, 0))[3] == 0
+
+
+def test_lossless_formats_preserve_alpha(cutout):
+    """Test lossless formats round-trip the alpha channel exactly."""
+    for output_format in ("png-fast", "png-optimized", "webp-lossless"):
+        decoded = Image.open(io.BytesIO(encode_output(cutout, output_format)))
+        assert decoded.getchannel("A").tobytes() == cutout.getchannel("A").tobytes()
+
+
+def test_unknown_format(cutout):
+    """Test unknown formats are rejected."""
+    with pytest.raises(ValueError):
+        encode_output(cutout, "bmp")
+
+
+def test_remove_bg_output_format(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test the output_format form field selects the encoding."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"output_format": "webp", "quality": "fast"},
+        files={"file": ("photo.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "bggone_photo.webp" in response.headers["content-disposition"]
+    assert Image.open(io.BytesIO(response.content)).format == "WEBP"
+    
+    content = client.get("/metrics").text
+    assert 'bg_output_bytes_count{format="webp"' in content
+    
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"output_format": "gif"},
+        files={"file": ("photo.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 400
@@ -1,5 +1,10 @@
 """Tests for health check endpoints."""
+import time
+
 import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
 
 
 def test_health_check(client):
@@ -11,12 +16,51 @@ def test_health_check(client):
     assert data["service"] == "BgGone"
 
 
-def test_readiness_check(client):
-    """Test readiness endpoint returns 200."""
+def test_readiness_check(fake_session):
+    """Test readiness turns 200 once the models are loaded and warmed up."""
+    with TestClient(app) as client:
+        deadline = time.time() + 10
+        response = client.get("/ready")
+        while response.status_code == 503 and time.time() < deadline:
+            time.sleep(0.02)
+            response = client.get("/ready")
+            
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["models"] == {"u2net": "ready"}
+        assert data["startup_seconds"] > 0
+        # The warm-up ran an inference before any request
+        assert fake_session.inner_session.batch_sizes
+
+
+def test_readiness_before_models_load(client, monkeypatch):
+    """Test readiness is 503 while models are loading, but health is 200."""
+    from app.services.model_warmup import model_warmup
+    
+    monkeypatch.setattr(model_warmup, "state", "loading")
+    assert client.get("/health").status_code == 200
     response = client.get("/ready")
-    assert response.status_code == 200
-    data = response.json()
-    assert data["status"] == "ready"
+    assert response.status_code == 503
+    assert response.json()["status"] == "loading"
+
+
+async def test_warmup_failure_is_reported(fake_session):
+    """Test a model that fails to load marks readiness as failed."""
+    from app.services.model_warmup import ModelWarmup
+    from app.services.model_registry import model_registry
+    
+    def broken(config):
+        raise RuntimeError("model file missing")
+        
+    model_registry.unload_all()
+    model_registry.session_factory = broken
+    warmup = ModelWarmup(model_registry)
+    await warmup.start(["u2net"])
+    
+    assert warmup.state == "failed"
+    assert warmup.models == {"u2net": "failed"}
+    assert "model file missing" in warmup.error
 
 
 def test_root_endpoint(client):
@@ -0,0 +1,129 @@
+"""Tests for large-image decoding and alpha upsampling."""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app.config import settings
+from app.services.background_remover import RemovalOptions, remove_background_sync
+from app.services.image_io import (
+    ImageTooLarge,
+    composite_alpha,
+    decode_working_copy,
+    guided_upsample_alpha,
+    open_image,
+)
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_open_image_rejects_too_many_pixels():
+    """Test the pixel limit is enforced from the header alone."""
+    data = _encode(Image.new("RGB", (2000, 1000)), "PNG")
+    
+    assert open_image(data, max_megapixels=2).size == (2000, 1000)
+    with pytest.raises(ImageTooLarge):
+        open_image(data, max_megapixels=1.5)
+
+
+def test_working_copy_uses_jpeg_draft():
+    """Test JPEGs are decoded at reduced scale and bounded to max_side."""
+    data = _encode(Image.new("RGB", (1600, 1200), (200, 10, 10)), "JPEG")
+    image = open_image(data, max_megapixels=10)
+    
+    working = decode_working_copy(image, max_side=300)
+    
+    assert max(working.size) == 300
+    assert working.size == (300, 225)
+
+
+def test_working_copy_keeps_small_images():
+    """Test images within the bound are decoded unchanged."""
+    data = _encode(Image.new("RGB", (120, 80)), "PNG")
+    working = decode_working_copy(open_image(data, max_megapixels=10), max_side=300)
+    assert working.size == (120, 80)
+
+
+def test_working_copy_is_rgb():
+    """Test palette and RGBA inputs are converted once, up front."""
+    for image in (Image.new("P", (60, 40)), Image.new("RGBA", (60, 40), (10, 20, 30, 128))):
+        working = decode_working_copy(open_image(_encode(image, "PNG"), max_megapixels=10), max_side=300)
+        assert working.mode == "RGB"
+
+
+def test_composite_alpha_reuses_pixels():
+    """Test the cutout is built from the decoded pixels, clearing transparent ones."""
+    image = Image.new("RGB", (4, 1), (200, 100, 50))
+    alpha = Image.frombytes("L", (4, 1), bytes([0, 1, 128, 255]))
+    
+    cutout = composite_alpha(image, alpha)
+    
+    assert cutout is image
+    assert list(cutout.getdata()) == [
+        (0, 0, 0, 0),
+        (200, 100, 50, 1),
+        (200, 100, 50, 128),
+        (200, 100, 50, 255),
+    ]
+
+
+def test_guided_upsample_follows_guide_edges():
+    """Test the upsampled alpha snaps to edges in the full-resolution guide."""
+    guide = Image.new("RGB", (400, 400), (0, 0, 0))
+    ImageDraw.Draw(guide).rectangle((100, 100, 299, 299), fill=(255, 255, 255))
+    # A blurry low-res alpha of the same square
+    alpha_small = guide.convert("L").resize((50, 50), Image.Resampling.BILINEAR)
+    
+    alpha = guided_upsample_alpha(alpha_small, guide, radius=2, eps=1e-3, band_rows=64)
+    
+    assert alpha.size == guide.size
+    values = np.asarray(alpha)
+    assert values[200, 200] > 240
+    assert values[10, 10] < 15
+    # Sharper than a plain bilinear resize across the edge
+    plain = np.asarray(alpha_small.resize(guide.size, Image.Resampling.BILINEAR))
+    edge = slice(94, 106)
+    assert np.abs(values[200, edge].astype(int) - np.asarray(guide.convert("L"))[200, edge]).mean() < \
+        np.abs(plain[200, edge].astype(int) - np.asarray(guide.convert("L"))[200, edge]).mean()
+
+
+def test_large_image_pipeline(fake_session, monkeypatch):
+    """Test large images are processed at working size and returned at full size."""
+    monkeypatch.setattr(settings, "WORKING_MAX_SIDE", 100)
+    image = Image.new("RGB", (480, 320), (10, 10, 10))
+    ImageDraw.Draw(image).ellipse((120, 60, 360, 260), fill=(250, 250, 250))
+    
+    result = remove_background_sync(_encode(image, "JPEG"), RemovalOptions(quality="balanced"))
+    
+    output = Image.open(io.BytesIO(result))
+    assert output.size == (480, 320)
+    assert output.mode == "RGBA"
+    assert output.getpixel((240, 160))[3] > 200
+    assert output.getpixel((5, 5))[3] < 50
+
+
+def test_remove_bg_rejects_too_many_pixels(client, sample_image, reset_rate_limiter, monkeypatch):
+    """Test oversized images are rejected before processing."""
+    monkeypatch.setattr(settings, "MAX_MEGAPIXELS", 0.001)
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        files={"file": ("test.png", io.BytesIO(sample_image), "image/png")}
+    )
+    assert response.status_code == 400
+    assert "megapixels" in response.json()["detail"]
+
+
+def test_remove_bg_rejects_invalid_image(client, reset_rate_limiter):
+    """Test content that isn't an image is a client error."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        files={"file": ("test.png", io.BytesIO(b"not really a png"), "image/png")}
+    )
+    assert response.status_code == 400
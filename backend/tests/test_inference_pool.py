@@ -0,0 +1,83 @@
+"""Tests for the inference worker pool."""
+import asyncio
+import io
+import threading
+
+import pytest
+
+from app.services.inference_pool import InferencePool, InferenceQueueFull
+
+
+async def test_run_returns_result():
+    """Test work runs on a worker thread and returns its result."""
+    pool = InferencePool(max_workers=1, max_queue=0)
+    try:
+        thread_name = await pool.run(lambda: threading.current_thread().name)
+        assert thread_name.startswith("inference")
+        assert await pool.run(sum, [1, 2, 3]) == 6
+    finally:
+        pool.shutdown()
+
+
+async def test_rejects_when_full():
+    """Test work beyond workers + queue is rejected immediately."""
+    pool = InferencePool(max_workers=1, max_queue=1, retry_after=7)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait))
+        waiting = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        assert pool.queued == 1
+
+        with pytest.raises(InferenceQueueFull) as exc_info:
+            await pool.run(release.wait)
+        assert exc_info.value.retry_after == 7
+
+        release.set()
+        assert await running is True
+        assert await waiting is True
+        assert pool.queued == 0
+
+        # Capacity is released once work finishes
+        assert await pool.run(lambda: "ok") == "ok"
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+async def test_errors_release_capacity():
+    """Test a failing job does not leak an admission slot."""
+    pool = InferencePool(max_workers=1, max_queue=0)
+
+    def boom():
+        raise ValueError("bad image")
+
+    try:
+        with pytest.raises(ValueError):
+            await pool.run(boom)
+        assert await pool.run(lambda: 1) == 1
+    finally:
+        pool.shutdown()
+
+
+def test_remove_bg_returns_503_when_busy(client, sample_image, reset_rate_limiter, monkeypatch):
+    """Test overload returns 503 with Retry-After instead of queueing."""
+    from app.api.v1 import remove_bg
+
+    async def busy(_contents, *args, **kwargs):
+        raise InferenceQueueFull(3)
+
+    monkeypatch.setattr(remove_bg, "remove_background_cached", busy)
+
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "busy_device"},
+        files={"file": ("test.png", io.BytesIO(sample_image), "image/png")}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.json()["detail"]["error"] == "server_busy"
+
+    # Rejected requests are not charged
+    response = client.get("/api/v1/rate-limit", headers={"X-Device-ID": "busy_device"})
+    assert response.json()["remaining"] == 5
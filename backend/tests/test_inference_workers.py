@@ -0,0 +1,142 @@
+"""Tests for multi-process serving with shared inference workers."""
+import io
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from dataclasses import asdict
+
+import pytest
+from PIL import Image
+
+from app.services import inference_workers
+from app.services.background_remover import parse_options
+from app.services.cancellation import DeadlineExceeded
+from app.services.inference_workers import (
+    CRASHED_MESSAGE,
+    InferenceClient,
+    InferenceSupervisor,
+    InferenceWorkerError,
+    inference_worker_main,
+    read_shared,
+    write_shared,
+)
+
+
+def test_shared_memory_round_trip():
+    """Test buffers pass through shared memory and are unlinked after reading."""
+    name = write_shared(b"image bytes")
+    assert read_shared(name, 11, unlink=True) == b"image bytes"
+    with pytest.raises(FileNotFoundError):
+        read_shared(name, 11)
+
+
+def test_worker_processes_tasks_from_client(fake_session, subject_image):
+    """Test an HTTP worker's client gets results from an inference worker."""
+    task_queue, result_queue = queue.Queue(), queue.Queue()
+    done, ready = [0], [0]
+    worker = threading.Thread(
+        target=inference_worker_main,
+        args=(0, task_queue, [result_queue], done, ready, ["u2net"]),
+        daemon=True,
+    )
+    worker.start()
+    client = InferenceClient(0, task_queue, result_queue, ready, timeout=30)
+    try:
+        result = client.process(subject_image, asdict(parse_options(quality="fast", output_format="png-fast")))
+        assert client.ready_workers == 1
+        assert Image.open(io.BytesIO(result)).mode == "RGBA"
+        assert done == [1]
+        
+        # Failures come back as errors rather than hanging the caller
+        with pytest.raises(InferenceWorkerError, match="UnidentifiedImageError|ImageTooLarge|Error"):
+            client.process(b"not an image", asdict(parse_options()))
+            
+        # Tasks past their deadline are given up on rather than processed
+        with pytest.raises(DeadlineExceeded):
+            client.process(subject_image, asdict(parse_options()), time.monotonic() - 1)
+    finally:
+        task_queue.put(None)
+        worker.join(10)
+    assert not worker.is_alive()
+
+
+def test_worker_exits_after_max_tasks(fake_session, subject_image):
+    """Test a worker stops after max_tasks so the supervisor can recycle it."""
+    task_queue, result_queue = queue.Queue(), queue.Queue()
+    worker = threading.Thread(
+        target=inference_worker_main,
+        args=(0, task_queue, [result_queue], [0], [0], [], 0, 1),
+        daemon=True,
+    )
+    worker.start()
+    client = InferenceClient(0, task_queue, result_queue, [1], timeout=30)
+    client.process(subject_image, asdict(parse_options(quality="fast")))
+    worker.join(10)
+    assert not worker.is_alive()
+
+
+def test_client_times_out_when_no_worker_answers():
+    """Test a lost task fails after the timeout instead of blocking forever."""
+    client = InferenceClient(0, queue.Queue(), queue.Queue(), [0], timeout=0.1)
+    with pytest.raises(InferenceWorkerError, match="timed out"):
+        client.process(b"data", {})
+
+
+def test_remove_background_uses_inference_workers(monkeypatch, subject_image):
+    """Test removals go to the inference workers when connected."""
+    from app.services.background_remover import remove_background
+    
+    class StubClient:
+        def process(self, image_bytes, options, deadline=None):
+            return b"from worker " + options["model"].encode()
+            
+    monkeypatch.setattr(inference_workers, "client", StubClient())
+    
+    async def run():
+        return await remove_background(subject_image, parse_options(model="u2netp"))
+        
+    import asyncio
+    assert asyncio.run(run()) == b"from worker u2netp"
+
+
+def test_supervisor_restarts_crashed_worker():
+    """Test a crashed worker is replaced and its in-flight task is failed."""
+    ctx = multiprocessing.get_context("spawn")
+    task_queue, result_queue = ctx.Queue(), ctx.Queue()
+    supervisor = InferenceSupervisor(ctx, 1, task_queue, [result_queue], preload=[])
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + 60
+        while not supervisor.ready[0] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert supervisor.ready[0] == 1
+        
+        first = supervisor.workers[0]
+        assert supervisor.check() == []
+        
+        # Kill the worker while it is holding task 42 from HTTP worker 0
+        # (the shared-memory name doesn't exist, but it dies before reading it)
+        os.kill(first.pid, signal.SIGSTOP)
+        task_queue.put((42, 0, "bggone-missing", 1, {}, None))
+        while supervisor.assigned[0] == 0:
+            time.sleep(0.01)
+        first.kill()
+        first.join(5)
+        assert supervisor.check() == [(0, "crash")]
+        assert result_queue.get(timeout=5) == (42, None, 0, CRASHED_MESSAGE)
+        
+        # The replacement reads a fresh inbox and handles new work
+        second = supervisor.workers[0]
+        assert second.pid != first.pid
+        while not supervisor.ready[0] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        task_queue.put((43, 0, "bggone-missing", 1, {}, None))
+        task_id, name, _, error = result_queue.get(timeout=30)
+        assert (task_id, name) == (43, None)
+        assert "FileNotFoundError" in error
+    finally:
+        supervisor.stop()
+    assert not supervisor.workers[0].is_alive()
@@ -0,0 +1,350 @@
+"""Tests for the batch job API."""
+import asyncio
+import io
+import time
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.config import settings
+from app.main import app
+from app.services import jobs
+from app.services.background_remover import DEFAULT_OPTIONS
+from app.services.cancellation import DeadlineExceeded
+from app.services.inference_pool import InferenceQueueFull
+from app.services.jobs import ITEM_DONE, JobItem, Job, JobManager, MemoryJobStore, SQLiteJobStore
+from app.services.rate_limiter import check_rate_limit
+
+
+@pytest.fixture
+def jobs_client(fake_session, reset_rate_limiter, reset_result_cache):
+    """Test client with lifespan, so the job workers run."""
+    with TestClient(app) as client:
+        yield client
+
+
+def _wait_for_job(client, job_id, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_create_job_and_download_results(jobs_client, subject_image):
+    """Test a multi-image job runs in the background and streams a zip."""
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "job_device"},
+        files=[
+            ("files", ("one.png", io.BytesIO(subject_image), "image/png")),
+            ("files", ("two.png", io.BytesIO(subject_image), "image/png")),
+        ],
+    )
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.json()["total"] == 2
+    
+    job = _wait_for_job(jobs_client, job_id)
+    assert job["status"] == "done"
+    assert job["completed"] == 2
+    
+    response = jobs_client.get(f"/api/v1/jobs/{job_id}/results")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["001_bggone_one.png", "002_bggone_two.png"]
+    assert Image.open(io.BytesIO(archive.read("001_bggone_one.png"))).mode == "RGBA"
+    
+    # Each image is charged
+    response = jobs_client.get("/api/v1/rate-limit", headers={"X-Device-ID": "job_device"})
+    assert response.json()["remaining"] == 3
+
+
+def test_zip_upload(jobs_client, subject_image):
+    """Test images inside a zip archive become job items."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("photos/a.png", subject_image)
+        archive.writestr("photos/notes.txt", "not an image")
+        archive.writestr("__MACOSX/photos/._a.png", "resource fork")
+        
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "zip_device"},
+        files=[("files", ("batch.zip", io.BytesIO(buffer.getvalue()), "application/zip"))],
+        data={"output_format": "webp"},
+    )
+    assert response.status_code == 202
+    job = _wait_for_job(jobs_client, response.json()["id"])
+    assert [item["filename"] for item in job["items"]] == ["photos/a.png"]
+    
+    response = jobs_client.get(f"/api/v1/jobs/{job['id']}/results")
+    assert zipfile.ZipFile(io.BytesIO(response.content)).namelist() == ["001_bggone_a.webp"]
+
+
+def test_job_over_daily_limit_is_rejected(jobs_client, subject_image):
+    """Test a batch larger than the remaining uses returns 429."""
+    files = [("files", (f"{i}.png", io.BytesIO(subject_image), "image/png")) for i in range(6)]
+    response = jobs_client.post("/api/v1/jobs", headers={"X-Device-ID": "greedy"}, files=files)
+    assert response.status_code == 429
+
+
+def test_job_rejects_invalid_input(jobs_client):
+    """Test bad files and options are rejected before a job is created."""
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "bad_device"},
+        files=[("files", ("fake.png", io.BytesIO(b"not an image"), "image/png"))],
+    )
+    assert response.status_code == 400
+    
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "bad_device"},
+        files=[("files", ("doc.pdf", io.BytesIO(b"%PDF"), "application/pdf"))],
+    )
+    assert response.status_code == 400
+    
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "bad_device"},
+        files=[("files", ("a.png", io.BytesIO(b""), "image/png"))],
+        data={"quality": "ultra"},
+    )
+    assert response.status_code == 400
+
+
+def test_unknown_job_returns_404(client):
+    """Test unknown job ids return 404."""
+    assert client.get("/api/v1/jobs/missing").status_code == 404
+    assert client.get("/api/v1/jobs/missing/results").status_code == 404
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    """Test the SQLite store persists jobs, progress and results."""
+    path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(path)
+    job = Job(
+        id="job1",
+        device_id="device",
+        priority=0,
+        options=DEFAULT_OPTIONS,
+        items=[JobItem(index=0, filename="a.png"), JobItem(index=1, filename="b.png")],
+    )
+    store.create(job, [b"input-a", b"input-b"])
+    
+    store.save_result("job1", 0, b"result-a")
+    store.update_item("job1", JobItem(index=0, filename="a.png", status=ITEM_DONE))
+    
+    # A new store on the same file sees the same state
+    reopened = SQLiteJobStore(path)
+    loaded = reopened.get("job1")
+    assert loaded.options == DEFAULT_OPTIONS
+    assert [item.status for item in loaded.items] == ["done", "queued"]
+    assert reopened.load_result("job1", 0) == b"result-a"
+    assert reopened.load_input("job1", 1) == b"input-b"
+    assert [j.id for j in reopened.unfinished()] == ["job1"]
+    
+    assert reopened.delete_before(time.time() + 1) == 1
+    assert reopened.get("job1") is None
+
+
+def _job(job_id="job1", count=2):
+    return Job(
+        id=job_id,
+        device_id="device",
+        priority=0,
+        options=DEFAULT_OPTIONS,
+        items=[JobItem(index=i, filename=f"{i}.png") for i in range(count)],
+    )
+
+
+def test_claims_are_exclusive_across_processes(tmp_path):
+    """Test only one store sharing the database can claim an item."""
+    path = str(tmp_path / "jobs.db")
+    worker_a, worker_b = SQLiteJobStore(path), SQLiteJobStore(path)
+    worker_a.create(_job(), [b"a", b"b"])
+    
+    assert worker_a.claim("job1", 0)
+    assert not worker_b.claim("job1", 0)
+    assert not worker_a.claim("job1", 0)
+    assert worker_b.claim("job1", 1)
+    assert not worker_a.claim("missing", 0)
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_stale_claims_are_requeued_once(kind, tmp_path):
+    """Test items left running by a dead worker go back to the queue with their charge."""
+    store = MemoryJobStore() if kind == "memory" else SQLiteJobStore(str(tmp_path / "jobs.db"))
+    store.create(_job(), [b"a", b"b"])
+    store.claim("job1", 0)
+    store.record_charge("job1", 0, "credit")
+    store.claim("job1", 1)
+    
+    assert store.requeue_stale(time.time() - 60) == []
+    assert sorted(store.requeue_stale(time.time() + 1)) == [("job1", 0, "credit"), ("job1", 1, None)]
+    assert [item.status for item in store.get("job1").items] == ["queued", "queued"]
+    assert store.requeue_stale(time.time() + 1) == []
+
+
+async def test_item_is_processed_once_by_workers_sharing_a_store(tmp_path, monkeypatch, reset_rate_limiter):
+    """Test two managers on one database (e.g. two HTTP workers) run and charge each item once."""
+    calls = []
+    
+    async def fake_removal(data, options, **kwargs):
+        calls.append(data)
+        await asyncio.sleep(0.01)
+        return b"result-" + data, False
+        
+    monkeypatch.setattr(jobs, "remove_background_cached", fake_removal)
+    path = str(tmp_path / "jobs.db")
+    store_a, store_b = SQLiteJobStore(path), SQLiteJobStore(path)
+    store_a.create(_job(count=4), [b"0", b"1", b"2", b"3"])
+    managers = [JobManager(store_a, 2), JobManager(store_b, 2)]
+    try:
+        for manager in managers:
+            await manager.start()
+        for _ in range(200):
+            if (await managers[0].get("job1")).finished:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        for manager in managers:
+            await manager.stop()
+            
+    assert sorted(calls) == [b"0", b"1", b"2", b"3"]
+    assert (await managers[1].get("job1")).completed == 4
+    assert (await check_rate_limit("device"))[1] == settings.FREE_DAILY_LIMIT - 4
+
+
+async def test_running_items_are_not_requeued_on_start(monkeypatch):
+    """Test a restart leaves items another worker is running alone."""
+    store = MemoryJobStore()
+    store.create(_job(), [b"a", b"b"])
+    store.claim("job1", 0)
+    manager = JobManager(store, 1)
+    monkeypatch.setattr(manager, "_worker", lambda: asyncio.sleep(3600))
+    await manager.start()
+    try:
+        assert manager._queue.qsize() == 1
+        assert manager._queue.get_nowait()[2:] == ("job1", 1)
+    finally:
+        await manager.stop()
+
+
+async def test_busy_pool_releases_the_item_and_retries_later(monkeypatch, reset_rate_limiter):
+    """Test a full inference queue refunds the item and re-queues it instead of spinning."""
+    attempts = []
+    
+    async def busy_once(data, options, **kwargs):
+        attempts.append(data)
+        if len(attempts) == 1:
+            raise InferenceQueueFull(retry_after=0.05)
+        return b"result", False
+        
+    monkeypatch.setattr(jobs, "remove_background_cached", busy_once)
+    store = MemoryJobStore()
+    manager = JobManager(store, 1)
+    await manager.start()
+    try:
+        store.create(_job(count=1), [b"a"])
+        await manager._process("job1", 0)
+        assert store.get("job1").items[0].status == "queued"
+        assert (await check_rate_limit("device"))[1] == settings.FREE_DAILY_LIMIT
+        assert len(manager._retries) == 1
+        
+        for _ in range(100):
+            if store.get("job1").finished:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await manager.stop()
+    assert store.get("job1").items[0].status == "done"
+    assert len(attempts) == 2
+    assert (await check_rate_limit("device"))[1] == settings.FREE_DAILY_LIMIT - 1
+
+
+async def test_stop_cancels_pending_retries(monkeypatch, reset_rate_limiter):
+    """Test stopping while an item waits for the pool doesn't leave a retry behind."""
+    async def always_busy(data, options, **kwargs):
+        raise InferenceQueueFull(retry_after=60)
+        
+    monkeypatch.setattr(jobs, "remove_background_cached", always_busy)
+    store = MemoryJobStore()
+    manager = JobManager(store, 1)
+    await manager.start()
+    store.create(_job(count=1), [b"a"])
+    await manager._process("job1", 0)
+    await asyncio.wait_for(manager.stop(), timeout=5)
+    assert not manager._retries
+    assert store.get("job1").items[0].status == "queued"
+
+
+async def test_timed_out_item_records_why(monkeypatch, reset_rate_limiter):
+    """Test an item past JOB_ITEM_TIMEOUT_SECONDS fails with a readable reason and is refunded."""
+    async def too_slow(data, options, **kwargs):
+        raise DeadlineExceeded()
+        
+    monkeypatch.setattr(jobs, "remove_background_cached", too_slow)
+    monkeypatch.setattr(settings, "JOB_ITEM_TIMEOUT_SECONDS", 30)
+    store = MemoryJobStore()
+    manager = JobManager(store, 1)
+    await manager.start()
+    try:
+        store.create(_job(count=1), [b"a"])
+        await manager._process("job1", 0)
+    finally:
+        await manager.stop()
+        
+    item = store.get("job1").items[0]
+    assert (item.status, item.error) == ("failed", "Timed out after 30s")
+    assert (await check_rate_limit("device"))[1] == settings.FREE_DAILY_LIMIT
+
+
+async def test_reaper_deletes_expired_jobs(monkeypatch):
+    """Test jobs past JOB_TTL_HOURS are dropped while the manager keeps running."""
+    monkeypatch.setattr(jobs, "STALE_CLAIM_GRACE_SECONDS", 0.01)
+    store = MemoryJobStore()
+    manager = JobManager(store, 1)
+    await manager.start()
+    try:
+        old = _job("old", count=1)
+        old.created_at = time.time() - settings.JOB_TTL_HOURS * 3600 - 1
+        store.create(old, [b"a"])
+        store.create(_job("new", count=1), [b"b"])
+        for _ in range(100):
+            if store.get("old") is None:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await manager.stop()
+    assert store.get("old") is None
+    assert store.get("new") is not None
+
+
+def test_results_skip_items_whose_result_is_gone(jobs_client, subject_image, monkeypatch):
+    """Test a result deleted while the archive streams becomes an error entry instead of breaking the zip."""
+    from app.services.jobs import job_manager
+    
+    response = jobs_client.post(
+        "/api/v1/jobs",
+        headers={"X-Device-ID": "expiring"},
+        files=[("files", ("one.png", io.BytesIO(subject_image), "image/png"))],
+    )
+    job_id = response.json()["id"]
+    assert _wait_for_job(jobs_client, job_id)["status"] == "done"
+    
+    async def expired(job_id, index):
+        return None
+        
+    monkeypatch.setattr(job_manager, "load_result", expired)
+    response = jobs_client.get(f"/api/v1/jobs/{job_id}/results")
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.namelist() == ["errors/001_one.png.txt"]
+    assert archive.read("errors/001_one.png.txt") == b"Result is no longer available"
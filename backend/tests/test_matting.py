@@ -0,0 +1,93 @@
+"""Tests for mask refinement and quality modes."""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app.services.background_remover import RemovalOptions, remove_background_sync
+from app.services.matting import balanced_matting_cutout, build_trimap
+
+
+@pytest.fixture
+def soft_mask():
+    """A disc mask with a blurred edge."""
+    from PIL import ImageFilter
+    
+    mask = Image.new("L", (200, 150), 0)
+    ImageDraw.Draw(mask).ellipse((50, 25, 150, 125), fill=255)
+    return mask.filter(ImageFilter.GaussianBlur(4))
+
+
+def test_build_trimap(soft_mask):
+    """Test the trimap marks sure foreground, sure background and the band."""
+    trimap = build_trimap(np.asarray(soft_mask), 240, 10, 5)
+    
+    assert trimap[75, 100] == 255
+    assert trimap[0, 0] == 0
+    assert (trimap == 128).any()
+    assert set(np.unique(trimap)) <= {0, 128, 255}
+
+
+def test_balanced_matting_keeps_known_regions(soft_mask):
+    """Test balanced matting only changes alpha inside the unknown band."""
+    img = Image.effect_noise((200, 150), 40).convert("RGB")
+    pixels = np.asarray(img)
+    
+    cutout = balanced_matting_cutout(img, soft_mask, 240, 10, 5, max_side=64)
+    
+    assert cutout.mode == "RGBA"
+    assert cutout.size == (200, 150)
+    alpha = np.asarray(cutout)[:, :, 3]
+    trimap = build_trimap(np.asarray(soft_mask), 240, 10, 5)
+    assert (alpha[trimap == 255] == 255).all()
+    assert (alpha[trimap == 0] == 0).all()
+    # Original pixels are kept where visible; fully transparent ones are cleared
+    rgb = np.asarray(cutout)[:, :, :3]
+    assert np.array_equal(rgb[alpha > 0], pixels[alpha > 0])
+    assert not rgb[alpha == 0].any()
+
+
+@pytest.mark.parametrize("quality", ["fast", "balanced", "best"])
+def test_quality_modes(fake_session, subject_image, quality):
+    """Test every quality mode returns a transparent cutout."""
+    result = remove_background_sync(subject_image, RemovalOptions(quality=quality))
+    
+    output = Image.open(io.BytesIO(result))
+    assert output.mode == "RGBA"
+    assert output.getpixel((60, 40))[3] > 200
+    assert output.getpixel((2, 2))[3] < 50
+
+
+def test_stage_timings_exported(client, fake_session, subject_image):
+    """Test stage durations are exported per quality mode."""
+    remove_background_sync(subject_image, RemovalOptions(quality="fast"))
+    
+    content = client.get("/metrics").text
+    for stage in ("decode", "inference", "matting", "encode"):
+        assert f'stage="{stage}"' in content
+    assert 'quality="fast"' in content
+
+
+def test_remove_bg_invalid_quality(client, sample_image, reset_rate_limiter):
+    """Test unknown quality modes are rejected."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"quality": "ultra"},
+        files={"file": ("test.png", io.BytesIO(sample_image), "image/png")}
+    )
+    assert response.status_code == 400
+    assert "Invalid quality" in response.json()["detail"]
+
+
+def test_remove_bg_fast_quality(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test the quality form field reaches the pipeline."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"quality": "fast"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
@@ -31,3 +31,65 @@ def test_metrics_after_usage(client, sample_image, reset_rate_limiter):
     
     # Should have recorded the usage
     assert "free_trial_used_total" in content
+
+
+def test_bound_children_update_the_labelled_series():
+    """Test pre-bound children are the same series as .labels() would return."""
+    from app import metrics
+    
+    child = metrics.bg_removal_total.labels(tool=metrics.TOOL_NAME, status="success")
+    before = child._value.get()
+    metrics.removals_succeeded.inc()
+    assert child._value.get() == before + 1
+    assert metrics.stage_duration("decode", "fast", "u2net", "lt0.5mp") is metrics.stage_duration(
+        "decode", "fast", "u2net", "lt0.5mp"
+    )
+
+
+def test_exposition_is_cached():
+    """Test the metrics page is rebuilt at most once per max_age."""
+    from app import metrics
+    
+    exposition = metrics.Exposition(max_age=3600)
+    first = exposition.render()
+    metrics.removals_failed.inc()
+    assert exposition.render() is first
+    
+    exposition.max_age = 0
+    assert exposition.render() != first
+
+
+def test_multiprocess_metrics_are_aggregated(tmp_path):
+    """Test counters from several worker processes are summed in one exposition."""
+    import os
+    import subprocess
+    import sys
+    
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    bump = "from app import metrics; metrics.free_trials_used.inc(3)"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", bump], env=env, check=True, timeout=60)
+        
+    render = "from app import metrics; print(metrics.Exposition(0).render().decode())"
+    output = subprocess.run(
+        [sys.executable, "-c", render], env=env, check=True, timeout=60, capture_output=True, text=True
+    ).stdout
+    assert 'free_trial_used_total{tool="bggone"} 6.0' in output
+
+
+def test_metrics_settings_come_from_env_file(tmp_path):
+    """Test METRICS_CACHE_SECONDS and PROMETHEUS_MULTIPROC_DIR set in .env are honoured."""
+    import os
+    import subprocess
+    import sys
+    
+    metrics_dir = tmp_path / "metrics"
+    (tmp_path / ".env").write_text(f"METRICS_CACHE_SECONDS=42\nPROMETHEUS_MULTIPROC_DIR={metrics_dir}\n")
+    env = {key: value for key, value in os.environ.items() if key not in ("METRICS_CACHE_SECONDS", "PROMETHEUS_MULTIPROC_DIR")}
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = "from app import metrics; metrics.free_trials_used.inc(); print(metrics.exposition.max_age)"
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=tmp_path, env=env, check=True, timeout=60, capture_output=True, text=True
+    ).stdout
+    assert output.strip() == "42.0"
+    assert any(name.endswith(".db") for name in os.listdir(metrics_dir))
@@ -0,0 +1,123 @@
+"""Tests for the model registry."""
+import io
+
+import onnxruntime as ort
+import pytest
+
+from app.services.model_registry import (
+    ModelConfig,
+    ModelRegistry,
+    build_session_options,
+    load_model_configs,
+)
+
+
+class _Session:
+    def __init__(self, name):
+        self.model_name = name
+
+
+def _registry(budget_mb):
+    configs = {
+        "small": ModelConfig("small", memory_mb=100),
+        "medium": ModelConfig("medium", memory_mb=300),
+        "large": ModelConfig("large", memory_mb=600),
+    }
+    return ModelRegistry(configs, memory_budget_mb=budget_mb, session_factory=lambda c: _Session(c.name))
+
+
+def test_models_load_lazily_and_stay_warm():
+    """Test sessions are created once and reused."""
+    registry = _registry(budget_mb=1000)
+    assert registry.loaded == []
+    
+    with registry.session("small") as session:
+        pass
+    with registry.session("small") as again:
+        assert again is session
+    assert registry.loaded == ["small"]
+
+
+def test_lru_eviction_under_budget():
+    """Test the least recently used idle model is unloaded first."""
+    registry = _registry(budget_mb=900)
+    registry.preload(["small", "medium"])
+    registry.preload(["small"])  # "medium" is now least recently used
+    
+    registry.preload(["large"])
+    
+    assert registry.loaded == ["small", "large"]
+    assert registry.memory_mb == 700
+
+
+def test_models_in_use_are_not_evicted():
+    """Test a model serving a request survives eviction."""
+    registry = _registry(budget_mb=700)
+    with registry.acquire("medium"):
+        registry.preload(["large"])
+        assert "medium" in registry.loaded
+        
+    # Once idle it can be evicted again
+    registry.preload(["small"])
+    assert registry.loaded == ["large", "small"]
+    
+    # A session handed out directly is leased the same way
+    with registry.session("small") as session:
+        registry.preload(["medium"])
+        assert session.model_name == "small" and "small" in registry.loaded
+
+
+def test_unknown_model():
+    """Test unknown models are rejected."""
+    with pytest.raises(KeyError):
+        with _registry(budget_mb=1000).session("nope"):
+            pass
+
+
+def test_load_model_configs_overrides():
+    """Test per-model session options come from JSON overrides."""
+    configs = load_model_configs(
+        "u2net, u2netp",
+        '{"u2netp": {"intra_op_threads": 2, "execution_mode": "parallel"}}',
+    )
+    assert list(configs) == ["u2net", "u2netp"]
+    assert configs["u2netp"].intra_op_threads == 2
+    assert configs["u2netp"].execution_mode == "parallel"
+    assert configs["u2net"].intra_op_threads == 0
+    
+    with pytest.raises(ValueError):
+        load_model_configs("u2net", '{"u2net": {"graph_optimization": "max"}}')
+    with pytest.raises(ValueError, match="intra_threads"):
+        load_model_configs("u2net", '{"u2net": {"intra_threads": 4}}')
+
+
+def test_build_session_options():
+    """Test ModelConfig maps onto ONNX Runtime options."""
+    sess_opts = build_session_options(
+        ModelConfig("u2net", memory_mb=1, intra_op_threads=3, inter_op_threads=1, graph_optimization="basic")
+    )
+    assert sess_opts.intra_op_num_threads == 3
+    assert sess_opts.inter_op_num_threads == 1
+    assert sess_opts.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    assert sess_opts.execution_mode == ort.ExecutionMode.ORT_SEQUENTIAL
+
+
+def test_remove_bg_model_param(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test requests are routed to the model they ask for."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"model": "u2netp", "quality": "fast"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 200
+    assert fake_session.created["u2netp"].inner_session.batch_sizes == [1]
+    
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        data={"model": "not-a-model"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 400
+    assert "Invalid model" in response.json()["detail"]
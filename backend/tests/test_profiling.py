@@ -0,0 +1,74 @@
+"""Tests for stage instrumentation and opt-in profiling."""
+import io
+import os
+
+from app.config import settings
+from app.services.timing import StageTimings, size_class
+
+
+def test_size_class():
+    """Test images are bucketed into coarse size classes."""
+    assert size_class(640, 480) == "lt0.5mp"
+    assert size_class(1600, 1200) == "0.5-2mp"
+    assert size_class(4000, 3000) == "8-24mp"
+    assert size_class(8000, 6000) == "gt24mp"
+
+
+def test_stage_timings_server_timing():
+    """Test stage durations are formatted as a Server-Timing value."""
+    timings = StageTimings("fast", "u2net")
+    timings.set_image_size(640, 480)
+    with timings.stage("decode"):
+        pass
+    with timings.stage("encode"):
+        pass
+        
+    header = timings.server_timing()
+    assert header.startswith("decode;dur=")
+    assert ", encode;dur=" in header
+
+
+def test_server_timing_header_on_request(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test X-Profile adds the stage breakdown and stage metrics get size labels."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "profiled", "X-Profile": "1"},
+        data={"quality": "fast"},
+        files={"file": ("photo.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 200
+    server_timing = response.headers["Server-Timing"]
+    for stage in ("decode", "inference", "matting", "encode", "total"):
+        assert f"{stage};dur=" in server_timing
+        
+    content = client.get("/metrics").text
+    assert 'size_class="lt0.5mp"' in content
+    assert "bg_input_megapixels_count" in content
+    
+    # Not profiled unless asked for
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "profiled"},
+        files={"file": ("photo.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert "Server-Timing" not in response.headers
+
+
+def test_profile_dumps_are_written(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache,
+                                   monkeypatch, tmp_path):
+    """Test sampled requests write a cProfile dump to PROFILE_DIR."""
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILE_SAMPLE_RATE", 1.0)
+    
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "profiled"},
+        data={"quality": "fast"},
+        files={"file": ("photo.png", io.BytesIO(subject_image), "image/png")}
+    )
+    assert response.status_code == 200
+    assert "Server-Timing" in response.headers
+    
+    dumps = os.listdir(tmp_path)
+    assert len(dumps) == 1 and dumps[0].endswith(".prof")
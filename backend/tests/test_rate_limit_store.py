@@ -0,0 +1,221 @@
+"""Tests for the rate limiter storage backends."""
+import socketserver
+import threading
+
+import pytest
+
+from app.services.rate_limit_store import (
+    MemoryRateLimitStore,
+    RedisRateLimitStore,
+    SQLiteRateLimitStore,
+)
+
+DAY = 1_700_000_000
+NEXT_DAY = DAY + 86400
+
+
+class _RedisStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis server, speaking RESP, for the limiter's commands."""
+    
+    allow_reuse_address = True
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RedisHandler)
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+        
+    def _reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self._reply(item)
+        elif isinstance(value, str):
+            self.wfile.write(b"+%s\r\n" % value.encode())
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            
+    def handle(self):
+        queued = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            if command == b"MULTI":
+                queued = []
+                self._reply("OK")
+            elif command == b"EXEC":
+                with self.server.lock:
+                    self._reply([self._run(*queued_args) for queued_args in queued])
+                queued = None
+            elif queued is not None:
+                queued.append(args)
+                self._reply("QUEUED")
+            else:
+                with self.server.lock:
+                    self._reply(self._run(*args))
+                    
+    def _run(self, command, *args):
+        data = self.server.data
+        command = command.upper()
+        if command == b"GET":
+            reply = data.get(args[0])
+        elif command in (b"INCR", b"DECR"):
+            value = int(data.get(args[0], b"0")) + (1 if command == b"INCR" else -1)
+            data[args[0]] = str(value).encode()
+            reply = value
+        elif command == b"SET":
+            data[args[0]] = args[1]
+            if b"KEEPTTL" not in args:
+                self.server.expiry.pop(args[0], None)
+            reply = "OK"
+        elif command == b"EXPIREAT":
+            self.server.expiry[args[0]] = int(args[1])
+            reply = 1
+        elif command == b"PFADD":
+            data.setdefault(args[0], set()).update(args[1:])
+            reply = 1
+        elif command == b"PFCOUNT":
+            reply = len(data.get(args[0], ()))
+        elif command == b"SCAN":
+            prefix = args[2].rstrip(b"*")
+            reply = [b"0", [key for key in data if key.startswith(prefix)]]
+        elif command == b"DEL":
+            reply = sum(data.pop(key, None) is not None for key in args)
+            for key in args:
+                self.server.expiry.pop(key, None)
+        else:
+            reply = None
+        return reply
+
+
+@pytest.fixture
+def redis_server():
+    server = _RedisStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_url(redis_server):
+    return f"redis://127.0.0.1:{redis_server.server_address[1]}/0"
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryRateLimitStore()
+    if request.param == "sqlite":
+        return SQLiteRateLimitStore(str(tmp_path / "ratelimit.db"))
+    return RedisRateLimitStore(request.getfixturevalue("redis_url"))
+
+
+def test_increment_and_count(store):
+    """Test counters start at zero and increment per device."""
+    assert store.count("a", DAY) == 0
+    assert store.increment("a", DAY) == 1
+    assert store.increment("a", DAY) == 2
+    assert store.increment("b", DAY) == 1
+    assert store.count("a", DAY) == 2
+    assert store.device_count(DAY) == 2
+    
+    store.decrement("a", DAY)
+    assert store.count("a", DAY) == 1
+    
+    store.clear()
+    assert store.count("a", DAY) == 0
+
+
+def test_increment_respects_limit(store):
+    """Test a limited increment is refused at the limit without counting."""
+    assert store.increment("a", DAY, limit=2) == 1
+    assert store.increment("a", DAY, limit=2) == 2
+    assert store.increment("a", DAY, limit=2) is None
+    assert store.count("a", DAY) == 2
+
+
+def test_new_day_starts_fresh(store):
+    """Test counters from the previous day don't carry over."""
+    for _ in range(3):
+        store.increment("a", DAY)
+    assert store.count("a", NEXT_DAY) == 0
+    assert store.increment("a", NEXT_DAY, limit=3) == 1
+
+
+def test_concurrent_increments_never_exceed_limit(store):
+    """Test check-and-increment is atomic under concurrency."""
+    results = []
+    
+    def worker():
+        for _ in range(5):
+            results.append(store.increment("racer", DAY, limit=7))
+            
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        
+    assert sorted(r for r in results if r is not None) == list(range(1, 8))
+    assert store.count("racer", DAY) == 7
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    """Test two stores on the same file (e.g. two workers) share counts."""
+    path = str(tmp_path / "ratelimit.db")
+    worker_a = SQLiteRateLimitStore(path)
+    worker_b = SQLiteRateLimitStore(path)
+    
+    worker_a.increment("device", DAY, limit=2)
+    worker_b.increment("device", DAY, limit=2)
+    assert worker_a.increment("device", DAY, limit=2) is None
+    assert worker_b.count("device", DAY) == 2
+    
+    # Rolling over expires the old rows in bulk
+    worker_a.increment("other", NEXT_DAY)
+    assert worker_b.device_count(DAY) == 0
+
+
+def test_memory_store_drops_old_day_in_bulk():
+    """Test the in-process table is replaced at the daily reset."""
+    store = MemoryRateLimitStore()
+    for i in range(100):
+        store.increment(f"device-{i}", DAY)
+    assert store.device_count(DAY) == 100
+    
+    store.increment("late", NEXT_DAY)
+    assert store.device_count(NEXT_DAY) == 1
+
+
+def test_redis_keys_always_expire(redis_server, redis_url):
+    """Test every key the Redis store writes gets the day's EXPIREAT in the same transaction."""
+    store = RedisRateLimitStore(redis_url)
+    store.increment("a", DAY)
+    store.increment("a", DAY, limit=1)
+    # A refund after the counter expired recreates the key
+    store.decrement("gone", DAY)
+    
+    assert set(redis_server.data) == set(redis_server.expiry)
+    assert set(redis_server.expiry.values()) == {DAY}
+    assert store.count("gone", DAY) == 0
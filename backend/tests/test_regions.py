@@ -0,0 +1,98 @@
+"""Tests for region-of-interest and tiled processing."""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app.config import settings
+from app.services.background_remover import InvalidOptions, parse_options, remove_background_sync
+from app.services.model_registry import model_registry
+from app.services.regions import predict_tiled, scale_box, subject_box, tile_starts
+
+
+@pytest.fixture
+def panorama():
+    """A wide dark image with a bright subject near its left end."""
+    image = Image.new("RGB", (1200, 300), (10, 10, 10))
+    ImageDraw.Draw(image).ellipse((100, 60, 300, 240), fill=(250, 250, 250))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _decode(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def test_subject_box_is_padded_and_clamped():
+    """Test the box covers pixels above the threshold plus padding, within the image."""
+    mask = Image.new("L", (100, 50), 0)
+    ImageDraw.Draw(mask).rectangle((10, 5, 29, 24), fill=200)
+    
+    assert subject_box(mask, threshold=32, padding=0.0) == (10, 5, 30, 25)
+    assert subject_box(mask, threshold=32, padding=0.5) == (0, 0, 40, 35)
+    assert subject_box(mask, threshold=250, padding=0.1) is None
+
+
+def test_scale_box_rounds_outwards():
+    """Test boxes mapped to another resolution never shrink."""
+    assert scale_box((1, 1, 3, 3), (10, 10), (25, 25)) == (2, 2, 8, 8)
+
+
+def test_tile_starts_cover_with_overlap():
+    """Test tiles span the whole length and neighbours share the overlap."""
+    starts = tile_starts(1000, 300, 50)
+    assert starts[0] == 0 and starts[-1] + 300 == 1000
+    assert all(b - a <= 250 for a, b in zip(starts, starts[1:]))
+    assert tile_starts(200, 300, 50) == [0]
+
+
+def test_predict_tiled_blends_and_gates(fake_session, panorama):
+    """Test tiled masks are blended seamlessly and background tiles stay clear."""
+    image = _decode(panorama)
+    with model_registry.acquire("u2net") as batcher:
+        mask = predict_tiled(batcher, image, tile_size=300, overlap=60)
+        
+    assert mask.size == image.size
+    pixels = np.asarray(mask)
+    assert pixels[150, 200] > 200
+    # Tiles of pure background would be noise after normalisation; they're gated out
+    assert pixels[:, 800:].max() == 0
+    # Every tile went through the model, together with the whole-image pass
+    assert sum(fake_session.inner_session.batch_sizes) == 1 + len(tile_starts(1200, 300, 60))
+
+
+@pytest.mark.parametrize("region", ["roi", "tiled"])
+def test_region_modes_keep_full_canvas(fake_session, panorama, region, monkeypatch):
+    """Test only the subject area is processed and the result is placed back full size."""
+    # A small working size, so the region comes from the full-resolution decode
+    monkeypatch.setattr(settings, "WORKING_MAX_SIDE", 600)
+    monkeypatch.setattr(settings, "TILED_WORKING_MAX_SIDE", 600)
+    options = parse_options(quality="fast", output_format="png-fast", region=region)
+    
+    output = _decode(remove_background_sync(panorama, options))
+    
+    assert output.size == (1200, 300)
+    alpha = np.asarray(output.getchannel("A"))
+    assert alpha[150, 200] > 200
+    assert alpha[:, 500:].max() == 0
+
+
+def test_crop_returns_subject_only(fake_session, panorama):
+    """Test crop=true trims the output to the subject."""
+    options = parse_options(quality="fast", output_format="png-fast", region="roi", crop=True)
+    
+    output = _decode(remove_background_sync(panorama, options))
+    
+    width, height = output.size
+    assert 150 <= width <= 260 and 120 <= height <= 240
+    assert output.getchannel("A").getbbox() == (0, 0, width, height)
+
+
+def test_invalid_region_rejected():
+    """Test unknown region modes are rejected."""
+    with pytest.raises(InvalidOptions):
+        parse_options(region="everything")
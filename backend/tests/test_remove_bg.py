@@ -73,6 +73,19 @@ def test_remove_bg_rate_limited(client, sample_image, reset_rate_limiter):
     assert data["detail"]["error"] == "rate_limit_exceeded"
 
 
+def test_remove_bg_body_has_content_length(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test the encoded result is sent as the body in one piece, not streamed in chunks."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "length_device"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")},
+        data={"quality": "fast"},
+    )
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert "transfer-encoding" not in response.headers
+
+
 def test_image_info(client, sample_image):
     """Test image info endpoint."""
     response = client.post(
@@ -84,3 +97,155 @@ def test_image_info(client, sample_image):
     assert data["width"] == 100
     assert data["height"] == 100
     assert data["format"] == "PNG"
+
+
+def _sse_events(body: str) -> list:
+    import json
+    
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_remove_bg_progressive(client, fake_session, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test progressive mode streams the result (after an optional preview) as server-sent events."""
+    import base64
+    
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "progressive_device"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")},
+        data={"quality": "fast", "output_format": "png-fast", "progressive": "true"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = _sse_events(response.text)
+    names = [name for name, _ in events]
+    assert names in (["preview", "result"], ["result"])
+    result = events[-1][1]
+    assert result["media_type"] == "image/png"
+    assert result["remaining_uses"] == 4
+    assert base64.b64decode(result["data"]).startswith(b"\x89PNG")
+
+
+async def test_abandoned_progressive_request_is_refunded(monkeypatch, reset_rate_limiter):
+    """Test a client leaving before the result cancels the work and refunds the use."""
+    import asyncio
+    from app.api.v1 import remove_bg as api
+    from app.services.background_remover import RemovalOptions
+    from app.services.credits import charge_use
+    from app.services.rate_limiter import check_rate_limit
+    
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+    
+    async def never_finishes(*args, **kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+            
+    monkeypatch.setattr(api, "remove_background_cached", never_finishes)
+    monkeypatch.setattr(api, "remove_background", never_finishes)
+    
+    charge = await charge_use("leaving_device")
+    assert (await check_rate_limit("leaving_device"))[1] == 4
+    events = api._progressive_events(b"image", RemovalOptions(), "test.png", "leaving_device", charge)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(events.__anext__(), 0.1)
+    await asyncio.sleep(0)
+    
+    assert started.is_set() and cancelled.is_set()
+    assert (await check_rate_limit("leaving_device"))[1] == 5
+
+
+def test_cancelled_removal_stops_before_inference(fake_session, subject_image):
+    """Test a cancelled scope stops the pipeline at its next checkpoint."""
+    from app.services.background_remover import RemovalOptions, remove_background_sync
+    from app.services.cancellation import CancelScope, RemovalCancelled
+    
+    scope = CancelScope()
+    scope.cancel()
+    with pytest.raises(RemovalCancelled):
+        remove_background_sync(subject_image, RemovalOptions(quality="fast"), None, scope)
+
+
+def test_remove_bg_rejects_invalid_timeout_header(client, sample_image, reset_rate_limiter):
+    """Test X-Request-Timeout must be a positive number of seconds."""
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "timeout_device", "X-Request-Timeout": "soon"},
+        files={"file": ("test.png", io.BytesIO(sample_image), "image/png")},
+    )
+    assert response.status_code == 400
+
+
+def test_remove_bg_past_deadline(monkeypatch, client, subject_image, reset_rate_limiter, reset_result_cache):
+    """Test a removal still running at the request's deadline gets a 504 and is refunded."""
+    import asyncio
+    import time
+    from app.services import background_remover
+    from app.services.rate_limiter import check_rate_limit
+    
+    def slow_removal(image_bytes, options, timings, cancel):
+        while not cancel.expired:
+            time.sleep(0.01)
+        cancel.check()
+        
+    monkeypatch.setattr(background_remover, "remove_background_sync", slow_removal)
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "deadline_device", "X-Request-Timeout": "0.1"},
+        files={"file": ("test.png", io.BytesIO(subject_image), "image/png")},
+        data={"quality": "fast"},
+    )
+    assert response.status_code == 504
+    assert response.json()["detail"]["error"] == "deadline_exceeded"
+    assert asyncio.run(check_rate_limit("deadline_device"))[1] == 5
+
+
+async def test_work_is_cancelled_when_client_disconnects():
+    """Test the removal a request is waiting on is cancelled when its client goes away."""
+    import asyncio
+    from app.api.v1.remove_bg import ClientDisconnected, _unless_disconnected
+    
+    gone = asyncio.Event()
+    cancelled = asyncio.Event()
+    
+    class Request:
+        async def receive(self):
+            await gone.wait()
+            return {"type": "http.disconnect"}
+            
+    async def removal():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+            
+    waiting = asyncio.ensure_future(_unless_disconnected(Request(), removal()))
+    await asyncio.sleep(0)
+    gone.set()
+    with pytest.raises(ClientDisconnected):
+        await waiting
+    await asyncio.sleep(0)
+    assert cancelled.is_set()
+
+
+def test_removal_stops_at_deadline(fake_session, subject_image):
+    """Test work that waited past its deadline is dropped before it starts."""
+    import time
+    from app.services.background_remover import RemovalOptions, remove_background_sync
+    from app.services.cancellation import CancelScope, DeadlineExceeded
+    from app.services.timing import StageTimings
+    
+    timings = StageTimings("fast", "u2net")
+    with pytest.raises(DeadlineExceeded):
+        remove_background_sync(subject_image, RemovalOptions(quality="fast"), timings, CancelScope(time.monotonic()))
+    assert not timings.durations
@@ -0,0 +1,142 @@
+"""Tests for the result cache."""
+import io
+import os
+import threading
+
+from app.config import settings
+from app.services.result_cache import ResultCache, cache_key
+
+
+def test_cache_key_depends_on_params():
+    """Test the key changes with the bytes or the processing parameters."""
+    params = {"model": "u2net", "output_format": "png"}
+    key = cache_key(b"image", params)
+    
+    assert key == cache_key(b"image", dict(reversed(list(params.items()))))
+    assert key != cache_key(b"other", params)
+    assert key != cache_key(b"image", {**params, "model": "u2netp"})
+
+
+async def test_memory_lru_evicts_by_bytes():
+    """Test least recently used entries are evicted once over budget."""
+    cache = ResultCache(max_bytes=10)
+    await cache.put("a", b"aaaa")
+    await cache.put("b", b"bbbb")
+    assert await cache.get("a") == b"aaaa"  # "b" is now least recently used
+    
+    await cache.put("c", b"cccc")
+    
+    assert await cache.get("b") is None
+    assert await cache.get("a") == b"aaaa"
+    assert await cache.get("c") == b"cccc"
+    assert cache.size == 8
+
+
+async def test_oversized_values_skip_memory():
+    """Test a value larger than the budget doesn't flush the cache."""
+    cache = ResultCache(max_bytes=10)
+    await cache.put("a", b"aaaa")
+    await cache.put("huge", b"x" * 20)
+    
+    assert await cache.get("huge") is None
+    assert await cache.get("a") == b"aaaa"
+
+
+async def test_disk_tier_survives_restart(tmp_path):
+    """Test results written to disk are found by a fresh cache."""
+    cache = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+    await cache.put("abcdef", b"result")
+    
+    restarted = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+    assert len(restarted) == 0
+    assert await restarted.get("abcdef") == b"result"
+    # Promoted into memory on hit
+    assert len(restarted) == 1
+
+
+async def test_disk_tier_is_bounded(tmp_path):
+    """Test the disk tier prunes old files beyond its budget."""
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10)
+    await cache.put("aa01", b"1234")
+    await cache.put("aa02", b"5678")
+    await cache.put("aa03", b"9012")
+    
+    files = [p for p in tmp_path.rglob("*") if p.is_file()]
+    assert sum(p.stat().st_size for p in files) <= 10
+
+
+async def test_disk_tier_evicts_least_recently_used(tmp_path):
+    """Test pruning removes the files read least recently, not the oldest written."""
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10)
+    await cache.put("aa01", b"1234")
+    await cache.put("aa02", b"5678")
+    os.utime(cache._disk_path("aa01"), (1, 1))
+    os.utime(cache._disk_path("aa02"), (2, 2))
+    assert await cache.get("aa01") == b"1234"
+    
+    await cache.put("aa03", b"9012")
+    assert await cache.get("aa02") is None
+    assert await cache.get("aa01") == b"1234"
+    assert await cache.get("aa03") == b"9012"
+
+
+async def test_disk_tier_skips_oversized_and_existing_values(tmp_path):
+    """Test values over the disk budget aren't written, and existing files aren't rewritten."""
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=8)
+    await cache.put("bb01", b"x" * 9)
+    assert not os.path.exists(cache._disk_path("bb01"))
+    
+    await cache.put("bb02", b"first")
+    await cache.put("bb02", b"again")
+    assert await cache.get("bb02") == b"first"
+
+
+async def test_disk_tier_runs_off_the_event_loop(tmp_path, monkeypatch):
+    """Test disk reads and writes happen on a worker thread."""
+    cache = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+    threads = []
+    for name in ("_read_disk", "_write_disk"):
+        original = getattr(cache, name)
+        
+        def record(*args, original=original):
+            threads.append(threading.current_thread())
+            return original(*args)
+            
+        monkeypatch.setattr(cache, name, record)
+        
+    await cache.put("cc01", b"value")
+    cache.clear()
+    assert await cache.get("cc01") == b"value"
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_repeat_upload_is_served_from_cache(
+    client, fake_session, subject_image, reset_rate_limiter, reset_result_cache, monkeypatch
+):
+    """Test a re-upload skips processing and follows the charging policy."""
+    monkeypatch.setattr(settings, "RESULT_CACHE_CHARGE_HITS", False)
+    
+    def upload():
+        return client.post(
+            "/api/v1/remove-bg",
+            headers={"X-Device-ID": "cache_device"},
+            files={"file": ("test.png", io.BytesIO(subject_image), "image/png")}
+        )
+        
+    first = upload()
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    assert first.headers["X-Remaining-Uses"] == "4"
+    
+    second = upload()
+    assert second.status_code == 200
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.content == first.content
+    assert second.headers["X-Remaining-Uses"] == "4"
+    assert fake_session.inner_session.batch_sizes == [1]
+    
+    monkeypatch.setattr(settings, "RESULT_CACHE_CHARGE_HITS", True)
+    third = upload()
+    assert third.headers["X-Cache"] == "HIT"
+    assert third.headers["X-Remaining-Uses"] == "3"
@@ -0,0 +1,60 @@
+"""Tests for the multi-process launcher."""
+import os
+
+import pytest
+
+from app import serve
+from app.config import settings
+
+
+def test_prepare_metrics_dir_clears_the_last_run(tmp_path, monkeypatch):
+    """Test metric files from a previous run are removed and the directory is exported."""
+    path = tmp_path / "metrics"
+    path.mkdir()
+    (path / "counter_1234.db").write_bytes(b"stale")
+    (path / "README").write_text("kept")
+    monkeypatch.setattr(settings, "PROMETHEUS_MULTIPROC_DIR", str(path))
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "")
+    
+    assert serve.prepare_metrics_dir() == str(path)
+    assert os.listdir(path) == ["README"]
+    assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(path)
+
+
+def test_prepare_metrics_dir_defaults_to_a_temporary_directory(monkeypatch):
+    """Test a directory is created when none is configured, and recorded in the settings."""
+    monkeypatch.setattr(settings, "PROMETHEUS_MULTIPROC_DIR", "")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "")
+    
+    path = serve.prepare_metrics_dir()
+    try:
+        assert os.path.isdir(path)
+        assert settings.PROMETHEUS_MULTIPROC_DIR == os.environ["PROMETHEUS_MULTIPROC_DIR"] == path
+    finally:
+        os.rmdir(path)
+
+
+def test_single_worker_runs_uvicorn_in_process(monkeypatch):
+    """Test one HTTP worker without inference processes is a plain uvicorn server."""
+    served = []
+    
+    class FakeServer:
+        def __init__(self, config):
+            self.config = config
+            
+        def run(self, sockets=None):
+            served.append(self.config.app)
+            
+    monkeypatch.setattr(serve.uvicorn, "Server", FakeServer)
+    monkeypatch.setattr(settings, "SERVE_HTTP_WORKERS", 1)
+    monkeypatch.setattr(settings, "INFERENCE_PROCESSES", 0)
+    serve.main()
+    assert served == ["app.main:app"]
+
+
+def test_several_workers_need_a_shared_job_store(monkeypatch):
+    """Test the launcher refuses to split in-memory batch jobs between processes."""
+    monkeypatch.setattr(settings, "SERVE_HTTP_WORKERS", 2)
+    monkeypatch.setattr(settings, "JOB_STORE", "memory")
+    with pytest.raises(SystemExit, match="JOB_STORE=sqlite"):
+        serve.main()
@@ -0,0 +1,155 @@
+"""Tests for ONNX Runtime session tuning, graph caching and INT8 variants."""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+from rembg.sessions.u2net import U2netSession
+
+from app.services.model_registry import (
+    ModelConfig,
+    available_cpus,
+    create_session,
+    default_intra_op_threads,
+    load_model_configs,
+    quantized_model_path,
+    rembg_session_classes,
+)
+
+onnx = pytest.importorskip("onnx")
+
+
+def _write_tiny_model(path: str):
+    """A one-conv stand-in for u2net with the same input and output layout."""
+    from onnx import TensorProto, helper, numpy_helper
+    
+    rng = np.random.default_rng(0)
+    weight = numpy_helper.from_array(rng.normal(0, 0.3, (1, 3, 3, 3)).astype(np.float32), "weight")
+    bias = numpy_helper.from_array(np.zeros(1, dtype=np.float32), "bias")
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["input.1", "weight", "bias"], ["conv"], pads=[1, 1, 1, 1]),
+            helper.make_node("Sigmoid", ["conv"], ["output"]),
+        ],
+        "tiny",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["batch_size", 3, 320, 320])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch_size", 1, 320, 320])],
+        initializer=[weight, bias],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+@pytest.fixture
+def tiny_model(tmp_path, monkeypatch):
+    """Serve the tiny model as u2net."""
+    path = str(tmp_path / "u2net.onnx")
+    _write_tiny_model(path)
+    
+    class TinySession(U2netSession):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return path
+            
+    monkeypatch.setitem(rembg_session_classes(), "u2net", TinySession)
+    return path
+
+
+def test_default_intra_op_threads():
+    """Test CPUs are divided between processes and concurrent runs."""
+    assert default_intra_op_threads(cpus=8, processes=2, concurrent_runs=2) == 2
+    assert default_intra_op_threads(cpus=8, processes=1, concurrent_runs=1) == 8
+    assert default_intra_op_threads(cpus=2, processes=4, concurrent_runs=2) == 1
+    assert available_cpus() >= 1
+
+
+def test_configs_get_thread_and_variant_defaults():
+    """Test settings-level defaults apply unless overridden per model."""
+    configs = load_model_configs(
+        "u2net,u2netp", '{"u2netp": {"intra_op_threads": 1}}', intra_op_threads=3, variant="int8"
+    )
+    assert configs["u2net"].intra_op_threads == 3
+    assert configs["u2net"].inter_op_threads == 1
+    assert configs["u2net"].variant == "int8"
+    assert configs["u2netp"].intra_op_threads == 1
+    
+    with pytest.raises(ValueError):
+        load_model_configs("u2net", '{"u2net": {"variant": "fp8"}}')
+
+
+def test_optimized_graph_is_cached(tiny_model, tmp_path):
+    """Test the first load saves the optimized graph and later loads reuse it."""
+    cache_dir = str(tmp_path / "optimized")
+    config = ModelConfig("u2net", memory_mb=1, intra_op_threads=1)
+    
+    first = create_session(config, graph_cache_dir=cache_dir)
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1 and cached[0].startswith("u2net.fp32.")
+    
+    second = create_session(config, graph_cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == cached
+    
+    image = Image.effect_noise((64, 48), 64).convert("RGB")
+    assert np.array_equal(np.array(first.predict(image)[0]), np.array(second.predict(image)[0]))
+
+
+def test_int8_variant(tiny_model, tmp_path):
+    """Test the int8 variant must be generated, then loads and predicts."""
+    from app.services.quantization import quantize_model
+    
+    config = ModelConfig("u2net", memory_mb=1, variant="int8")
+    with pytest.raises(FileNotFoundError):
+        create_session(config, graph_cache_dir="")
+        
+    images = [Image.effect_noise((64, 64), 40 + i * 10).convert("RGB") for i in range(4)]
+    quantize_model("u2net", tiny_model, quantized_model_path(tiny_model), images)
+    
+    session = create_session(config, graph_cache_dir="")
+    mask = session.predict(images[0])[0]
+    assert mask.size == (64, 64)
+
+
+def test_quantized_model_matches_fp32(tiny_model, tmp_path):
+    """Test quantization writes a QDQ graph whose masks stay close to the fp32 model's."""
+    import onnxruntime as ort
+    from app.services.quantization import preprocess, quantize_model
+    
+    images = [Image.effect_noise((64, 64), 40 + i * 10).convert("RGB") for i in range(4)]
+    output_path = str(tmp_path / "tiny.int8.onnx")
+    quantize_model("u2net", tiny_model, output_path, images)
+    assert sorted(os.listdir(tmp_path)) == ["tiny.int8.onnx", "u2net.onnx"]
+    
+    graph = onnx.load(output_path).graph
+    assert {"QuantizeLinear", "DequantizeLinear"} <= {node.op_type for node in graph.node}
+    
+    tensor = preprocess(images[0], "u2net")
+    assert tensor.shape == (1, 3, 320, 320) and tensor.dtype == np.float32
+    fp32, int8 = (
+        ort.InferenceSession(path, providers=["CPUExecutionProvider"]).run(None, {"input.1": tensor})[0]
+        for path in (tiny_model, output_path)
+    )
+    assert np.abs(fp32 - int8).max() < 0.05
+
+
+def test_quantization_command(tiny_model, tmp_path, capsys):
+    """Test the command calibrates on a directory of samples and writes the int8 variant."""
+    from app.services.quantization import load_calibration_images, main
+    
+    samples = tmp_path / "samples"
+    samples.mkdir()
+    for i, name in enumerate(["b.png", "a.jpg", "c.webp"]):
+        Image.effect_noise((32, 32), 50 + i * 10).convert("RGB").save(samples / name)
+    (samples / "notes.txt").write_text("not an image")
+    assert [os.path.basename(image.filename) for image in load_calibration_images(str(samples), 2)] == [
+        "a.jpg", "b.png"
+    ]
+    
+    main(["u2net", "--calibration-dir", str(samples)])
+    assert os.path.exists(quantized_model_path(tiny_model))
+    assert "with 3 calibration images" in capsys.readouterr().out
+    
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    with pytest.raises(SystemExit):
+        main(["u2net", "--calibration-dir", str(empty)])
@@ -0,0 +1,138 @@
+"""Tests for coalescing identical in-flight removals."""
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services import background_remover
+from app.services.background_remover import parse_options, remove_background
+from app.services.single_flight import SingleFlight
+
+
+async def test_identical_calls_share_one_run():
+    """Test concurrent calls with one key run the work once."""
+    flight = SingleFlight()
+    calls = []
+    
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"result"
+        
+    results = await asyncio.gather(*(flight.run("key", work) for _ in range(3)))
+    
+    assert calls == [1]
+    assert [result for result, _ in results] == [b"result"] * 3
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert len(flight) == 0
+    
+    # Nothing is remembered once the work is done
+    assert await flight.run("key", work) == (b"result", False)
+    assert calls == [1, 1]
+
+
+async def test_errors_reach_every_waiter():
+    """Test a failure is raised to all callers and the next call retries."""
+    flight = SingleFlight()
+    
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad image")
+        
+    results = await asyncio.gather(flight.run("key", boom), flight.run("key", boom), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flight) == 0
+
+
+async def test_cancelled_caller_does_not_cancel_work():
+    """Test a disconnecting caller leaves the shared computation running."""
+    flight = SingleFlight()
+    
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+        
+    first = asyncio.ensure_future(flight.run("key", work))
+    second = asyncio.ensure_future(flight.run("key", work))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    
+    assert await second == ("done", True)
+
+
+async def test_work_is_cancelled_when_every_caller_leaves():
+    """Test the shared computation is abandoned once nobody is waiting for it."""
+    flight = SingleFlight()
+    finished = []
+    
+    async def work():
+        await asyncio.sleep(0.2)
+        finished.append(1)
+        
+    callers = [asyncio.ensure_future(flight.run("key", work)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    for caller in callers:
+        caller.cancel()
+    await asyncio.sleep(0.3)
+    
+    assert finished == []
+    assert len(flight) == 0
+
+
+async def test_caller_after_cancellation_starts_fresh_work():
+    """Test a call arriving just after the last waiter left doesn't join the dying work."""
+    flight = SingleFlight()
+    
+    async def work():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            # Cleanup that outlives the cancel request
+            await asyncio.sleep(0.01)
+            raise
+        return "done"
+        
+    caller = asyncio.ensure_future(flight.run("key", work))
+    await asyncio.sleep(0.01)
+    caller.cancel()
+    await asyncio.sleep(0)
+    
+    assert await flight.run("key", work) == ("done", False)
+
+
+@pytest.fixture
+def slow_removal(monkeypatch):
+    """Make remove_background_sync slow enough for requests to overlap, and count calls."""
+    calls = []
+    
+    def fake_sync(image_bytes, options, timings=None, cancel=None):
+        calls.append(options.quality)
+        time.sleep(0.1)
+        return image_bytes[::-1]
+        
+    monkeypatch.setattr(background_remover, "remove_background_sync", fake_sync)
+    return calls
+
+
+async def test_remove_background_coalesces(slow_removal):
+    """Test identical concurrent removals run one inference."""
+    fast = parse_options(quality="fast")
+    results = await asyncio.gather(
+        remove_background(b"image", fast),
+        remove_background(b"image", fast),
+        remove_background(b"image", parse_options(quality="best")),
+        remove_background(b"other", fast),
+    )
+    
+    assert results == [b"egami", b"egami", b"egami", b"rehto"]
+    assert sorted(slow_removal) == ["best", "fast", "fast"]
+
+
+async def test_coalescing_can_be_disabled(slow_removal, monkeypatch):
+    """Test every request does its own work with COALESCE_REQUESTS off."""
+    monkeypatch.setattr(settings, "COALESCE_REQUESTS", False)
+    
+    await asyncio.gather(*(remove_background(b"image", parse_options()) for _ in range(3)))
+    
+    assert len(slow_removal) == 3
@@ -0,0 +1,121 @@
+"""Tests for streaming upload handling."""
+import io
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from app.config import settings
+from app.services.uploads import (
+    InvalidImage,
+    UploadTooLarge,
+    read_upload,
+    sniff_image_header,
+)
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="test.png", size=len(data))
+
+
+class _CountingFile(io.BytesIO):
+    """BytesIO that records how many bytes were read."""
+    
+    bytes_read = 0
+    
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+async def test_sniff_reads_only_the_header():
+    """Test header sniffing stops after the first chunk."""
+    noise = Image.merge("RGB", [Image.effect_noise((600, 400), 80) for _ in range(3)])
+    buffer = io.BytesIO()
+    noise.save(buffer, format="PNG")
+    raw = _CountingFile(buffer.getvalue())
+    
+    header = await sniff_image_header(UploadFile(file=raw, filename="big.png"))
+    
+    assert (header.width, header.height, header.format) == (600, 400, "PNG")
+    assert raw.bytes_read <= 64 * 1024 < len(buffer.getvalue())
+    assert raw.tell() == 0
+
+
+async def test_sniff_rejects_non_images():
+    """Test random bytes are not accepted as an image."""
+    with pytest.raises(InvalidImage):
+        await sniff_image_header(_upload(b"\x00" * 1000))
+
+
+async def test_read_upload_stops_at_limit():
+    """Test reading stops once the limit is crossed."""
+    assert await read_upload(_upload(b"x" * 100), max_bytes=100) == b"x" * 100
+    
+    unsized = UploadFile(file=io.BytesIO(b"x" * 200_000), filename="a.png")
+    with pytest.raises(UploadTooLarge):
+        await read_upload(unsized, max_bytes=100_000)
+
+
+def test_image_info_from_truncated_upload(client, large_image):
+    """Test /image-info answers from the header even if the pixels are cut off."""
+    truncated = large_image[:200]
+    response = client.post(
+        "/api/v1/image-info",
+        files={"file": ("test.png", io.BytesIO(truncated), "image/png")}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["width"], data["height"], data["format"]) == (2000, 2000, "PNG")
+    assert data["size_bytes"] == 200
+
+
+def test_image_info_invalid(client):
+    """Test /image-info rejects files that aren't images."""
+    response = client.post(
+        "/api/v1/image-info",
+        files={"file": ("test.png", io.BytesIO(b"hello"), "image/png")}
+    )
+    assert response.status_code == 400
+
+
+def test_remove_bg_file_too_large(client, sample_image, reset_rate_limiter, monkeypatch):
+    """Test uploads over MAX_FILE_SIZE_MB are rejected."""
+    monkeypatch.setattr(settings, "MAX_FILE_SIZE_MB", 0)
+    response = client.post(
+        "/api/v1/remove-bg",
+        headers={"X-Device-ID": "test_device"},
+        files={"file": ("test.png", io.BytesIO(sample_image), "image/png")}
+    )
+    assert response.status_code == 400
+    assert "too large" in response.json()["detail"]
+
+
+def test_body_limit_by_content_length(client):
+    """Test a declared oversized body is refused before it is read."""
+    too_big = settings.MAX_FILE_SIZE_MB * 1024 * 1024 + 128 * 1024
+    response = client.post(
+        "/api/v1/image-info",
+        headers={"Content-Length": str(too_big), "Content-Type": "application/octet-stream"},
+        content=b"",
+    )
+    assert response.status_code == 413
+
+
+def test_body_limit_while_streaming(client):
+    """Test a chunked body is cut off once it crosses the limit."""
+    sent = []
+    chunk = b"x" * (1024 * 1024)
+    
+    def body():
+        for _ in range(settings.MAX_FILE_SIZE_MB + 5):
+            sent.append(len(chunk))
+            yield chunk
+            
+    response = client.post(
+        "/api/v1/image-info",
+        headers={"Content-Type": "multipart/form-data; boundary=xyz"},
+        content=body(),
+    )
+    assert response.status_code == 413
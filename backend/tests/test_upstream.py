@@ -0,0 +1,201 @@
+"""Tests for the upstream HTTP client, against a local mock server."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.upstream import CircuitBreaker, CircuitOpen, RetryBudget, UpstreamClient, UpstreamError
+
+
+class MockServer:
+    """Serves scripted (status, body) responses in order, then the last one forever."""
+    
+    def __init__(self):
+        self.responses = [(200, {"ok": True})]
+        self.requests = []
+        self.delay = 0.0
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._reply(body)
+                
+            def do_GET(self):
+                self._reply(b"")
+                
+            def _reply(self, body: bytes):
+                server.requests.append((self.command, self.path, dict(self.headers), body, self.client_address[1]))
+                time.sleep(server.delay)
+                status, payload = server.responses.pop(0) if len(server.responses) > 1 else server.responses[0]
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                
+            def log_message(self, *args):
+                pass
+                
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer()
+    yield server
+    server.close()
+
+
+def _client(server, **kwargs):
+    kwargs.setdefault("backoff", 0.001)
+    return UpstreamClient("mock", server.url, **kwargs)
+
+
+async def test_connections_are_reused(mock_server):
+    """Test sequential calls share one keep-alive connection."""
+    client = _client(mock_server)
+    try:
+        for _ in range(3):
+            response = await client.request("GET", "/ping")
+            assert response.json() == {"ok": True}
+    finally:
+        await client.close()
+    assert len({request[4] for request in mock_server.requests}) == 1
+
+
+async def test_transient_errors_are_retried(mock_server):
+    """Test 5xx responses to idempotent calls are retried until success."""
+    mock_server.responses = [(503, {}), (502, {}), (200, {"id": "ok"})]
+    client = _client(mock_server, max_retries=2)
+    try:
+        response = await client.request("GET", "/thing")
+    finally:
+        await client.close()
+    assert response.json() == {"id": "ok"}
+    assert len(mock_server.requests) == 3
+
+
+async def test_unsafe_calls_and_client_errors_are_not_retried(mock_server):
+    """Test a POST isn't repeated after a server error, nor any call after a 4xx."""
+    client = _client(mock_server)
+    try:
+        mock_server.responses = [(500, {}), (200, {})]
+        with pytest.raises(UpstreamError) as error:
+            await client.request("POST", "/charge", json={})
+        assert error.value.status_code == 500
+        
+        mock_server.responses = [(404, {}), (200, {})]
+        with pytest.raises(UpstreamError):
+            await client.request("GET", "/missing")
+    finally:
+        await client.close()
+    assert len(mock_server.requests) == 2
+
+
+async def test_timeouts_are_per_attempt(mock_server):
+    """Test a slow upstream times out instead of hanging the caller."""
+    mock_server.delay = 0.5
+    client = _client(mock_server, timeout=0.05, max_retries=0)
+    try:
+        started = time.perf_counter()
+        with pytest.raises(UpstreamError):
+            await client.request("GET", "/slow")
+        assert time.perf_counter() - started < 0.4
+    finally:
+        await client.close()
+
+
+async def test_retry_budget_limits_retries(mock_server):
+    """Test retries stop once the budget for recent traffic is spent."""
+    mock_server.responses = [(503, {})]
+    client = _client(mock_server, max_retries=5, budget=RetryBudget(ratio=0, min_retries=2))
+    try:
+        with pytest.raises(UpstreamError):
+            await client.request("GET", "/down")
+    finally:
+        await client.close()
+    assert len(mock_server.requests) == 3
+
+
+async def test_circuit_opens_and_recovers(mock_server):
+    """Test the breaker fails fast while open and closes after a good trial call."""
+    mock_server.responses = [(500, {}), (500, {}), (200, {})]
+    breaker = CircuitBreaker("mock", failure_threshold=2, reset_timeout=0.1)
+    client = _client(mock_server, max_retries=0, breaker=breaker)
+    try:
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await client.request("GET", "/flaky")
+        with pytest.raises(CircuitOpen):
+            await client.request("GET", "/flaky")
+        assert len(mock_server.requests) == 2
+        
+        time.sleep(0.15)
+        assert (await client.request("GET", "/flaky")).status_code == 200
+        assert breaker.state == "closed"
+    finally:
+        await client.close()
+
+
+async def test_cancelled_trial_call_does_not_jam_the_breaker(mock_server):
+    """Test a half-open trial call that is cancelled lets the next call try again."""
+    import asyncio
+    
+    breaker = CircuitBreaker("mock", failure_threshold=1, reset_timeout=0.05)
+    client = _client(mock_server, max_retries=0, breaker=breaker)
+    try:
+        breaker.record_failure()
+        time.sleep(0.1)
+        mock_server.delay = 0.5
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await client.request("GET", "/trial")
+        assert breaker.state == "half_open"
+        
+        mock_server.delay = 0
+        assert (await client.request("GET", "/trial")).status_code == 200
+        assert breaker.state == "closed"
+    finally:
+        await client.close()
+
+
+def test_create_checkout_uses_pooled_client(client, mock_server, monkeypatch):
+    """Test create-checkout goes through the upstream client and maps failures."""
+    from app.api.v1 import payment
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "CREEM_API_KEY", "creem_test_key")
+    monkeypatch.setattr(settings, "CREEM_PRODUCT_IDS", '{"starter_50": "prod_1"}')
+    monkeypatch.setattr(payment, "creem_client", UpstreamClient(
+        "creem", mock_server.url, headers={"Authorization": "Bearer creem_test_key"},
+        backoff=0.001, breaker=CircuitBreaker("creem", failure_threshold=3, reset_timeout=60),
+    ))
+    body = {"product_sku": "starter_50", "device_id": "buyer", "success_url": "s", "cancel_url": "c"}
+    
+    mock_server.responses = [(503, {}), (200, {"id": "ch_1", "checkout_url": "https://pay/ch_1"})]
+    response = client.post("/api/v1/payment/create-checkout", json=body)
+    assert response.status_code == 200
+    assert response.json() == {"checkout_url": "https://pay/ch_1", "checkout_id": "ch_1"}
+    method, path, headers, sent, _ = mock_server.requests[-1]
+    assert (method, path) == ("POST", "/v1/checkouts")
+    assert headers["Authorization"] == "Bearer creem_test_key"
+    assert json.loads(sent)["metadata"]["device_id"] == "buyer"
+    
+    mock_server.responses = [(500, {})]
+    assert client.post("/api/v1/payment/create-checkout", json=body).status_code == 502
+    response = client.post("/api/v1/payment/create-checkout", json=body)
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,163 @@
+"""Tests for webhook journaling and batch processing."""
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from app.services.webhooks import WebhookJournal, WebhookProcessor
+
+SECRET = "whsec_test"
+
+
+def _checkout_event(event_id: str, order_id: str, device_id: str, product_sku: str = "starter_50") -> bytes:
+    return json.dumps({
+        "id": event_id,
+        "type": "checkout.completed",
+        "data": {
+            "id": f"ch_{order_id}",
+            "order": {"id": order_id},
+            "amount": 299,
+            "currency": "USD",
+            "metadata": {"device_id": device_id, "product_sku": product_sku},
+        },
+    }).encode()
+
+
+def _sign(payload: bytes) -> str:
+    return "sha256=" + hmac.new(SECRET.encode(), payload, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """The shared webhook journal, reopened on an empty file."""
+    from app.config import settings
+    from app.services.webhooks import webhook_journal
+    
+    monkeypatch.setattr(settings, "WEBHOOK_JOURNAL_PATH", str(tmp_path / "webhooks.db"))
+    webhook_journal.close()
+    yield webhook_journal
+    webhook_journal.close()
+
+
+@pytest.fixture
+def signed(monkeypatch):
+    from app.config import settings
+    
+    monkeypatch.setattr(settings, "CREEM_WEBHOOK_SECRET", SECRET)
+
+
+def test_journal_keeps_entries_until_removed(tmp_path):
+    """Test the journal survives reopening and hands out entries oldest first."""
+    path = str(tmp_path / "webhooks.db")
+    journal = WebhookJournal(path)
+    first = journal.append("evt_1", "checkout.completed", b"{}")
+    journal.append("evt_2", "checkout.completed", b"{}")
+    
+    reopened = WebhookJournal(path)
+    assert [entry.event_key for entry in reopened.pending(10, 3)] == ["evt_1", "evt_2"]
+    reopened.remove([first])
+    reopened.record_failure(first + 1, "boom")
+    assert [entry.attempts for entry in reopened.pending(10, 3)] == [1]
+    assert reopened.pending(10, 1) == []
+
+
+async def test_journal_opens_on_start(tmp_path, ledger, monkeypatch):
+    """Test the journal file is only created once the processor starts, at the configured path."""
+    from app.config import settings
+    
+    path = tmp_path / "journal" / "webhooks.db"
+    path.parent.mkdir()
+    monkeypatch.setattr(settings, "WEBHOOK_JOURNAL_PATH", str(path))
+    journal = WebhookJournal()
+    processor = WebhookProcessor(journal, ledger, handler=None)
+    assert not path.exists()
+    
+    await processor.start()
+    try:
+        assert path.exists()
+        assert journal.count() == 0
+    finally:
+        await processor.stop()
+        journal.close()
+
+
+def test_webhook_requires_valid_signature(client, journal, signed):
+    """Test unsigned or mis-signed webhooks are rejected and not journaled."""
+    payload = _checkout_event("evt_x", "ord_x", "mallory")
+    assert client.post("/api/v1/payment/webhooks/creem", content=payload).status_code == 401
+    response = client.post(
+        "/api/v1/payment/webhooks/creem", content=payload, headers={"X-Creem-Signature": "sha256=bad"}
+    )
+    assert response.status_code == 401
+    assert journal.count() == 0
+
+
+async def test_webhook_is_journaled_then_applied_once(client, journal, ledger, signed):
+    """Test a delivery is acknowledged before it's applied, and replays are no-ops."""
+    from app.api.v1.payment import webhook_processor
+    
+    payload = _checkout_event("evt_1", "ord_1", "buyer")
+    for _ in range(3):
+        response = client.post(
+            "/api/v1/payment/webhooks/creem", content=payload, headers={"X-Creem-Signature": _sign(payload)}
+        )
+        assert response.status_code == 200
+    assert journal.count() == 3
+    assert (await ledger.balance("buyer", fresh=True)).credits == 0
+    
+    assert await webhook_processor.drain() == 1
+    assert journal.count() == 0
+    assert (await ledger.balance("buyer", fresh=True)).credits == 50
+    
+    # A later redelivery is dropped by the idempotency table
+    client.post("/api/v1/payment/webhooks/creem", content=payload, headers={"X-Creem-Signature": _sign(payload)})
+    assert await webhook_processor.drain() == 0
+    assert (await ledger.balance("buyer", fresh=True)).credits == 50
+
+
+async def test_batch_looks_up_idempotency_once(tmp_path, ledger):
+    """Test a whole batch is deduped with one lookup and applied in order."""
+    journal = WebhookJournal(str(tmp_path / "webhooks.db"))
+    applied, lookups = [], []
+    original = ledger.seen_events
+    
+    async def counting_seen_events(keys):
+        lookups.append(set(keys))
+        return await original(keys)
+        
+    async def handler(event):
+        applied.append(event["id"])
+        
+    ledger.seen_events = counting_seen_events
+    try:
+        await ledger.record_events([("evt_0", "checkout.completed")])
+        for i in range(5):
+            journal.append(f"evt_{i}", "checkout.completed", json.dumps({"id": f"evt_{i}"}).encode())
+        processor = WebhookProcessor(journal, ledger, handler, batch_size=10)
+        assert await processor.drain() == 4
+    finally:
+        del ledger.seen_events
+    assert applied == ["evt_1", "evt_2", "evt_3", "evt_4"]
+    assert lookups == [{f"evt_{i}" for i in range(5)}]
+
+
+async def test_failed_events_stay_journaled(tmp_path, ledger):
+    """Test a failing event is kept for retry while the rest of the batch is applied."""
+    journal = WebhookJournal(str(tmp_path / "webhooks.db"))
+    attempts = []
+    
+    async def handler(event):
+        attempts.append(event["id"])
+        if event["id"] == "evt_bad" and attempts.count("evt_bad") < 2:
+            raise RuntimeError("database down")
+            
+    journal.append("evt_bad", "checkout.completed", b'{"id": "evt_bad"}')
+    journal.append("evt_good", "checkout.completed", b'{"id": "evt_good"}')
+    processor = WebhookProcessor(journal, ledger, handler, max_attempts=3)
+    
+    assert await processor.drain() == 1
+    assert [entry.attempts for entry in journal.pending(10, 3)] == [1]
+    assert await processor.drain() == 1
+    assert journal.count() == 0
+    assert await ledger.seen_events({"evt_bad", "evt_good"}) == {"evt_bad", "evt_good"}